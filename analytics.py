@@ -0,0 +1,174 @@
+# analytics.py
+"""
+Portfolio analytics over transaction histories.
+
+Each user's transactions are held as NumPy columns (type, chain and
+wallet codes, amount, gas, timestamp) and the rollups are vectorized
+group-bys over them. The columns are cached per user and extended in
+place when the log grows, so a refresh only parses the new records.
+"""
+import threading
+
+import numpy as np
+
+from storage import get_backend
+
+TX_TYPES = (
+    "onramp", "offramp", "transfer_sent", "transfer_received", "contract_call",
+    "nft_mint", "nft_transfer", "nft_received", "nft_burn", "nft_listed",
+    "nft_purchase", "nft_sold",
+)
+# Direction of the amount field for each type: money in (+1), out (-1), or
+# not a cash flow (0, e.g. a listing's asking price). Gas is always paid out.
+FLOW_SIGN = {"onramp": 1, "offramp": -1, "transfer_sent": -1, "transfer_received": 1,
+             "nft_purchase": -1, "nft_sold": 1}
+NFT_TYPES = ("nft_mint", "nft_transfer", "nft_received", "nft_burn", "nft_listed", "nft_purchase", "nft_sold")
+
+
+class _Codes:
+    """Dense integer codes for the distinct values of one column."""
+
+    def __init__(self, values=()):
+        self.values = []
+        self.index = {}
+        for value in values:
+            self.code(value)
+
+    def code(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class TransactionColumns:
+    """Append-only columnar copy of one user's transaction log."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.version = None
+        self.types = _Codes(TX_TYPES)
+        self.chains = _Codes()
+        self.wallets = _Codes()
+        self.type = np.empty(0, dtype=np.int16)
+        self.chain = np.empty(0, dtype=np.int32)
+        self.wallet = np.empty(0, dtype=np.int32)
+        self.amount = np.empty(0)
+        self.gas = np.empty(0)
+        self.ts = np.empty(0, dtype="datetime64[us]")
+
+    def __len__(self):
+        return len(self.type)
+
+    def refresh(self):
+        """Append whatever the log gained since the last refresh."""
+        backend = get_backend()
+        version = backend.transactions_version(self.user_id)
+        if version == self.version:
+            return
+        types, chains, wallets, amounts, gas, ts = [], [], [], [], [], []
+        for tx in backend.iter_transactions(self.user_id, len(self)):
+            types.append(self.types.code(tx.get("type")))
+            chains.append(self.chains.code(tx.get("chain")))
+            wallets.append(self.wallets.code(tx.get("wallet")))
+            amounts.append(tx.get("amount") or 0)
+            gas.append(tx.get("gas_fee") or 0)
+            ts.append(tx.get("timestamp") or "NaT")
+        if types:
+            self.type = np.concatenate([self.type, np.array(types, dtype=np.int16)])
+            self.chain = np.concatenate([self.chain, np.array(chains, dtype=np.int32)])
+            self.wallet = np.concatenate([self.wallet, np.array(wallets, dtype=np.int32)])
+            self.amount = np.concatenate([self.amount, np.array(amounts, dtype=float)])
+            self.gas = np.concatenate([self.gas, np.array(gas, dtype=float)])
+            self.ts = np.concatenate([self.ts, np.array(ts, dtype="datetime64[us]")])
+        self.version = version
+
+    def by_type(self, table, default=0):
+        """Per-row table[type] as an array, looked up once per distinct type."""
+        values = np.array([table.get(t, default) for t in self.types.values], dtype=float)
+        return values[self.type]
+
+    def mask(self, since=None, until=None):
+        keep = np.ones(len(self), dtype=bool)
+        if since is not None:
+            keep &= self.ts >= np.datetime64(since, "us")
+        if until is not None:
+            keep &= self.ts < np.datetime64(until, "us")
+        return keep
+
+
+_columns = {}
+_lock = threading.Lock()
+
+
+def transaction_columns(user_id):
+    """The user's refreshed TransactionColumns (shared; treat as read-only)."""
+    with _lock:
+        columns = _columns.get(user_id)
+        if columns is None:
+            columns = _columns[user_id] = TransactionColumns(user_id)
+        columns.refresh()
+        return columns
+
+
+def _group(codes, keys, weights, keep):
+    """{value: sum of weights} over the rows in keep, grouped by code."""
+    totals = np.bincount(keys[keep], weights=weights[keep], minlength=len(codes.values))
+    return {value: float(total) for value, total in zip(codes.values, totals) if value is not None}
+
+def _present(codes, keys, keep):
+    """Values with at least one row in keep, in code order."""
+    counts = np.bincount(keys[keep], minlength=len(codes.values))
+    return [value for value, count in zip(codes.values, counts) if count and value is not None]
+
+
+# ---------- Rollups ----------
+def gas_by_chain(user_id, wallet=None, since=None, until=None):
+    """{chain: total gas paid}, optionally for one wallet and a time window."""
+    c = transaction_columns(user_id)
+    keep = c.mask(since, until)
+    if wallet is not None:
+        keep &= c.wallet == c.wallets.index.get(wallet, -1)
+    return {chain: gas for chain, gas in _group(c.chains, c.chain, c.gas, keep).items() if gas}
+
+
+def net_flows(user_id, since=None, until=None):
+    """{wallet: {"inflow", "outflow", "gas", "net"}} in USDC."""
+    c = transaction_columns(user_id)
+    keep = c.mask(since, until)
+    flow = c.by_type(FLOW_SIGN) * c.amount
+    inflow = _group(c.wallets, c.wallet, np.where(flow > 0, flow, 0), keep)
+    outflow = _group(c.wallets, c.wallet, np.where(flow < 0, -flow, 0), keep)
+    gas = _group(c.wallets, c.wallet, c.gas, keep)
+    return {
+        wallet: {
+            "inflow": inflow[wallet],
+            "outflow": outflow[wallet],
+            "gas": gas[wallet],
+            "net": inflow[wallet] - outflow[wallet] - gas[wallet]
+        }
+        for wallet in _present(c.wallets, c.wallet, keep)
+    }
+
+
+def nft_pnl(user_id, since=None, until=None):
+    """
+    {wallet: {"bought", "sold", "gas", "pnl"}} for NFT trading: sale
+    proceeds minus purchase prices minus the gas of every NFT action.
+    """
+    c = transaction_columns(user_id)
+    is_nft = c.by_type({t: 1 for t in NFT_TYPES}).astype(bool)
+    keep = c.mask(since, until) & is_nft
+    bought = _group(c.wallets, c.wallet, c.amount * (c.type == c.types.index["nft_purchase"]), keep)
+    sold = _group(c.wallets, c.wallet, c.amount * (c.type == c.types.index["nft_sold"]), keep)
+    gas = _group(c.wallets, c.wallet, c.gas, keep)
+    return {
+        wallet: {
+            "bought": bought[wallet],
+            "sold": sold[wallet],
+            "gas": gas[wallet],
+            "pnl": sold[wallet] - bought[wallet] - gas[wallet]
+        }
+        for wallet in _present(c.wallets, c.wallet, keep)
+    }
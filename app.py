@@ -1,24 +1,50 @@
-﻿from datetime import datetime
+﻿import json
+from datetime import datetime
 from venv import create
 
 import streamlit as st
 
 from wallet import create_wallet, get_wallets, load_all_wallets
-from balances import get_wallet_balance, update_wallet_balance, transfer, off_ramp
-from chains import CHAINS, DEFAULT_CHAIN
-from transactions import save_transaction, load_transactions
-from nfts import load_catalog, mint_nft, list_nfts_by_owner, transfer_nft, burn_nft, get_nft
-from marketplace import list_nft_for_sale, get_listing, load_marketplace, remove_listing
-from calculator import calculate_gas_fee
+from balances import apply_transaction, get_wallet_balance, transfer_many
+from chains import CHAINS, COMPLEXITIES, DEFAULT_CHAIN
+from transactions import save_transaction, load_wallet_transactions
+from nfts import load_catalog, mint_nft, new_token_id, list_nfts_by_owner, transfer_nft, burn_nft
+from marketplace import buy_listing, list_nft_for_sale, listed_token_ids, query_listings, remove_listing, load_marketplace_with_nfts
+from calculator import quote, quote_many
+from analytics import gas_by_chain, net_flows, nft_pnl
+from catalog_index import catalog_tags, search_catalog
 from users import create_new_user
+from cache import stats as cache_stats
+from instrument import begin_run, end_run
+from thumbnails import image_for
 
 st.set_page_config(page_title="Crossmobi", layout="wide")
 
+# Record the data-module I/O of this rerun; the debug panel shows the previous one.
+# The run is closed where the script ends (below, or at any rerun()/stop()), so
+# wall time covers this script only, not the idle time before the next rerun.
+begin_run(label=st.session_state.get("user_id"))
+
+def finish_run():
+    run = end_run()
+    if run is not None:
+        st.session_state.perf_last_run = run.to_dict()
+
+def rerun():
+    finish_run()
+    st.rerun()
+
+def stop():
+    finish_run()
+    st.stop()
+
 # Initialize session state for active wallet and chain
 if "active_wallet_address" not in st.session_state:
     st.session_state.active_wallet_address = None
 
-if "active_chain" not in st.session_state:
+# chains.yaml is reloaded while sessions run: a chain renamed or removed
+# since the last rerun falls back to the default
+if st.session_state.get("active_chain") not in CHAINS:
     st.session_state.active_chain = DEFAULT_CHAIN
 
 # ---- User Login UI ----
@@ -39,7 +65,7 @@ if login_mode == "Choose existing user":
         selected_user = st.sidebar.selectbox("Select a user", existing_users)
         if st.sidebar.button("Login as selected user"):
             st.session_state.user_id = selected_user
-            st.rerun()
+            rerun()
     else:
         st.sidebar.info("No users yet. Create one below.")
 elif login_mode == "Create new user":
@@ -52,13 +78,33 @@ elif login_mode == "Create new user":
         else:
             username = create_new_user(new_username)
             st.session_state.user_id = username
-            st.rerun()
+            rerun()
+
+with st.sidebar.expander("⚡ Read cache"):
+    st.table(cache_stats())
+
+if st.sidebar.checkbox("🔍 Performance debug"):
+    last_run = st.session_state.get("perf_last_run")
+    with st.sidebar.expander("Previous rerun", expanded=True):
+        if last_run is None:
+            st.caption("Interact with the app to record a rerun.")
+        else:
+            io = last_run["io"]
+            st.metric("Wall time", f"{last_run['wall_s'] * 1000:.0f} ms")
+            st.write(f"Read {io['files_read']} files / {io['bytes_read'] / 1024:.1f} KB, "
+                     f"wrote {io['files_written']} files / {io['bytes_written'] / 1024:.1f} KB")
+            st.table([
+                {"function": name, "calls": c["calls"], "ms": round(c["seconds"] * 1000, 2)}
+                for name, c in last_run["calls"].items()
+            ])
+            st.download_button("Export JSON", json.dumps(last_run, indent=2),
+                               file_name="crossmobi_rerun.json", mime="application/json")
 
 user_id = st.session_state.get("user_id", "")
 if not user_id:
     st.title("🔗 Crossmobi – Web3 Simulation Dashboard")
     st.warning("Please log in or create a user to get started.")
-    st.stop()
+    stop()
 
 
 
@@ -70,13 +116,13 @@ if st.button("➕ Create New Wallet"):
     new_wallet = create_wallet(user_id=user_id, nickname=nickname)
     st.success(f"Created wallet: {nickname or new_wallet['address']}")
     st.session_state.active_wallet_address = new_wallet["address"]
-    st.rerun()
+    rerun()
 
 # ---- Load Wallets ----
 wallets = get_wallets(user_id=user_id)
 if not wallets:
     st.info("No wallets created yet.")
-    st.stop()
+    stop()
 
 # ---- Wallet Selector ----
 st.subheader("📜 Your Wallets")
@@ -111,9 +157,7 @@ balance = get_wallet_balance(user_id, active_wallet["address"])
 st.metric(label="USDC", value=f'{balance["USDC"]:.2f}')
 
 if st.button("🔼 Simulate On-Ramp (Deposit $500 USDC)"):
-    update_wallet_balance(user_id, active_wallet["address"], 500)
-
-    save_transaction(user_id, {
+    apply_transaction(user_id, {
     "type": "onramp",
     "wallet": active_wallet["address"],
     "amount": 500,
@@ -124,9 +168,10 @@ if st.button("🔼 Simulate On-Ramp (Deposit $500 USDC)"):
     })
 
     st.success("Deposited $500 USDC!")
-    st.rerun()
+    rerun()
 
 # ---- List All Wallets ----
+# Served from the address directory, not a walk over every user folder
 all_wallets = load_all_wallets()
 recipient_options = [
     f"{w['nickname']} ({w['address'][:6]}…{w['address'][-4:]}) — @{w['user_id']}"
@@ -142,7 +187,7 @@ owned_nfts = list_nfts_by_owner(owner_address=active_wallet["address"])
 if owned_nfts:
     for nft in owned_nfts:
         with st.expander(f"{nft['name']} (Token {nft['token_id'][:8]}…)"):
-            st.image(nft["image_url"], caption=nft["name"], use_container_width=True)
+            st.image(image_for(nft), caption=nft["name"], use_container_width=True)
             st.write(nft["description"])
             st.text(f"Token ID: {nft['token_id']}")
 
@@ -153,31 +198,18 @@ if owned_nfts:
     selected_nft_label = st.selectbox("Select NFT to transfer", nft_options)
     selected_nft = owned_nfts[nft_options.index(selected_nft_label)]
 
-    # Pick recipient wallet
-    recipient_nft_options = [
-        f"{w['nickname']} ({w['address'][:6]}…{w['address'][-4:]}) — @{w['user_id']}"
-        if w['nickname'] else f"{w['address']} — @{w['user_id']}"
-        for w in all_wallets if w['address'] != active_wallet["address"]
-    ]
-    recipient_wallets = [w for w in all_wallets if w['address'] != active_wallet["address"]]
+    # Pick recipient wallet (same directory-backed list as the USDC transfer)
+    recipient_nft_options = recipient_options
 
     if recipient_nft_options:
         recipient_choice = st.selectbox("Transfer NFT to", recipient_nft_options)
         recipient_wallet = recipient_wallets[recipient_nft_options.index(recipient_choice)]
 
         if st.button("Confirm NFT Transfer"):
-            gas_fee = calculate_gas_fee(CHAINS[st.session_state.active_chain], "medium")
-            if balance["USDC"] < gas_fee:
-                st.error("Not enough USDC to cover gas.")
-            else:
-                update_wallet_balance(user_id, active_wallet["address"], -gas_fee)
-                transfer_nft(
-                    token_id=selected_nft["token_id"],
-                    new_owner_user=recipient_wallet["user_id"],
-                    new_owner_address=recipient_wallet["address"]
-                )
-
-                save_transaction(user_id, {
+            gas_fee = quote(st.session_state.active_chain, "medium")
+            try:
+                # Gas and its record come from one call, so they cannot drift apart
+                apply_transaction(user_id, {
                     "type": "nft_transfer",
                     "wallet": active_wallet["address"],
                     "token_id": selected_nft["token_id"],
@@ -186,7 +218,15 @@ if owned_nfts:
                     "timestamp": datetime.utcnow().isoformat(),
                     "gas_fee": gas_fee,
                     "direction": "out"
-                })
+                }, error="Not enough USDC to cover gas.")
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                transfer_nft(
+                    token_id=selected_nft["token_id"],
+                    new_owner_user=recipient_wallet["user_id"],
+                    new_owner_address=recipient_wallet["address"]
+                )
                 save_transaction(recipient_wallet["user_id"], {
                     "type": "nft_received",
                     "wallet": recipient_wallet["address"],
@@ -199,7 +239,7 @@ if owned_nfts:
                 })
 
                 st.success("NFT transferred successfully!")
-                st.rerun()
+                rerun()
     else:
         st.info("No other wallets to transfer to.")
 
@@ -211,14 +251,9 @@ if owned_nfts:
     nft_to_burn = owned_nfts[nft_options.index(burn_nft_label)]
 
     if st.button("Confirm Burn"):
-        gas_fee = calculate_gas_fee(CHAINS[st.session_state.active_chain], "medium")
-        if balance["USDC"] < gas_fee:
-            st.error("Not enough USDC to cover gas.")
-        else:
-            update_wallet_balance(user_id, active_wallet["address"], -gas_fee)
-            burn_nft(nft_to_burn["token_id"])
-
-            save_transaction(user_id, {
+        gas_fee = quote(st.session_state.active_chain, "medium")
+        try:
+            apply_transaction(user_id, {
                 "type": "nft_burn",
                 "wallet": active_wallet["address"],
                 "token_id": nft_to_burn["token_id"],
@@ -226,10 +261,14 @@ if owned_nfts:
                 "timestamp": datetime.utcnow().isoformat(),
                 "gas_fee": gas_fee,
                 "direction": "out"
-            })
+            }, error="Not enough USDC to cover gas.")
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            burn_nft(nft_to_burn["token_id"])
 
             st.success("NFT burned successfully.")
-            st.rerun()
+            rerun()
 
 else:
     st.info("This wallet doesn't own any NFTs yet.")
@@ -238,7 +277,8 @@ st.markdown("---")
 st.subheader("🛍 List NFT for Sale")
 
 # Reuse owned NFT labels
-listable_nfts = [nft for nft in owned_nfts if not get_listing(nft["token_id"])]
+unlisted_ids = {nft["token_id"] for nft in owned_nfts} - listed_token_ids()
+listable_nfts = [nft for nft in owned_nfts if nft["token_id"] in unlisted_ids]
 if not listable_nfts:
     st.info("All your NFTs are already listed or none available.")
 else:
@@ -248,7 +288,7 @@ else:
 
     sale_price = st.number_input("Set sale price (USDC)", min_value=1.0, step=1.0, format="%.2f")
 
-    gas_fee = calculate_gas_fee(CHAINS[st.session_state.active_chain], "medium")
+    gas_fee = quote(st.session_state.active_chain, "medium")
     st.info(f"Listing gas fee: ${gas_fee:.2f}")
 
     if st.button("List NFT for Sale"):
@@ -256,29 +296,35 @@ else:
         if balance < gas_fee:
             st.error("Not enough USDC to cover listing gas fee.")
         else:
-            update_wallet_balance(user_id, active_wallet["address"], -gas_fee)
-
-            listing = list_nft_for_sale(
-                token_id=selected_nft["token_id"],
-                seller_user=user_id,
-                seller_address=active_wallet["address"],
-                price=sale_price,
-                chain=st.session_state.active_chain
-            )
-
-            save_transaction(user_id, {
-                "type": "nft_listed",
-                "wallet": active_wallet["address"],
-                "token_id": listing["token_id"],
-                "amount": sale_price,
-                "chain": st.session_state.active_chain,
-                "timestamp": datetime.utcnow().isoformat(),
-                "gas_fee": gas_fee,
-                "direction": "out"
-            })
-
-            st.success(f"NFT listed for {sale_price:.2f} USDC!")
-            st.rerun()
+            try:
+                # Rejected if the NFT was sold, moved or burned since this page rendered
+                listing = list_nft_for_sale(
+                    token_id=selected_nft["token_id"],
+                    seller_user=user_id,
+                    seller_address=active_wallet["address"],
+                    price=sale_price,
+                    chain=st.session_state.active_chain
+                )
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                try:
+                    apply_transaction(user_id, {
+                        "type": "nft_listed",
+                        "wallet": active_wallet["address"],
+                        "token_id": listing["token_id"],
+                        "amount": sale_price,
+                        "chain": st.session_state.active_chain,
+                        "timestamp": datetime.utcnow().isoformat(),
+                        "gas_fee": gas_fee,
+                        "direction": "out"
+                    }, error="Not enough USDC to cover listing gas fee.")
+                except ValueError as e:
+                    remove_listing(listing["token_id"])  # the balance fell since the check above
+                    st.error(str(e))
+                else:
+                    st.success(f"NFT listed for {sale_price:.2f} USDC!")
+                    rerun()
 
 
 # ---- Transfer Funds ----
@@ -295,34 +341,12 @@ if recipient_options:
     if st.button("Send USDC"):
         try:
             gas_fee = CHAINS[st.session_state.active_chain]["gas_fee"]
-            transfer(user_id, active_wallet["address"], recipient_user_id, recipient_address, amount_to_send, gas_fee)
-
-            timestamp = datetime.utcnow().isoformat()
-
-            save_transaction(user_id, {
-                "type": "transfer_sent",
-                "wallet": active_wallet["address"],
-                "amount": amount_to_send,
-                "recipient": recipient_address,
-                "chain": st.session_state.active_chain,
-                "timestamp": timestamp,
-                "gas_fee": gas_fee,
-                "direction": "out"
-            })
-
-            save_transaction(recipient_user_id, {
-                "type": "transfer_received",
-                "wallet": recipient_address,
-                "amount": amount_to_send,
-                "sender": active_wallet["address"],
-                "chain": st.session_state.active_chain,
-                "timestamp": timestamp,
-                "gas_fee": 0,
-                "direction": "in"
-            })
+            # Commits both balances and writes both records from the same amounts
+            transfer_many(user_id, active_wallet["address"], [(recipient_user_id, recipient_address, amount_to_send)],
+                          gas_fee, chain=st.session_state.active_chain)
 
             st.success(f"Sent {amount_to_send:.2f} USDC to @{recipient_user_id}")
-            st.rerun()
+            rerun()
         except ValueError as e:
             st.error(str(e))
 else:
@@ -336,9 +360,7 @@ amount_to_withdraw = st.number_input("Amount to off-ramp", min_value=0.0, step=1
 
 if st.button("Withdraw"):
     try:
-        off_ramp(user_id, active_wallet["address"], amount_to_withdraw)
-
-        save_transaction(user_id, {
+        apply_transaction(user_id, {
         "type": "offramp",
         "wallet": active_wallet["address"],
         "amount": amount_to_withdraw,
@@ -346,10 +368,10 @@ if st.button("Withdraw"):
         "timestamp": datetime.utcnow().isoformat(),
         "gas_fee": 0,
         "direction": "out"
-        })
+        }, error="Insufficient USDC to off-ramp")
 
         st.success(f"Withdrew {amount_to_withdraw:.2f} USDC to fiat.")
-        st.rerun()
+        rerun()
     except ValueError as e:
         st.error(str(e))
 
@@ -360,27 +382,21 @@ st.subheader("📜 Smart Contract Simulation")
 contract_types = ['Simple Call (e.g. view balance)',
                   'Medium Call (e.g. transfer ownership)',
                   'Complex Call (e.g. mint NFT, DAO vote)']
-chain_info = CHAINS[st.session_state.active_chain]
-gas_fees = {level: calculate_gas_fee(chain_info, level) for level in chain_info['contract_multipliers']} 
+gas_fees = dict(zip(COMPLEXITIES, quote_many(st.session_state.active_chain, COMPLEXITIES).tolist()))
 contract_action = st.selectbox('Select interaction type',
                                [f'{contract_type} - ${gas_fees[contract_type.split(" ")[0].lower()]:.2f}' for contract_type in contract_types]
                                 )
 contract_level = contract_action.split(' ')[0].lower()
 
 # Define gas multipliers based on complexity
-gas_fee = calculate_gas_fee(chain_info, contract_level)
+gas_fee = gas_fees[contract_level]
 ##base_gas = chain_info["gas_fee"]
 ##gas_multiplier = chain_info["contract_multipliers"][contract_level]
 ##scaled_gas = base_gas * gas_multiplier
 
 if st.button("Simulate Contract Interaction"):
-    balance = get_wallet_balance(user_id, active_wallet["address"])["USDC"]
-    if balance < gas_fee: ##scaled_gas:
-        st.error(f"Not enough USDC to cover gas (${gas_fee:.2f})")
-    else:
-        update_wallet_balance(user_id, active_wallet["address"], -gas_fee)
-
-        save_transaction(user_id, {
+    try:
+        apply_transaction(user_id, {
             "type": "contract_call",
             "wallet": active_wallet["address"],
             "chain": st.session_state.active_chain,
@@ -388,10 +404,12 @@ if st.button("Simulate Contract Interaction"):
             "gas_fee": gas_fee,
             "direction": "out",
             "action": contract_action
-        })
-
+        }, error=f"Not enough USDC to cover gas (${gas_fee:.2f})")
+    except ValueError as e:
+        st.error(str(e))
+    else:
         st.success(f"Simulated: {contract_action} (gas: ${gas_fee:.2f})")
-        st.rerun()
+        rerun()
 
 
 # ---- Mint NFT ----
@@ -401,64 +419,90 @@ catalog = load_catalog()
 if not catalog:
     st.info("No portfolio catalog found. Add data/portfolio_catalog.json to enable NFT minting.")
 else:
-    # Build selection labels
-    asset_labels = [f"{a['title']} ({a['asset_id']})" for a in catalog]
-    asset_choice = st.selectbox("Choose an artwork to mint", asset_labels)
-    asset = catalog[asset_labels.index(asset_choice)]
-
-    # Optional override name/description
-    nft_name = st.text_input("NFT Name", value=asset["title"])
-    nft_desc = st.text_area("NFT Description", value=asset.get("description", ""))
-
-    # Use current chain for mint cost (treat mint as 'complex contract')
-    # Gas fee scaling re-uses your YAML/multipliers
-    chain_info = CHAINS[st.session_state.active_chain]
-    gas_fee = calculate_gas_fee(chain_info, 'complex')
-    st.info(f"Mint cost (gas): ${gas_fee:.2f} on {st.session_state.active_chain}")
-
-    if st.button("Mint NFT"):
-        # Check funds
-        bal = get_wallet_balance(user_id, active_wallet["address"])["USDC"]
-        if bal < gas_fee:
-            st.error("Insufficient USDC to cover mint gas.")
-        else:
-            # Deduct gas
-            update_wallet_balance(user_id, active_wallet["address"], -gas_fee)
-
-            # Mint NFT
-            nft = mint_nft(
-                asset={**asset, "title": nft_name, "description": nft_desc},
-                chain=st.session_state.active_chain,
-                owner_user=user_id,
-                owner_address=active_wallet["address"]
-            )
-
-            # Log tx
-            save_transaction(user_id, {
-                "type": "nft_mint",
-                "wallet": active_wallet["address"],
-                "token_id": nft["token_id"],
-                "asset_id": nft["asset_id"],
-                "amount": 0,
-                "chain": st.session_state.active_chain,
-                "timestamp": datetime.utcnow().isoformat(),
-                "gas_fee": gas_fee,
-                "direction": "out"
-            })
-
-            st.success(f"Minted NFT '{nft_name}' (Token {nft['token_id'][:8]}…)!")
-            st.rerun()
+    # Search the catalog instead of putting every asset in one selectbox
+    search_col, tags_col = st.columns([2, 1])
+    with search_col:
+        asset_query = st.text_input("Search artworks", placeholder="Title, description or tag")
+    with tags_col:
+        asset_tags = st.multiselect("Tags", catalog_tags())
+    matches = search_catalog(asset_query, tags=asset_tags, limit=50)
+
+    if not matches:
+        st.info("No artworks match this search.")
+    else:
+        asset_labels = [f"{a['title']} ({a['asset_id']})" for a in matches]
+        asset_choice = st.selectbox("Choose an artwork to mint", asset_labels)
+        asset = matches[asset_labels.index(asset_choice)]
+
+        # Optional override name/description
+        nft_name = st.text_input("NFT Name", value=asset["title"])
+        nft_desc = st.text_area("NFT Description", value=asset.get("description", ""))
+
+        # Use current chain for mint cost (treat mint as 'complex contract')
+        # Gas fee scaling re-uses your YAML/multipliers
+        gas_fee = quote(st.session_state.active_chain, 'complex')
+        st.info(f"Mint cost (gas): ${gas_fee:.2f} on {st.session_state.active_chain}")
+
+        if st.button("Mint NFT"):
+            # Pay the gas and log the mint in one call, then mint under the id already logged
+            token_id = new_token_id()
+            try:
+                apply_transaction(user_id, {
+                    "type": "nft_mint",
+                    "wallet": active_wallet["address"],
+                    "token_id": token_id,
+                    "asset_id": asset["asset_id"],
+                    "amount": 0,
+                    "chain": st.session_state.active_chain,
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "gas_fee": gas_fee,
+                    "direction": "out"
+                }, error="Insufficient USDC to cover mint gas.")
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                nft = mint_nft(
+                    asset={**asset, "title": nft_name, "description": nft_desc},
+                    chain=st.session_state.active_chain,
+                    owner_user=user_id,
+                    owner_address=active_wallet["address"],
+                    token_id=token_id
+                )
 
+                st.success(f"Minted NFT '{nft_name}' (Token {nft['token_id'][:8]}…)!")
+                rerun()
+
+
+# ---- Portfolio Analytics ----
+with st.expander("📊 Portfolio analytics"):
+    flows = net_flows(user_id)
+    pnl = nft_pnl(user_id)
+    gas_col, flow_col = st.columns([1, 2])
+    with gas_col:
+        st.markdown("**Gas spend by chain**")
+        st.table([{"chain": c, "gas (USDC)": round(g, 2)} for c, g in gas_by_chain(user_id).items()])
+    with flow_col:
+        st.markdown("**Per wallet**")
+        st.table([
+            {
+                "wallet": f"{w[:6]}…{w[-4:]}",
+                "in": round(f["inflow"], 2),
+                "out": round(f["outflow"], 2),
+                "gas": round(f["gas"], 2),
+                "net": round(f["net"], 2),
+                "NFT P&L": round(pnl.get(w, {}).get("pnl", 0.0), 2)
+            }
+            for w, f in flows.items()
+        ])
 
 # ---- Transaction History ----
 st.subheader("📜 Transaction History")
 
-txs = load_transactions(user_id)
 wallet_addr = active_wallet["address"]
-wallet_txs = [tx for tx in txs if tx["wallet"] == wallet_addr]
+wallet_txs, _ = load_wallet_transactions(user_id, wallet_addr, limit=25)
 
 if wallet_txs:
-    for tx in reversed(wallet_txs[-25:]):  # show latest 25
+    for tx in wallet_txs:  # latest 25, newest first
         ts = tx.get("timestamp", "unknown").replace("T", " ").split(".")[0]
         kind = tx["type"]
         amt = tx.get("amount")
@@ -519,10 +563,6 @@ st.subheader("🌐 Select Network")
 
 chain_names = list(CHAINS.keys())
 
-# Track selected chain in session
-if "active_chain" not in st.session_state:
-    st.session_state.active_chain = chain_names[0]
-
 selected_chain = st.selectbox("Choose blockchain network", chain_names, index=chain_names.index(st.session_state.active_chain))
 st.session_state.active_chain = selected_chain
 
@@ -544,7 +584,7 @@ if st.button("Update Nickname"):
     from wallet import update_wallet_nickname
     update_wallet_nickname(user_id, active_wallet["address"], new_nickname)
     st.session_state.active_wallet_address = active_wallet["address"]
-    st.rerun()
+    rerun()
     st.success("Nickname updated!")
 
 # ---- Delete Wallet ----
@@ -554,26 +594,54 @@ if st.button("Delete Active Wallet"):
     from wallet import delete_wallet
     delete_wallet(user_id, active_wallet["address"])
     st.warning("Wallet deleted. Refreshing...")
-    st.rerun()
+    rerun()
 
 
 # ---- NFT Marketplace ----
 st.subheader("🏪 NFT Marketplace")
 
-marketplace = load_marketplace()
+LISTINGS_PER_PAGE = 10
+
+sort_labels = {"Price: low to high": "price", "Price: high to low": "-price",
+               "Newest": "newest", "Oldest": "oldest"}
+filter_col, sort_col = st.columns(2)
+with filter_col:
+    market_chain = st.selectbox("Chain", ["All chains"] + list(CHAINS.keys()), key="market_chain")
+with sort_col:
+    market_sort = st.selectbox("Sort by", list(sort_labels), key="market_sort")
+market_chain = None if market_chain == "All chains" else market_chain
+
+_, total_listings = query_listings(chain=market_chain, limit=0)
+page_count = max(1, -(-total_listings // LISTINGS_PER_PAGE))
+# A filter change or a sale can leave the remembered page past the last one
+if st.session_state.get("market_page", 1) > page_count:
+    st.session_state.market_page = page_count
+market_page = st.number_input("Page", min_value=1, max_value=page_count, step=1, key="market_page")
+
+marketplace, _ = query_listings(
+    chain=market_chain,
+    sort=sort_labels[market_sort],
+    offset=(market_page - 1) * LISTINGS_PER_PAGE,
+    limit=LISTINGS_PER_PAGE
+)
 if not marketplace:
     st.info("No NFTs are currently listed for sale.")
 else:
-    for listing in marketplace:
-        nft = get_nft(listing["token_id"])
-        if not nft:
-            continue  # handle orphaned listing
+    st.caption(f"Page {market_page} of {page_count} · {total_listings} listings")
+    # Price every buy button on the page in one lookup. Listings on a chain
+    # since removed from chains.yaml have no price and cannot be bought.
+    priced = [l for l in marketplace if l["chain"] in CHAINS]
+    purchase_gas_fees = quote_many([l["chain"] for l in priced], "complex").tolist() if priced else []
+    gas_by_token = {l["token_id"]: fee for l, fee in zip(priced, purchase_gas_fees)}
+    # One registry read for the whole page; orphaned listings are dropped
+    for listing, nft in load_marketplace_with_nfts(marketplace):
+        purchase_gas_fee = gas_by_token.get(listing["token_id"])
 
         is_my_nft = listing["seller_address"] == active_wallet["address"]
 
         col1, col2 = st.columns([1, 2])
         with col1:
-            st.image(nft["image_url"], caption=nft["name"], use_container_width=True)
+            st.image(image_for(nft), caption=nft["name"], use_container_width=True)
         with col2:
             st.markdown(f"**{nft['name']}**")
             st.markdown(f"*Listed by:* @{listing['seller_user']}")
@@ -582,32 +650,23 @@ else:
             st.markdown(f"*Chain:* {listing['chain']}")
             st.markdown(nft["description"])
 
-            if not is_my_nft:
+            if purchase_gas_fee is None:
+                st.caption(f"{listing['chain']} is no longer a supported chain.")
+            elif not is_my_nft:
                 if st.button(f"💰 Buy for {listing['price']:.2f} USDC", key=f"buy_{nft['token_id']}"):
-                    buyer_balance = get_wallet_balance(user_id, active_wallet["address"])["USDC"]
-                    gas_fee = calculate_gas_fee(CHAINS[listing["chain"]], "complex")
+                    gas_fee = purchase_gas_fee
                     total_cost = listing["price"] + gas_fee
 
-                    if buyer_balance < total_cost:
-                        st.error(f"Not enough USDC to complete purchase. Need {total_cost:.2f}, have {buyer_balance:.2f}.")
+                    try:
+                        # Pay the seller, move the NFT and delist it, or do nothing
+                        buy_listing(nft["token_id"], user_id, active_wallet["address"], gas_fee)
+                    except ValueError as e:
+                        buyer_balance = get_wallet_balance(user_id, active_wallet["address"])["USDC"]
+                        if buyer_balance < total_cost:
+                            st.error(f"Not enough USDC to complete purchase. Need {total_cost:.2f}, have {buyer_balance:.2f}.")
+                        else:
+                            st.error(str(e))
                     else:
-                        # Deduct from buyer
-                        update_wallet_balance(user_id, active_wallet["address"], -total_cost)
-
-                        # Credit seller
-                        update_wallet_balance(listing["seller_user"], listing["seller_address"], listing["price"])
-
-                        # Transfer NFT
-                        transfer_nft(
-                            token_id=nft["token_id"],
-                            new_owner_user=user_id,
-                            new_owner_address=active_wallet["address"],
-                            chain=listing["chain"]
-                        )
-
-                        # Remove from marketplace
-                        remove_listing(nft["token_id"])
-
                         timestamp = datetime.utcnow().isoformat()
 
                         # Buyer transaction
@@ -637,4 +696,6 @@ else:
                         })
 
                         st.success("NFT purchase successful!")
-                        st.rerun()
+                        rerun()
+
+finish_run()
@@ -1,56 +1,182 @@
 # balances.py
 
-import json
-import os
+import atexit
+from datetime import datetime
 
-def get_balance_file(user_id):
-    return f"data/users/{user_id}/balances.json"
+import numpy as np
 
+from analytics import FLOW_SIGN
+from instrument import instrumented
+from ledger import Ledger, LEDGER_WAL_PATH
+from storage import get_backend, get_balance_file
+from transactions import save_transactions
+
+@instrumented("_read_balances")
+def _read_balances(user_id):
+    return get_backend().load_balances(user_id)
+
+@instrumented("_write_balances")
+def _write_balances(user_id, balances):
+    get_backend().save_balances(user_id, balances)
+
+# All balance changes go through the ledger; the backend holds its checkpoints
+_ledger = Ledger(LEDGER_WAL_PATH, load=_read_balances, save=_write_balances)
+atexit.register(_ledger.close)
+
+@instrumented("load_balances")
 def load_balances(user_id):
-    path = get_balance_file(user_id)
-    if not os.path.exists(path):
-        return {}
-    with open(path, 'r') as f:
-        return json.load(f)
+    return _ledger.balances(user_id)
 
+@instrumented("save_balances")
 def save_balances(user_id, balances):
-    path = get_balance_file(user_id)
-    with open(path, 'w') as f:
-        json.dump(balances, f, indent=2)
+    _ledger.replace(user_id, balances)
 
 def get_wallet_balance(user_id, address):
-    balances = load_balances(user_id)
-    return balances.get(address, {"USDC": 0})
+    return _ledger.wallet(user_id, address)
 
 def update_wallet_balance(user_id, address, amount_delta):
-    balances = load_balances(user_id)
-    current = balances.get(address, {"USDC": 0})
-    current["USDC"] += amount_delta
-    balances[address] = current
-    save_balances(user_id, balances)
+    _ledger.commit([(user_id, address, amount_delta)])
 
 def transfer(user_id, sender_address, recipient_user_id, recipient_address, amount, gas_fee):
-    # Subtract from sender
-    sender_bal = load_balances(user_id)
-    sender = sender_bal.get(sender_address, {"USDC": 0})
-    if sender["USDC"] < amount + gas_fee:
-        raise ValueError("Insufficient balance")
-    sender["USDC"] -= (amount + gas_fee)
-    sender_bal[sender_address] = sender
-    save_balances(user_id, sender_bal)
-
-    # Add to recipient
-    recipient_bal = load_balances(recipient_user_id)
-    recipient = recipient_bal.get(recipient_address, {"USDC": 0})
-    recipient["USDC"] += amount
-    recipient_bal[recipient_address] = recipient
-    save_balances(recipient_user_id, recipient_bal)
+    # Debit sender and credit recipient in one WAL record
+    _ledger.commit(
+        [(user_id, sender_address, -(amount + gas_fee)),
+         (recipient_user_id, recipient_address, amount)],
+        minimums=[(user_id, sender_address, amount + gas_fee)],
+        error="Insufficient balance"
+    )
+
+def transfer_many(sender_user, sender_address, recipients, gas_fee, chain=None):
+    """
+    Pay many wallets from one sender in a single ledger commit.
+
+    recipients: [(recipient_user, recipient_address, amount), ...]
+    gas_fee is charged per recipient, as if each were a separate transfer.
+    The whole batch is rejected if the sender cannot cover its total.
+    Then writes the paired transfer_sent / transfer_received records (with
+    chain, if given), one append per user.
+    """
+    if not recipients:
+        return
+    users, addresses, amounts = zip(*recipients)
+    amounts = np.asarray(amounts, dtype=float)
+    if (amounts < 0).any():
+        raise ValueError("Transfer amounts must be non-negative")
+    total = float(amounts.sum() + gas_fee * len(amounts))
+
+    # Sum the credits per (user, address) so repeated recipients become one delta
+    keys = list(zip(users, addresses))
+    unique_keys, inverse = np.unique(np.array(keys, dtype=str), axis=0, return_inverse=True)
+    credits = np.bincount(inverse.ravel(), weights=amounts, minlength=len(unique_keys))
+
+    deltas = [(sender_user, sender_address, -total)]
+    deltas += [(user, address, float(credit)) for (user, address), credit in zip(unique_keys.tolist(), credits)]
+    _ledger.commit(deltas, minimums=[(sender_user, sender_address, total)], error="Insufficient balance")
+
+    timestamp = datetime.utcnow().isoformat()
+    sent, received = [], {}
+    for user, address, amount in zip(users, addresses, amounts.tolist()):
+        sent.append({
+            "type": "transfer_sent",
+            "wallet": sender_address,
+            "amount": amount,
+            "recipient": address,
+            "chain": chain,
+            "timestamp": timestamp,
+            "gas_fee": gas_fee,
+            "direction": "out"
+        })
+        received.setdefault(user, []).append({
+            "type": "transfer_received",
+            "wallet": address,
+            "amount": amount,
+            "sender": sender_address,
+            "chain": chain,
+            "timestamp": timestamp,
+            "gas_fee": 0,
+            "direction": "in"
+        })
+    save_transactions(sender_user, sent)
+    for user, txs in received.items():
+        save_transactions(user, txs)
 
 def off_ramp(user_id, address, amount):
-    balances = load_balances(user_id)
-    wallet = balances.get(address, {"USDC": 0})
-    if wallet["USDC"] < amount:
-        raise ValueError("Insufficient USDC to off-ramp")
-    wallet["USDC"] -= amount
-    balances[address] = wallet
-    save_balances(user_id, balances)
+    _ledger.commit(
+        [(user_id, address, -amount)],
+        minimums=[(user_id, address, amount)],
+        error="Insufficient USDC to off-ramp"
+    )
+
+# ---------- Event-sourced view ----------
+# Replays start from the user's latest snapshot; a new snapshot is taken
+# once a replay has gone this many records past it
+SNAPSHOT_EVERY = 1000
+
+def tx_delta(tx):
+    """USDC change a transaction record implies for its own wallet."""
+    return FLOW_SIGN.get(tx.get("type"), 0) * (tx.get("amount") or 0) - (tx.get("gas_fee") or 0)
+
+def apply_transaction(user_id, tx, error="Insufficient balance"):
+    """
+    Commit the balance change a record implies (see tx_delta), then append
+    the record, so the two are computed from the same values. A debit is
+    rejected with ValueError(error) if the wallet cannot cover it.
+    """
+    delta = tx_delta(tx)
+    minimums = [(user_id, tx["wallet"], -delta)] if delta < 0 else []
+    _ledger.commit([(user_id, tx["wallet"], delta)], minimums=minimums, error=error)
+    save_transactions(user_id, [tx])
+
+def derive_balances(user_id, from_genesis=False):
+    """
+    Balances implied by the transaction log alone, {address: {"USDC": ...}}.
+    Replays from the latest snapshot (or the first record, if from_genesis).
+    """
+    backend = get_backend()
+    snapshot = None if from_genesis else backend.load_balance_snapshot(user_id)
+    snapshot = snapshot or {"count": 0, "balances": {}}
+    derived, count = dict(snapshot["balances"]), snapshot["count"]
+    for tx in backend.iter_transactions(user_id, count):
+        wallet = tx.get("wallet")
+        if wallet is not None:  # a record without a wallet moves no balance
+            derived[wallet] = derived.get(wallet, 0.0) + tx_delta(tx)
+        count += 1
+    if count - snapshot["count"] >= SNAPSHOT_EVERY:
+        backend.save_balance_snapshot(user_id, {"count": count, "balances": derived})
+    return {address: {"USDC": usdc} for address, usdc in derived.items()}
+
+def verify_balances(user_id, tolerance=1e-6, from_genesis=False):
+    """
+    Compare the stored balances with the ones derived from the log.
+    Returns [{"wallet", "stored", "derived", "diff"}] for every wallet that
+    disagrees by more than tolerance; empty when they match. A transfer in
+    flight (balance committed, record not yet written) shows up as a
+    mismatch, so run this against a quiet system.
+    """
+    stored = load_balances(user_id)
+    derived = derive_balances(user_id, from_genesis)
+    mismatches = []
+    for address in sorted(set(stored) | set(derived)):
+        have = stored.get(address, {}).get("USDC", 0)
+        want = derived.get(address, {}).get("USDC", 0)
+        if abs(have - want) > tolerance * max(1.0, abs(want)):
+            mismatches.append({"wallet": address, "stored": have, "derived": want, "diff": have - want})
+    return mismatches
+
+
+if __name__ == "__main__":
+    import sys
+
+    args = sys.argv[1:]
+    if args[:1] != ["verify"]:
+        print("usage: python balances.py verify [--from-genesis] [USER_ID ...]")
+        sys.exit(2)
+    from_genesis = "--from-genesis" in args
+    users = [a for a in args[1:] if a != "--from-genesis"] or get_backend().list_users()
+    failed = 0
+    for user_id in users:
+        for m in verify_balances(user_id, from_genesis=from_genesis):
+            failed += 1
+            print(f"{user_id} {m['wallet']}: stored {m['stored']:.6f}, derived {m['derived']:.6f} ({m['diff']:+.6f})")
+    print(f"Checked {len(users)} users, {failed} mismatched wallets")
+    sys.exit(1 if failed else 0)
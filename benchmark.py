@@ -0,0 +1,214 @@
+# benchmark.py
+"""
+Time the public functions of the data modules across dataset sizes.
+
+    python benchmark.py --tiers small,medium --output benchmark_results.json
+
+Each tier is generated with synthetic.py into a scratch directory, then
+measured in a fresh subprocess whose working directory is that tree, so
+every tier starts from a cold process. Within a tier the read cache
+(cache.py) is cleared before every timed call, but the NFT registry
+table, the order book and the ledger stay loaded between calls, as they
+do in a long-running server: the percentiles are warm, steady-state
+costs, not cache hits. first_s is the first call of each function,
+which for the first reader of a structure includes loading it.
+Results are written as JSON, one row per (tier, function).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+TIERS = {
+    "small":  {"users": 10,   "wallets_per_user": 3, "nfts": 1_000,   "listings": 200,    "transactions_per_user": 200},
+    "medium": {"users": 100,  "wallets_per_user": 3, "nfts": 10_000,  "listings": 2_000,  "transactions_per_user": 1_000},
+    "large":  {"users": 1000, "wallets_per_user": 3, "nfts": 100_000, "listings": 20_000, "transactions_per_user": 500},
+}
+
+
+def _timings(fn, calls, setup=None):
+    if not calls:
+        return None
+    samples = []
+    for i in range(calls):
+        args = setup(i) if setup else ()
+        started = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - started)
+    first = samples[0]
+    samples.sort()
+    return {
+        "calls": calls,
+        "first_s": first,
+        "mean_s": statistics.fmean(samples),
+        "p50_s": samples[len(samples) // 2],
+        "p95_s": samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+        "min_s": samples[0],
+        "max_s": samples[-1],
+    }
+
+
+def run_tier(calls):
+    """Measure every function against the data/ tree in the working directory."""
+    import balances, marketplace, nfts, transactions, wallet
+    from cache import read_cache
+
+    rng = random.Random(1)
+    users = wallet.list_users()
+    directory = wallet.get_address_directory()
+    owners = [(entry["user_id"], address) for address, entry in directory.items()]
+    token_ids = [n["token_id"] for n in nfts.list_nfts_by_owner()]
+    listed = list(marketplace.listed_token_ids())
+    catalog = nfts.load_catalog()
+    chains = list(__import__("chains").CHAINS)
+
+    def uncached(fn):
+        def call(*args):
+            read_cache.clear()
+            return fn(*args)
+        return call
+
+    def owner(_):
+        return rng.choice(owners)
+
+    def user(_):
+        return (rng.choice(users),)
+
+    def token(_):
+        return (rng.choice(token_ids),)
+
+    # Give every sender enough funds for the write benchmarks
+    for user_id, address in owners[:50]:
+        balances.update_wallet_balance(user_id, address, 1_000_000)
+    funded = owners[:50]
+
+    def tx(i):
+        user_id, address = rng.choice(funded)
+        return user_id, {"type": "onramp", "wallet": address, "amount": 1, "chain": chains[0],
+                         "timestamp": datetime.utcnow().isoformat(), "gas_fee": 0, "direction": "in"}
+
+    def pay(_):
+        (su, sa), (ru, ra) = rng.choice(funded), rng.choice(owners)
+        return su, sa, ru, ra, 1.0, 0.01
+
+    minted = []
+
+    def mint(_):
+        user_id, address = rng.choice(funded)
+        return rng.choice(catalog), rng.choice(chains), user_id, address
+
+    # Each call lists a different token, so this case gets at most one call per unlisted token
+    unlisted = [t for t in token_ids if t not in marketplace.listed_token_ids()]
+
+    def listing(i):
+        nft = nfts.get_nft(unlisted[i])
+        return nft["token_id"], nft["owner_user"], nft["owner_address"], 10.0, nft["chain"]
+
+    def move(i):
+        user_id, address = rng.choice(owners)
+        return token_ids[i % len(token_ids)], user_id, address
+
+    limits = {"list_nft_for_sale": len(unlisted), "transfer_nft": calls if token_ids else 0}
+
+    cases = [
+        ("list_users", wallet.list_users, None),
+        ("get_wallets", wallet.get_wallets, user),
+        ("load_all_wallets", wallet.load_all_wallets, None),
+        ("get_wallet_balance", balances.get_wallet_balance, owner),
+        ("load_transactions", transactions.load_transactions, user),
+        ("load_wallet_transactions", lambda u, a: transactions.load_wallet_transactions(u, a, 25), owner),
+        ("get_nft", nfts.get_nft, token),
+        ("get_nfts", lambda: nfts.get_nfts(token_ids[:25]), None),
+        ("list_nfts_by_owner", lambda u, a: nfts.list_nfts_by_owner(owner_address=a), owner),
+        ("load_marketplace", marketplace.load_marketplace, None),
+        ("get_listing", marketplace.get_listing, lambda _: (rng.choice(listed),) if listed else ("",)),
+        ("query_listings", lambda: marketplace.query_listings(chain=chains[0], min_price=100, max_price=1000), None),
+        ("listed_token_ids", marketplace.listed_token_ids, None),
+        ("load_catalog", nfts.load_catalog, None),
+        ("save_transaction", transactions.save_transaction, tx),
+        ("update_wallet_balance", lambda u, a: balances.update_wallet_balance(u, a, 1), owner),
+        ("transfer", balances.transfer, pay),
+        ("list_nft_for_sale", marketplace.list_nft_for_sale, listing),
+        ("mint_nft", lambda *a: minted.append(nfts.mint_nft(*a)), mint),
+        ("transfer_nft", nfts.transfer_nft, move),
+    ]
+
+    results = {}
+    for name, fn, setup in cases:
+        timing = _timings(uncached(fn), min(calls, limits.get(name, calls)), setup)
+        if timing is None:
+            print(f"{name}: skipped, nothing to call it on in this tree", file=sys.stderr)
+        else:
+            results[name] = timing
+    return results
+
+
+def run(tiers, calls, keep=False):
+    sys.path.insert(0, REPO_ROOT)
+    from synthetic import generate
+
+    rows = []
+    for tier in tiers:
+        workdir = tempfile.mkdtemp(prefix=f"crossmobi-bench-{tier}-")
+        try:
+            started = time.perf_counter()
+            sizes = generate(workdir, **TIERS[tier])
+            generated_s = time.perf_counter() - started
+            env = dict(os.environ, PYTHONPATH=REPO_ROOT, STORAGE_BACKEND="json")
+            out = subprocess.run(
+                [sys.executable, os.path.join(REPO_ROOT, "benchmark.py"), "--run-tier", "--calls", str(calls)],
+                cwd=workdir, env=env, check=True, stdout=subprocess.PIPE, text=True
+            ).stdout
+            for function, timing in json.loads(out.splitlines()[-1]).items():
+                rows.append({"tier": tier, "sizes": sizes, "function": function, **timing})
+            print(f"{tier}: generated in {generated_s:.1f}s, measured in {time.perf_counter() - started - generated_s:.1f}s",
+                  file=sys.stderr)
+        finally:
+            if keep:
+                print(f"{tier}: kept {workdir}", file=sys.stderr)
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the data modules across dataset sizes")
+    parser.add_argument("--tiers", default="small,medium", help=f"comma-separated, from {', '.join(TIERS)}")
+    parser.add_argument("--calls", type=int, default=50, help="timed calls per function")
+    parser.add_argument("--output", help="write results JSON here instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the generated data trees")
+    parser.add_argument("--run-tier", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_tier:
+        print(json.dumps(run_tier(args.calls)))
+        sys.exit(0)
+
+    tiers = [t.strip() for t in args.tiers.split(",") if t.strip()]
+    unknown = set(tiers) - set(TIERS)
+    if unknown:
+        parser.error(f"unknown tier(s): {', '.join(sorted(unknown))}")
+
+    report = {
+        "generated_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "calls": args.calls,
+        "tiers": {t: TIERS[t] for t in tiers},
+        "results": run(tiers, args.calls, keep=args.keep),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
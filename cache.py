@@ -0,0 +1,98 @@
+# cache.py
+"""
+Process-wide read cache shared by every Streamlit session.
+
+Read functions are wrapped with @cached(name, stamp=...); the write
+functions that change their results call invalidate(name, **args) so
+entries are dropped as soon as this process changes the data, and the
+stamp catches changes made by other processes. Cached values are shared
+between sessions and must be treated as read-only.
+"""
+import functools
+import inspect
+import threading
+
+
+class ReadCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}   # name -> {bound args tuple: (stamp, value)}
+        self._params = {}    # name -> parameter names, in order
+        self._generation = {}  # name -> bumped by every invalidate()
+        self._hits = {}
+        self._misses = {}
+
+    def cached(self, name, stamp=None):
+        """
+        Decorator caching a function's result per argument set.
+        stamp: optional callable taking the same arguments as the function;
+        a changed return value (e.g. a file's mtime) invalidates the entry
+        on the next read, which catches writes from other processes.
+        """
+        def decorator(fn):
+            signature = inspect.signature(fn)
+            self._params[name] = list(signature.parameters)
+            self._entries.setdefault(name, {})
+            self._generation.setdefault(name, 0)
+            self._hits.setdefault(name, 0)
+            self._misses.setdefault(name, 0)
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                key = tuple(bound.arguments.values())
+                current = stamp(*bound.args, **bound.kwargs) if stamp else None
+                with self._lock:
+                    entry = self._entries[name].get(key)
+                    if entry is not None and entry[0] == current:
+                        self._hits[name] += 1
+                        return entry[1]
+                    self._misses[name] += 1
+                    generation = self._generation[name]
+                value = fn(*args, **kwargs)
+                with self._lock:
+                    # skip the store if a write invalidated us mid-read
+                    if self._generation[name] == generation:
+                        self._entries[name][key] = (current, value)
+                return value
+
+            return wrapper
+        return decorator
+
+    def invalidate(self, name, **match):
+        """Drop entries of name whose arguments equal every value in match (all if empty)."""
+        with self._lock:
+            entries = self._entries.get(name, {})
+            self._generation[name] = self._generation.get(name, 0) + 1
+            if not match:
+                entries.clear()
+                return
+            params = self._params[name]
+            for key in list(entries):
+                args = dict(zip(params, key))
+                if all(args.get(k) == v for k, v in match.items()):
+                    del entries[key]
+
+    def clear(self):
+        with self._lock:
+            for entries in self._entries.values():
+                entries.clear()
+
+    def stats(self):
+        """{name: {"hits", "misses", "entries"}} for every cached function."""
+        with self._lock:
+            return {
+                name: {
+                    "hits": self._hits[name],
+                    "misses": self._misses[name],
+                    "entries": len(self._entries[name])
+                }
+                for name in self._entries
+            }
+
+
+read_cache = ReadCache()
+cached = read_cache.cached
+invalidate = read_cache.invalidate
+stats = read_cache.stats
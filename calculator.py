@@ -1,6 +1,13 @@
 # calculator.py
 
+import numpy as np
+
+import chains
+
 def calculate_gas_fee(chain_info, complexity):
+    """chain_info: a chain's settings, or its name to use the current chains.yaml."""
+    if isinstance(chain_info, str):
+        chain_info = chains.CHAINS[chain_info]
     base_fee = chain_info['gas_fee']
     if 'contract_multipliers' in chain_info:
         multiplier = chain_info['contract_multipliers'].get(complexity, 1)
@@ -8,4 +15,35 @@ def calculate_gas_fee(chain_info, complexity):
         multiplier = 1
     scaled_fee = base_fee * multiplier
     
-    return scaled_fee
\ No newline at end of file
+    return scaled_fee
+
+def _codes(values, index, default=None):
+    """Map names to table positions. Integer arrays are taken as positions already."""
+    values = np.asarray(values)
+    if values.dtype.kind in "iu":
+        return values
+    # Look up each distinct name once instead of once per element
+    uniques, inverse = np.unique(values, return_inverse=True)
+    lookup = np.array(
+        [index[name] if default is None else index.get(name, default) for name in uniques.tolist()],
+        dtype=np.intp
+    )
+    return lookup[inverse].reshape(values.shape)
+
+def quote(chain, complexity):
+    """Gas fee for one operation on a chain, read from the precompiled fee table."""
+    config = chains.current()
+    column = chains.COMPLEXITY_INDEX.get(complexity, chains.BASE_FEE_COLUMN)
+    return float(config.fee_table[config.chain_index[chain], column])
+
+def quote_many(chain_names, complexities):
+    """
+    Vectorised gas fees. chain_names and complexities are broadcast
+    against each other, so either can be a single name; both may also be
+    pre-encoded integer arrays (rows of chains.CHAIN_INDEX, columns of
+    chains.COMPLEXITY_INDEX). Returns a float array.
+    """
+    config = chains.current()  # one snapshot, so rows and table agree across a reload
+    rows = _codes(chain_names, config.chain_index)
+    columns = _codes(complexities, chains.COMPLEXITY_INDEX, default=chains.BASE_FEE_COLUMN)
+    return config.fee_table[rows, columns]
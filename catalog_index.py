@@ -0,0 +1,174 @@
+# catalog_index.py
+"""
+Search index over the portfolio catalog.
+
+Titles, descriptions and tags are split into lowercase tokens and kept
+in an inverted index: a sorted vocabulary with one posting list (catalog
+positions and field weights) per token. Because the vocabulary is
+sorted, every token starting with a prefix is one contiguous range found
+by bisection, which is what lets a partly typed word match.
+
+The index is saved next to the catalog (data/portfolio_catalog.index)
+with the catalog's file stamp and rebuilt only when the catalog changes.
+
+    python catalog_index.py "harbor sun" --tags night
+"""
+import bisect
+import heapq
+import math
+import re
+
+from cache import cached
+from instrument import instrumented
+from nfts import CATALOG_PATH, load_catalog
+from storage import _read_doc, _write_doc, file_stamp
+
+INDEX_PATH = CATALOG_PATH.rsplit(".", 1)[0] + ".index"
+INDEX_VERSION = 1
+# A match in the title counts for more than one in the tags, and both more than the description
+FIELD_WEIGHTS = {"title": 3.0, "tags": 2.0, "description": 1.0}
+PREFIX_MATCH = 0.5  # a token that only starts with the query term
+MIN_PREFIX = 2      # shorter terms must match whole tokens
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+class CatalogIndex:
+    def __init__(self, data):
+        self.stamp = data["stamp"]
+        self.size = data["size"]
+        self.vocab = data["vocab"]        # sorted tokens
+        self.docs = data["docs"]          # per token: catalog positions, ascending
+        self.weights = data["weights"]    # per token: field weight of each position
+        self.tags = data["tags"]          # tag -> catalog positions, ascending
+
+    @classmethod
+    def build(cls, catalog, stamp):
+        postings = {}
+        tags = {}
+        for position, asset in enumerate(catalog):
+            weights = {}
+            for field, weight in FIELD_WEIGHTS.items():
+                value = asset.get(field) or ""
+                text = " ".join(value) if isinstance(value, list) else value
+                for token in tokenize(text):
+                    weights[token] = max(weights.get(token, 0.0), weight)
+            for token, weight in weights.items():
+                postings.setdefault(token, []).append((position, weight))
+            for tag in asset.get("tags") or []:
+                tags.setdefault(tag.lower(), []).append(position)
+        vocab = sorted(postings)
+        return cls({
+            "stamp": list(stamp) if stamp else None,
+            "size": len(catalog),
+            "vocab": vocab,
+            "docs": [[p for p, _ in postings[t]] for t in vocab],
+            "weights": [[w for _, w in postings[t]] for t in vocab],
+            "tags": tags,
+        })
+
+    def to_dict(self):
+        return {
+            "version": INDEX_VERSION,
+            "stamp": self.stamp,
+            "size": self.size,
+            "vocab": self.vocab,
+            "docs": self.docs,
+            "weights": self.weights,
+            "tags": self.tags,
+        }
+
+    def _matches(self, term):
+        """{position: best score} over the tokens that equal or start with one query term."""
+        lo = bisect.bisect_left(self.vocab, term)
+        if len(term) >= MIN_PREFIX:
+            hi = bisect.bisect_left(self.vocab, term + "\U0010ffff")
+        else:
+            hi = lo + 1 if lo < len(self.vocab) and self.vocab[lo] == term else lo
+        scores = {}
+        for i in range(lo, hi):
+            boost = 1.0 if self.vocab[i] == term else PREFIX_MATCH
+            idf = math.log(1 + self.size / len(self.docs[i]))
+            for position, weight in zip(self.docs[i], self.weights[i]):
+                score = boost * weight * idf
+                if score > scores.get(position, 0.0):
+                    scores[position] = score
+        return scores
+
+    def search(self, query, tags=None, limit=20):
+        """[(position, score)] best first; every term and every tag must match."""
+        allowed = None
+        for tag in tags or ():
+            positions = set(self.tags.get(tag.lower(), ()))
+            allowed = positions if allowed is None else allowed & positions
+
+        scores = None
+        for term in dict.fromkeys(tokenize(query)):
+            matches = self._matches(term)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {p: s + matches[p] for p, s in scores.items() if p in matches}
+            if not scores:
+                return []
+
+        if scores is None:
+            # No query text: the tag filter (or the whole catalog) in catalog order
+            positions = sorted(allowed) if allowed is not None else range(self.size)
+            return [(p, 0.0) for p in positions[:limit]]
+        if allowed is not None:
+            scores = {p: s for p, s in scores.items() if p in allowed}
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+# ---------- Loading ----------
+@instrumented("load_catalog_index")
+@cached("load_catalog_index", stamp=lambda: file_stamp(CATALOG_PATH))
+def load_catalog_index():
+    """The index for the current catalog, read from disk or rebuilt if the catalog changed."""
+    stamp = file_stamp(CATALOG_PATH)
+    current = list(stamp) if stamp else None
+    data = _read_doc(INDEX_PATH, None)
+    if data and data.get("version") == INDEX_VERSION and data.get("stamp") == current:
+        return CatalogIndex(data)
+    index = CatalogIndex.build(load_catalog(), stamp)
+    if stamp is not None:
+        _write_doc(INDEX_PATH, index.to_dict())
+    return index
+
+
+def search_catalog(query, tags=None, limit=20):
+    """Catalog assets matching query (and carrying every tag in tags), best match first."""
+    catalog = load_catalog()
+    index = load_catalog_index()
+    if index.size != len(catalog):
+        return []  # catalog replaced between the two reads; the next call sees both new
+    return [catalog[position] for position, _ in index.search(query, tags=tags, limit=limit)]
+
+
+def catalog_tags():
+    """Every tag in the catalog, sorted."""
+    return sorted(load_catalog_index().tags)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Search the portfolio catalog")
+    parser.add_argument("query", nargs="?", default="")
+    parser.add_argument("--tags", nargs="*", default=None)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    load_catalog_index()
+    started = time.perf_counter()
+    results = search_catalog(args.query, tags=args.tags, limit=args.limit)
+    elapsed = time.perf_counter() - started
+    for asset in results:
+        print(f"{asset['asset_id']}  {asset['title']}  [{', '.join(asset.get('tags') or [])}]")
+    print(f"{len(results)} results in {elapsed * 1000:.2f} ms")
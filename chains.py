@@ -1,10 +1,129 @@
 # chains.py
+"""
+Chain registry, read from chains.yaml.
 
+CHAINS, DEFAULT_CHAIN, FEE_TABLE and CHAIN_INDEX are resolved on access
+(module __getattr__), so they follow the file: at most every
+CHECK_INTERVAL seconds its stamp is compared, and a changed file is
+validated and recompiled. An invalid edit is reported and the previous
+config stays in use. Code that reads several of them together should
+take one current() snapshot instead.
+
+The parsed, validated config is cached in data/chains.compiled, tagged
+with the YAML file's stamp, so processes after the first skip the YAML
+parse.
+"""
+import threading
+import time
+import warnings
+
+import numpy as np
 import yaml
 
+from storage import _read_doc, _write_doc, file_stamp
+
+CHAINS_PATH = "chains.yaml"
+COMPILED_PATH = "data/chains.compiled"
+COMPILED_VERSION = 1
+CHECK_INTERVAL = 1.0  # seconds between stamp checks of chains.yaml
+
+# Contract complexity levels, in fee-table column order. Fees for any other
+# level fall back to the chain's base gas fee (multiplier 1), which lives
+# in the extra last column.
+COMPLEXITIES = ("simple", "medium", "complex")
+COMPLEXITY_INDEX = {level: j for j, level in enumerate(COMPLEXITIES)}
+BASE_FEE_COLUMN = len(COMPLEXITIES)
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+
+def validate(chains):
+    """Raise ValueError unless chains has the shape chains.yaml must have."""
+    if not isinstance(chains, dict) or not chains:
+        raise ValueError(f"{CHAINS_PATH} must map chain names to their settings")
+    for name, info in chains.items():
+        if not isinstance(name, str) or not isinstance(info, dict):
+            raise ValueError(f"{CHAINS_PATH}: {name!r} must be a chain name mapped to its settings")
+        if not isinstance(info.get("symbol"), str) or not info["symbol"]:
+            raise ValueError(f"{CHAINS_PATH}: {name} needs a symbol")
+        if not _number(info.get("gas_fee")):
+            raise ValueError(f"{CHAINS_PATH}: {name} needs a non-negative gas_fee")
+        multipliers = info.get("contract_multipliers")
+        if not isinstance(multipliers, dict) or set(multipliers) != set(COMPLEXITIES):
+            raise ValueError(f"{CHAINS_PATH}: {name} needs contract_multipliers for exactly {', '.join(COMPLEXITIES)}")
+        for level, multiplier in multipliers.items():
+            if not _number(multiplier):
+                raise ValueError(f"{CHAINS_PATH}: {name} has an invalid {level} multiplier")
+    return chains
+
 def load_chains():
-    with open("chains.yaml", "r") as f:
-        return yaml.safe_load(f)
+    with open(CHAINS_PATH, "r") as f:
+        return validate(yaml.safe_load(f))
+
+def compile_fee_table(chains):
+    """Return (fees, chain_index): a chains × (complexities + base) array and its row lookup."""
+    fees = np.empty((len(chains), len(COMPLEXITIES) + 1))
+    for i, info in enumerate(chains.values()):
+        multipliers = info.get("contract_multipliers", {})
+        for j, level in enumerate(COMPLEXITIES):
+            fees[i, j] = info["gas_fee"] * multipliers.get(level, 1)
+        fees[i, BASE_FEE_COLUMN] = info["gas_fee"]
+    return fees, {name: i for i, name in enumerate(chains)}
+
+
+class ChainConfig:
+    """One validated version of chains.yaml with its fee table. Treat as read-only."""
+
+    def __init__(self, chains):
+        self.chains = chains
+        self.default_chain = next(iter(chains))
+        self.fee_table, self.chain_index = compile_fee_table(chains)
+
+
+def _load(stamp):
+    compiled = _read_doc(COMPILED_PATH, None)
+    if compiled and compiled.get("version") == COMPILED_VERSION and compiled.get("stamp") == list(stamp):
+        return ChainConfig(compiled["chains"])
+    chains = load_chains()
+    try:
+        _write_doc(COMPILED_PATH, {"version": COMPILED_VERSION, "stamp": list(stamp), "chains": chains})
+    except OSError:
+        pass  # the cache only saves the next process a parse
+    return ChainConfig(chains)
+
+
+_lock = threading.Lock()
+_config = None
+_stamp = None      # stamp of chains.yaml when it was last read, valid or not
+_checked = 0.0     # time.monotonic() of the last stamp check
+
+
+def current():
+    """The current ChainConfig, reloaded if chains.yaml changed since the last check."""
+    global _config, _stamp, _checked
+    if _config is not None and time.monotonic() - _checked < CHECK_INTERVAL:
+        return _config
+    with _lock:
+        if _config is None or time.monotonic() - _checked >= CHECK_INTERVAL:
+            stamp = file_stamp(CHAINS_PATH)
+            if _config is None or stamp != _stamp:
+                try:
+                    _config = _load(stamp) if stamp else ChainConfig(load_chains())
+                except (OSError, yaml.YAMLError, ValueError) as e:
+                    if _config is None:
+                        raise
+                    warnings.warn(f"Keeping the previous chain config: {e}")
+                _stamp = stamp
+            _checked = time.monotonic()
+        return _config
+
+
+_ATTRIBUTES = {"CHAINS": "chains", "DEFAULT_CHAIN": "default_chain",
+               "FEE_TABLE": "fee_table", "CHAIN_INDEX": "chain_index"}
+
 
-CHAINS = load_chains()
-DEFAULT_CHAIN = next(iter(CHAINS))
\ No newline at end of file
+def __getattr__(name):
+    if name in _ATTRIBUTES:
+        return getattr(current(), _ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,191 @@
+# codec.py
+"""
+Serialization codecs for the JSON-backend data files.
+
+Each kind of file (wallets, balances, the NFT registry, ...) is encoded
+with the codec named for it in config.yaml; compact JSON is the default
+and MessagePack is available when the msgpack package is installed.
+Reads detect the encoding from the first byte, so a tree can be switched
+over one file at a time. Append-only logs (transaction segments, NFT
+events, the ledger WAL) stay JSON lines.
+
+    python codec.py convert --to msgpack     # re-encode every file under data/
+    python codec.py convert --to json data/nfts.json
+    python codec.py bench                    # parse time and size per codec
+"""
+import json
+import os
+import warnings
+
+import yaml
+
+try:
+    import msgpack
+except ImportError:  # optional; JSON is always available
+    msgpack = None
+
+CONFIG_PATH = "config.yaml"
+DATA_ROOT = "data"
+
+# File name -> kind, the key used in config.yaml's codec section
+FILE_KINDS = {
+    "wallets.json": "wallets",
+    "balances.json": "balances",
+    "balance_snapshot.json": "balance_snapshot",
+    "nfts.json": "nfts",
+    "marketplace.json": "listings",
+    "address_directory.json": "address_directory",
+    "manifest.json": "manifest",
+}
+# First byte of every JSON document this project writes (leading whitespace aside)
+_JSON_START = frozenset(b'{["-0123456789tfn')
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, data):
+        return json.dumps(data, separators=(",", ":")).encode()
+
+    def decode(self, raw):
+        return json.loads(raw)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    def encode(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def decode(self, raw):
+        if msgpack is None:
+            raise RuntimeError("This file is MessagePack-encoded; install msgpack to read it (pip install msgpack)")
+        return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+
+
+CODECS = {"json": JsonCodec(), "msgpack": MsgpackCodec()}
+
+_config = None
+
+
+def _codec_config():
+    global _config
+    if _config is None:
+        config = {}
+        if os.path.exists(CONFIG_PATH):
+            with open(CONFIG_PATH, "r") as f:
+                config = (yaml.safe_load(f) or {}).get("codec") or {}
+        _config = config
+    return _config
+
+
+def codec_for(path):
+    """The codec new writes of this file should use."""
+    config = _codec_config()
+    kind = FILE_KINDS.get(os.path.basename(path))
+    name = config.get(kind) or config.get("default") or "json"
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec {name!r} for {kind or path} in {CONFIG_PATH}")
+    if name == "msgpack" and msgpack is None:
+        warnings.warn(f"msgpack is not installed; writing {path} as JSON")
+        name = "json"
+    return CODECS[name]
+
+
+def detect(raw):
+    """The codec a file's bytes were written with."""
+    start = raw.lstrip()[:1]
+    if not start or start[0] in _JSON_START:
+        return CODECS["json"]
+    return CODECS["msgpack"]
+
+
+def encode(path, data):
+    return codec_for(path).encode(data)
+
+
+def decode(raw):
+    return detect(raw).decode(raw)
+
+
+# ---------- Tools ----------
+def data_files(root=DATA_ROOT):
+    """Every codec-managed file under root."""
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if filename in FILE_KINDS:
+                yield os.path.join(dirpath, filename)
+
+
+def convert(paths, to):
+    """Re-encode paths with the named codec; returns {path: (old size, new size)}."""
+    from storage import _write_doc  # atomic write; storage imports this module
+    from locks import file_lock
+
+    codec = CODECS[to]
+    sizes = {}
+    for path in paths:
+        with file_lock(path):
+            with open(path, "rb") as f:
+                raw = f.read()
+            encoded = codec.encode(decode(raw))
+            _write_doc(path, encoded)
+        sizes[path] = (len(raw), len(encoded))
+    return sizes
+
+
+def bench(paths, repeat=5):
+    """Per file kind: bytes and best-of-repeat parse seconds for each encoding."""
+    import time
+
+    encoders = {
+        "json (indent=2)": lambda d: json.dumps(d, indent=2).encode(),
+        "json (compact)": CODECS["json"].encode,
+    }
+    if msgpack is not None:
+        encoders["msgpack"] = CODECS["msgpack"].encode
+
+    report = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            data = decode(f.read())
+        kind = report.setdefault(FILE_KINDS[os.path.basename(path)], {})
+        for label, encoder in encoders.items():
+            raw = encoder(data)
+            best = float("inf")
+            for _ in range(repeat):
+                started = time.perf_counter()
+                detect(raw).decode(raw)
+                best = min(best, time.perf_counter() - started)
+            totals = kind.setdefault(label, {"bytes": 0, "parse_s": 0.0})
+            totals["bytes"] += len(raw)
+            totals["parse_s"] += best
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert or benchmark the data file codecs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_convert = sub.add_parser("convert", help="re-encode data files")
+    p_convert.add_argument("--to", choices=sorted(CODECS), required=True)
+    p_convert.add_argument("paths", nargs="*", help=f"files to convert (default: every data file under {DATA_ROOT}/)")
+    p_bench = sub.add_parser("bench", help="compare parse time and size")
+    p_bench.add_argument("paths", nargs="*", help=f"files to measure (default: every data file under {DATA_ROOT}/)")
+    p_bench.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        if args.to == "msgpack" and msgpack is None:
+            raise SystemExit("msgpack is not installed (pip install msgpack)")
+        sizes = convert(args.paths or list(data_files()), args.to)
+        before = sum(old for old, _ in sizes.values())
+        after = sum(new for _, new in sizes.values())
+        print(f"Converted {len(sizes)} files to {args.to}: {before:,} -> {after:,} bytes")
+    else:
+        report = bench(args.paths or list(data_files()), args.repeat)
+        for kind, results in sorted(report.items()):
+            print(kind)
+            for label, totals in results.items():
+                print(f"  {label:<16} {totals['bytes']:>12,} bytes  {totals['parse_s'] * 1000:>9.2f} ms")
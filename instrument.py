@@ -0,0 +1,112 @@
+# instrument.py
+"""
+Per-rerun I/O instrumentation for the data modules.
+
+The load and save helpers of every data module are wrapped with
+@instrumented(name), and storage.py reports the files it opens and the
+bytes it reads and writes through record_read / record_write. Nothing is
+recorded unless a run is active on the current thread:
+
+    run = begin_run()      # top of app.py, once per Streamlit rerun
+    ...
+    run.to_dict()          # {"calls": {...}, "io": {...}, "wall_s": ...}
+
+Times are inclusive: a wrapped function that calls another wrapped
+function counts the inner call's time too. Byte counts cover the JSON
+backend; SQLite reads are counted as calls and time only.
+"""
+import functools
+import threading
+import time
+
+_local = threading.local()
+
+
+class RunStats:
+    """Counters for one rerun: calls and time per function, plus file I/O."""
+
+    def __init__(self, label=None):
+        self.label = label
+        self.started = time.time()
+        self._clock = time.perf_counter()
+        self.finished = None
+        self.calls = {}  # name -> [calls, seconds]
+        self.files_read = 0
+        self.bytes_read = 0
+        self.files_written = 0
+        self.bytes_written = 0
+
+    def add_call(self, name, seconds):
+        entry = self.calls.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def finish(self):
+        if self.finished is None:
+            self.finished = time.perf_counter()
+
+    def to_dict(self):
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return {
+            "label": self.label,
+            "started": self.started,
+            "wall_s": end - self._clock,
+            "calls": {
+                name: {"calls": calls, "seconds": seconds}
+                for name, (calls, seconds) in sorted(self.calls.items(), key=lambda item: -item[1][1])
+            },
+            "io": {
+                "files_read": self.files_read,
+                "bytes_read": self.bytes_read,
+                "files_written": self.files_written,
+                "bytes_written": self.bytes_written
+            }
+        }
+
+
+def begin_run(label=None):
+    """Start recording on this thread, finishing any run already in progress."""
+    end_run()
+    _local.run = RunStats(label)
+    return _local.run
+
+def end_run():
+    """Stop recording on this thread and return the finished run (or None)."""
+    run = getattr(_local, "run", None)
+    _local.run = None
+    if run is not None:
+        run.finish()
+    return run
+
+def current_run():
+    return getattr(_local, "run", None)
+
+
+def instrumented(name):
+    """Decorator counting calls and wall time of fn under name in the active run."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            run = getattr(_local, "run", None)
+            if run is None:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                run.add_call(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def record_read(nbytes, files=1):
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run.files_read += files
+        run.bytes_read += nbytes
+
+def record_write(nbytes, files=1):
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run.files_written += files
+        run.bytes_written += nbytes
@@ -0,0 +1,217 @@
+# ledger.py
+import json
+import os
+import threading
+
+from instrument import record_write
+from locks import file_lock, user_locks
+from storage import _repair_tail
+
+LEDGER_WAL_PATH = "data/ledger.wal"
+CHECKPOINT_EVERY = 200  # commits between checkpoints to the per-user files
+
+
+class Ledger:
+    """
+    Write-ahead-logged balance engine.
+
+    Balances are held in memory per user. Every commit appends one line to
+    the WAL and fsyncs it before the in-memory state changes, so a
+    multi-party transfer is a single durable write. The per-user files are
+    only rewritten at checkpoints, after which the WAL is replaced by an
+    empty one.
+
+    WAL records carry the resulting balance of every address they touch
+    rather than the delta. This makes replay idempotent: a crash partway
+    through a checkpoint cannot double-apply a transfer.
+
+    Several processes can share one WAL. Commits hold the WAL lock shared
+    plus the "balances" stripes of the users involved, and every operation
+    first applies whatever other processes appended since it last looked.
+    A checkpoint holds the WAL lock exclusively; the others notice the new
+    WAL file and reload from the checkpointed per-user files.
+
+    A WAL file starts with a {"wal": <random id>} header, so a process can
+    tell a fresh WAL from the one it was reading even if the inode number
+    is reused.
+    """
+
+    def __init__(self, wal_path, load, save, checkpoint_every=CHECKPOINT_EVERY):
+        self.wal_path = wal_path
+        self._load = load
+        self._save = save
+        self.checkpoint_every = checkpoint_every
+        self._lock = threading.RLock()  # guards the in-memory state below
+        self._balances = {}
+        self._dirty = set()
+        self._identity = None  # (inode, header id) of the WAL file being followed
+        self._offset = 0   # bytes of the current WAL file applied so far
+        self._records = 0  # records in the current WAL file
+
+    # ----- replay -----
+    def _catch_up(self):
+        """Apply records appended since the last call; caller holds the WAL lock and self._lock."""
+        try:
+            f = open(self.wal_path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            header = f.readline()
+            wal_id = json.loads(header).get("wal") if header.endswith(b"\n") else None
+            identity = (os.fstat(f.fileno()).st_ino, wal_id)
+            if identity != self._identity:
+                if self._identity is not None:
+                    # Checkpointed elsewhere: our view may miss the tail of the old WAL
+                    self._balances.clear()
+                    self._dirty.clear()
+                self._identity, self._offset, self._records = identity, 0, 0
+            if self._offset == 0 and wal_id is not None:
+                self._offset = len(header)
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn final record was never acknowledged
+                self._apply(json.loads(line))
+                self._offset += len(line)
+                self._records += 1
+
+    def _apply(self, record):
+        if "replace" in record:
+            user_id = record["replace"]
+            self._balances[user_id] = record["balances"]
+            self._dirty.add(user_id)
+        for user_id, address, usdc in record.get("set", []):
+            wallet = self._user(user_id).setdefault(address, {"USDC": 0})
+            wallet["USDC"] = usdc
+            self._dirty.add(user_id)
+
+    def _user(self, user_id):
+        if user_id not in self._balances:
+            self._balances[user_id] = self._load(user_id)
+        return self._balances[user_id]
+
+    # ----- reads -----
+    def balances(self, user_id):
+        with file_lock(self.wal_path, shared=True), self._lock:
+            self._catch_up()
+            return {address: dict(wallet) for address, wallet in self._user(user_id).items()}
+
+    def wallet(self, user_id, address):
+        with file_lock(self.wal_path, shared=True), self._lock:
+            self._catch_up()
+            return dict(self._user(user_id).get(address, {"USDC": 0}))
+
+    # ----- writes -----
+    def _new_wal(self):
+        """Write an empty WAL (just its header) next to the real one and return its path."""
+        os.makedirs(os.path.dirname(self.wal_path) or ".", exist_ok=True)
+        tmp_path = f"{self.wal_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"wal": os.urandom(8).hex()}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp_path
+
+    def _tail_is_clean(self):
+        try:
+            with open(self.wal_path, "rb") as f:
+                if f.seek(0, os.SEEK_END) == 0:
+                    return True
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) == b"\n"
+        except FileNotFoundError:
+            return True
+
+    def _repair(self):
+        """
+        Cut a torn final record left by a writer that crashed mid-append,
+        so the next record starts on its own line. Called before taking
+        the WAL lock shared; the cut happens under the exclusive lock, when
+        no other writer can be mid-append.
+        """
+        if self._tail_is_clean():
+            return
+        with file_lock(self.wal_path):
+            if not self._tail_is_clean():
+                _repair_tail(self.wal_path)
+
+    def _append(self, record):
+        """Durably append one record and apply it; True once a checkpoint is due."""
+        if not os.path.exists(self.wal_path):
+            tmp_path = self._new_wal()
+            try:
+                os.link(tmp_path, self.wal_path)  # only the first of racing writers wins
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp_path)
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        fd = os.open(self.wal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        record_write(len(line))
+        with self._lock:
+            self._catch_up()
+            return self._records >= self.checkpoint_every
+
+    def commit(self, deltas, minimums=(), error="Insufficient balance"):
+        """
+        Atomically apply [(user_id, address, amount_delta), ...].
+
+        minimums: [(user_id, address, required)] checked against the current
+        balances before anything is written; ValueError(error) if any fails.
+        """
+        users = {user_id for user_id, _, _ in deltas} | {user_id for user_id, _, _ in minimums}
+        self._repair()
+        with file_lock(self.wal_path, shared=True), user_locks("balances", *users):
+            with self._lock:
+                self._catch_up()
+                for user_id, address, required in minimums:
+                    if self._user(user_id).get(address, {"USDC": 0})["USDC"] < required:
+                        raise ValueError(error)
+
+                after = {}
+                for user_id, address, delta in deltas:
+                    key = (user_id, address)
+                    if key not in after:
+                        after[key] = self._user(user_id).get(address, {"USDC": 0})["USDC"]
+                    after[key] += delta
+
+            due = self._append({"set": [[u, a, usdc] for (u, a), usdc in after.items()]})
+        if due:
+            self.checkpoint()
+
+    def replace(self, user_id, balances):
+        balances = {address: dict(wallet) for address, wallet in balances.items()}
+        self._repair()
+        with file_lock(self.wal_path, shared=True), user_locks("balances", user_id):
+            due = self._append({"replace": user_id, "balances": balances})
+        if due:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Flush every user the WAL touched to their files and start an empty WAL."""
+        with file_lock(self.wal_path), self._lock:
+            self._catch_up()
+            if not self._records:
+                return
+            for user_id in sorted(self._dirty):
+                self._save(user_id, self._balances[user_id])
+            os.replace(self._new_wal(), self.wal_path)
+            self._dirty.clear()
+            self._identity, self._offset, self._records = None, 0, 0
+            self._catch_up()
+
+    def flush(self):
+        """Replay any pending WAL records and checkpoint them."""
+        self.checkpoint()
+
+    def close(self):
+        self.checkpoint()
+        with self._lock:
+            self._balances.clear()
+            self._dirty.clear()
+            self._identity, self._offset, self._records = None, 0, 0
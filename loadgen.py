@@ -0,0 +1,326 @@
+# loadgen.py
+"""
+asyncio load generator: thousands of simulated traders, no Streamlit.
+
+    python loadgen.py --traders 2000 --ops 20 --threads 32
+
+Every trader is a coroutine that repeatedly picks a workflow (on-ramp,
+transfer, mint, list, buy, burn) and runs it through the same module
+calls, in the same order, as the matching app.py button. The blocking
+file I/O runs on a thread pool of --threads workers. Traders share the
+wallets of a synthetic data/ tree (see synthetic.py), or of --tree.
+
+The report gives throughput and p50/p95/p99 latency per workflow, then
+checks invariants on the final state:
+
+  * USDC is conserved: final total == initial total + on-ramps - gas paid
+  * no wallet balance is negative
+  * every live NFT is owned by a wallet of the user that holds it
+  * every listing points at a live NFT owned by its seller
+  * every NFT's last provenance event names its current owner
+
+Exits non-zero if an invariant fails.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+WORKFLOWS = {"onramp": 3, "transfer": 4, "mint": 2, "list": 2, "buy": 3, "burn": 1}
+PAGE_SIZE = 10
+
+
+class Rejected(Exception):
+    """The workflow stopped where app.py would show an error instead."""
+
+
+class Simulation:
+    def __init__(self, seed=0):
+        import chains, wallet
+        self.rng = random.Random(seed)
+        self.chains = list(chains.CHAINS)
+        self.directory = wallet.get_address_directory()
+        self.wallets = [(entry["user_id"], address) for address, entry in self.directory.items()]
+        self._lock = threading.Lock()
+        self.onramped = 0.0
+        self.gas_paid = 0.0
+
+    def _account(self, onramped=0.0, gas=0.0):
+        with self._lock:
+            self.onramped += onramped
+            self.gas_paid += gas
+
+    # ----- workflows: each mirrors one app.py action -----
+    def onramp(self, user_id, address, chain):
+        from balances import apply_transaction
+        apply_transaction(user_id, {"type": "onramp", "wallet": address, "amount": 500, "chain": chain,
+                                    "timestamp": datetime.utcnow().isoformat(), "gas_fee": 0, "direction": "in"})
+        self._account(onramped=500)
+
+    def transfer(self, user_id, address, chain):
+        from balances import transfer_many
+        from chains import CHAINS
+        recipient_user, recipient_address = self.rng.choice(self.wallets)
+        if recipient_address == address:
+            raise Rejected("self transfer")
+        amount, gas_fee = round(self.rng.uniform(1, 25), 2), CHAINS[chain]["gas_fee"]
+        try:
+            transfer_many(user_id, address, [(recipient_user, recipient_address, amount)], gas_fee, chain=chain)
+        except ValueError as e:
+            raise Rejected(str(e))
+        self._account(gas=gas_fee)
+
+    def _pay_gas(self, user_id, tx):
+        """Charge tx's gas and log tx in one apply_transaction, as the app does."""
+        from balances import apply_transaction
+        try:
+            apply_transaction(user_id, tx, error="not enough USDC for gas")
+        except ValueError as e:
+            raise Rejected(str(e))
+        self._account(gas=tx["gas_fee"])
+
+    def mint(self, user_id, address, chain):
+        from calculator import quote
+        from nfts import load_catalog, mint_nft, new_token_id
+        catalog = load_catalog()
+        if not catalog:
+            raise Rejected("no catalog")
+        asset, token_id = self.rng.choice(catalog), new_token_id()
+        self._pay_gas(user_id, {"type": "nft_mint", "wallet": address, "token_id": token_id,
+                                "asset_id": asset["asset_id"], "amount": 0, "chain": chain,
+                                "timestamp": datetime.utcnow().isoformat(),
+                                "gas_fee": quote(chain, "complex"), "direction": "out"})
+        mint_nft(asset, chain, user_id, address, token_id=token_id)
+
+    def _unlisted(self, address):
+        from marketplace import listed_token_ids
+        from nfts import list_nfts_by_owner
+        listed = listed_token_ids()
+        owned = [n for n in list_nfts_by_owner(owner_address=address) if n["token_id"] not in listed]
+        if not owned:
+            raise Rejected("nothing to use")
+        return self.rng.choice(owned)
+
+    def list(self, user_id, address, chain):
+        from calculator import quote
+        from marketplace import list_nft_for_sale, remove_listing
+        from balances import get_wallet_balance
+        nft = self._unlisted(address)
+        gas_fee = quote(chain, "medium")
+        if get_wallet_balance(user_id, address)["USDC"] < gas_fee:
+            raise Rejected("not enough USDC for gas")
+        price = float(self.rng.randint(1, 200))
+        try:
+            list_nft_for_sale(nft["token_id"], user_id, address, price, chain)
+        except ValueError as e:
+            raise Rejected(str(e))  # sold, moved or burned since we looked; no gas spent, as in the app
+        try:
+            self._pay_gas(user_id, {"type": "nft_listed", "wallet": address, "token_id": nft["token_id"],
+                                    "amount": price, "chain": chain, "timestamp": datetime.utcnow().isoformat(),
+                                    "gas_fee": gas_fee, "direction": "out"})
+        except Rejected:
+            remove_listing(nft["token_id"])  # spent meanwhile; the app delists too
+            raise
+
+    def buy(self, user_id, address, chain):
+        from calculator import quote
+        from marketplace import buy_listing, query_listings
+        from transactions import save_transaction
+        _, total = query_listings(limit=0)
+        if not total:
+            raise Rejected("empty marketplace")
+        page, _ = query_listings(sort=self.rng.choice(["price", "newest"]),
+                                 offset=self.rng.randrange(0, total, PAGE_SIZE), limit=PAGE_SIZE)
+        candidates = [l for l in page if l["seller_address"] != address]
+        if not candidates:
+            raise Rejected("only own listings")
+        listing = self.rng.choice(candidates)
+        gas_fee = quote(listing["chain"], "complex")
+        try:
+            buy_listing(listing["token_id"], user_id, address, gas_fee)
+        except ValueError as e:
+            raise Rejected(str(e))  # someone else bought it first, or we cannot pay
+        self._account(gas=gas_fee)
+        timestamp = datetime.utcnow().isoformat()
+        save_transaction(user_id, {"type": "nft_purchase", "wallet": address, "token_id": listing["token_id"],
+                                   "amount": listing["price"], "chain": listing["chain"], "timestamp": timestamp,
+                                   "gas_fee": gas_fee, "direction": "out", "seller": listing["seller_address"]})
+        save_transaction(listing["seller_user"], {"type": "nft_sold", "wallet": listing["seller_address"],
+                                                  "token_id": listing["token_id"], "amount": listing["price"],
+                                                  "chain": listing["chain"], "timestamp": timestamp,
+                                                  "gas_fee": 0, "direction": "in", "buyer": address})
+
+    def burn(self, user_id, address, chain):
+        from calculator import quote
+        from nfts import burn_nft
+        nft = self._unlisted(address)  # burning delists, but traders keep what they list
+        self._pay_gas(user_id, {"type": "nft_burn", "wallet": address, "token_id": nft["token_id"],
+                                "chain": chain, "timestamp": datetime.utcnow().isoformat(),
+                                "gas_fee": quote(chain, "medium"), "direction": "out"})
+        burn_nft(nft["token_id"])
+
+    # ----- driver -----
+    async def trader(self, index, ops, pool, think, samples, outcomes):
+        loop = asyncio.get_running_loop()
+        user_id, address = self.wallets[index % len(self.wallets)]
+        names, weights = list(WORKFLOWS), list(WORKFLOWS.values())
+        for _ in range(ops):
+            name = self.rng.choices(names, weights)[0]
+            chain = self.rng.choice(self.chains)
+            started = time.perf_counter()
+            try:
+                await loop.run_in_executor(pool, getattr(self, name), user_id, address, chain)
+                outcome = "ok"
+            except Rejected:
+                outcome = "rejected"
+            except Exception as e:  # a crash is a finding, not a reason to stop the run
+                outcome = f"error: {type(e).__name__}: {e}"
+            samples.setdefault(name, []).append(time.perf_counter() - started)
+            outcomes.setdefault(name, {}).setdefault(outcome, 0)
+            outcomes[name][outcome] += 1
+            if think:
+                await asyncio.sleep(self.rng.uniform(0, think))
+
+    async def run(self, traders, ops, threads, think):
+        samples, outcomes = {}, {}
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                self.trader(i, ops, pool, think, samples, outcomes) for i in range(traders)
+            ))
+            elapsed = time.perf_counter() - started
+        return samples, outcomes, elapsed
+
+
+def _percentile(sorted_samples, q):
+    return sorted_samples[min(int(len(sorted_samples) * q), len(sorted_samples) - 1)]
+
+
+def total_usdc():
+    from balances import load_balances
+    from wallet import list_users
+    return sum(w.get("USDC", 0) for u in list_users() for w in load_balances(u).values())
+
+
+def check_invariants(sim, initial_usdc):
+    """List of human-readable invariant violations in the current state."""
+    from balances import load_balances
+    from marketplace import load_marketplace
+    from nfts import get_nft_history, list_nfts_by_owner
+    from wallet import list_users
+
+    problems = []
+    final_usdc = total_usdc()
+    expected = initial_usdc + sim.onramped - sim.gas_paid
+    if abs(final_usdc - expected) > 1e-6 * max(1.0, abs(expected)):
+        problems.append(f"USDC not conserved: total {final_usdc:.6f}, expected {expected:.6f}")
+
+    for user_id in list_users():
+        for address, wallet in load_balances(user_id).items():
+            if wallet.get("USDC", 0) < -1e-9:
+                problems.append(f"negative balance: {user_id}/{address} = {wallet['USDC']:.6f}")
+
+    live = {}
+    for nft in list_nfts_by_owner():
+        if nft.get("burned"):
+            continue
+        live[nft["token_id"]] = nft
+        owner = sim.directory.get(nft["owner_address"])
+        if owner is None or owner["user_id"] != nft["owner_user"]:
+            problems.append(f"NFT {nft['token_id']} held by {nft['owner_user']}/{nft['owner_address']}, "
+                            f"which is not that user's wallet")
+        events = list(get_nft_history(nft["token_id"]))
+        if events:
+            last = events[-1]
+            last_owner = last.get("to_address", last.get("address"))
+            if last_owner != nft["owner_address"]:
+                problems.append(f"NFT {nft['token_id']} owned by {nft['owner_address']} "
+                                f"but its last event names {last_owner}")
+
+    for listing in load_marketplace():
+        nft = live.get(listing["token_id"])
+        if nft is None:
+            problems.append(f"listing {listing['token_id']} points at a missing or burned NFT")
+        elif nft["owner_address"] != listing["seller_address"]:
+            problems.append(f"listing {listing['token_id']} sold by {listing['seller_address']} "
+                            f"but owned by {nft['owner_address']}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent traders against the data modules")
+    parser.add_argument("--traders", type=int, default=1000)
+    parser.add_argument("--ops", type=int, default=20, help="workflows per trader")
+    parser.add_argument("--threads", type=int, default=32, help="thread pool size for blocking I/O")
+    parser.add_argument("--think", type=float, default=0.0, help="max think time between workflows, seconds")
+    parser.add_argument("--tree", help="existing data tree to run against (default: a fresh synthetic one)")
+    parser.add_argument("--users", type=int, default=200, help="users in the synthetic tree")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report JSON here as well")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_ROOT)
+    output = os.path.abspath(args.output) if args.output else None
+    start_dir = os.getcwd()
+    tree = args.tree
+    if tree is None:
+        from synthetic import generate
+        tree = tempfile.mkdtemp(prefix="crossmobi-load-")
+        generate(tree, users=args.users, wallets_per_user=2, nfts=args.users * 5,
+                 listings=args.users, transactions_per_user=20, seed=args.seed)
+        os.environ["STORAGE_BACKEND"] = "json"
+    os.chdir(tree)
+
+    try:
+        sim = Simulation(args.seed)
+        initial_usdc = total_usdc()
+        samples, outcomes, elapsed = asyncio.run(sim.run(args.traders, args.ops, args.threads, args.think))
+
+        import balances
+        balances._ledger.flush()
+        problems = check_invariants(sim, initial_usdc)
+    finally:
+        os.chdir(start_dir)
+        if args.tree is None:
+            shutil.rmtree(tree, ignore_errors=True)
+
+    operations = {}
+    for name, values in sorted(samples.items()):
+        values.sort()
+        operations[name] = {
+            "count": len(values),
+            "ops_per_s": len(values) / elapsed,
+            "p50_ms": _percentile(values, 0.50) * 1000,
+            "p95_ms": _percentile(values, 0.95) * 1000,
+            "p99_ms": _percentile(values, 0.99) * 1000,
+            "outcomes": outcomes[name]
+        }
+    completed = sum(len(v) for v in samples.values())
+    report = {
+        "traders": args.traders,
+        "threads": args.threads,
+        "elapsed_s": elapsed,
+        "workflows": completed,
+        "throughput_per_s": completed / elapsed,
+        "operations": operations,
+        "invariant_violations": problems
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
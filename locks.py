@@ -0,0 +1,91 @@
+# locks.py
+"""
+Striped inter-process locks for the read-modify-write paths.
+
+Every lock is an flock() on a small file under data/locks, so it holds
+across Streamlit sessions, worker processes and threads alike (each
+acquisition opens its own file descriptor). Per-user state is guarded by
+one of USER_STRIPES stripes per namespace, so writes for different users
+rarely wait on each other; shared files get one lock each.
+
+    with user_locks("balances", sender, recipient):
+        ...
+    with file_lock(NFT_REGISTRY_PATH):
+        ...
+
+Locks are re-entrant per thread. A single call takes its locks in sorted
+order; nested calls must follow file locks -> ledger -> user stripes.
+"""
+import fcntl
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+from urllib.parse import quote
+
+LOCK_DIR = "data/locks"
+USER_STRIPES = 64
+
+_held = threading.local()
+
+
+def _held_locks():
+    if not hasattr(_held, "locks"):
+        _held.locks = {}  # name -> [fd, depth, shared]
+    return _held.locks
+
+
+def _acquire(name, shared):
+    held = _held_locks()
+    entry = held.get(name)
+    if entry is not None:
+        if entry[2] and not shared:
+            raise RuntimeError(f"Cannot upgrade shared lock {name!r} to exclusive")
+        entry[1] += 1
+        return
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    fd = os.open(os.path.join(LOCK_DIR, name + ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+    except BaseException:
+        os.close(fd)
+        raise
+    held[name] = [fd, 1, shared]
+
+
+def _release(name):
+    held = _held_locks()
+    entry = held[name]
+    entry[1] -= 1
+    if entry[1] == 0:
+        del held[name]
+        fcntl.flock(entry[0], fcntl.LOCK_UN)
+        os.close(entry[0])
+
+
+@contextmanager
+def locked(*names, shared=False):
+    """Hold every named lock (deduplicated, taken in sorted order) for the block."""
+    acquired = []
+    try:
+        for name in sorted(set(names)):
+            _acquire(name, shared)
+            acquired.append(name)
+        yield
+    finally:
+        for name in reversed(acquired):
+            _release(name)
+
+
+def user_stripe(namespace, user_id):
+    return f"{namespace}-{zlib.crc32(str(user_id).encode()) % USER_STRIPES:02d}"
+
+
+def user_locks(namespace, *user_ids):
+    """Exclusive lock on the stripes of every user_id within namespace."""
+    return locked(*(user_stripe(namespace, user_id) for user_id in user_ids))
+
+
+def file_lock(path, shared=False):
+    """Lock dedicated to one shared data file."""
+    return locked("file-" + quote(path, safe=""), shared=shared)
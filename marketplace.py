@@ -1,32 +1,209 @@
 # marketplace.py
-import json, os
+import threading
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime
+from operator import itemgetter
 
-MARKETPLACE_FILE = "data/marketplace.json"
+from balances import transfer
+from cache import cached, invalidate
+from instrument import instrumented
+from locks import file_lock
+from nfts import get_nft, get_nfts, transfer_nft
+from storage import get_backend, MARKETPLACE_FILE, NFT_REGISTRY_PATH
+
+SORT_OPTIONS = ("price", "-price", "newest", "oldest")
 
 
 # ---------- Load & Save ----------
+@instrumented("_load_marketplace")
 def _load_marketplace():
-    if not os.path.exists(MARKETPLACE_FILE):
-        return []
-    with open(MARKETPLACE_FILE, "r") as f:
-        return json.load(f)
+    return get_backend().load_listings()
 
 
-def _save_marketplace(listings):
-    with open(MARKETPLACE_FILE, "w") as f:
-        json.dump(listings, f, indent=2)
+@instrumented("_save_marketplace")
+def _save_marketplace(listings, changed=None, removed=()):
+    get_backend().save_listings(listings, changed=changed, removed=removed)
 
 
-# ---------- Add Listing ----------
-def list_nft_for_sale(token_id, seller_user, seller_address, price, chain):
-    listings = _load_marketplace()
+# ---------- Order Book ----------
+class ListingStore:
+    """
+    Cached order book over the stored listings. Listings are indexed by
+    token_id, seller_user and seller_address, and kept in (price, token_id) order both
+    overall and per chain so price-range queries are a pair of bisects.
+    File order (the order listings were added in) is kept alongside as
+    ascending sequence numbers, so a listing is found by bisection too.
+    Listings are only reloaded when the backend reports a new version.
+    Writes hold the marketplace file lock from refresh to save. Adding a
+    listing also holds the registry lock (taken first, as burn_nft and
+    transfer_nft do), so the token cannot change hands or burn between
+    the ownership check and the save.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()  # a reload must not swap the indexes under a write
+        self._stamp = None
+        self._listings = []
+        self._order = []   # sequence number of each entry of _listings, ascending
+        self._seq = {}     # token_id -> its sequence number
+        self._by_token = {}
+        self._by_seller = {}
+        self._by_seller_address = {}
+        self._by_price = []
+        self._by_chain_price = {}
+        self._listed = {}  # seller_address (None = everyone) -> frozenset of token_ids
+
+    def _refresh(self):
+        with self._lock:
+            stamp = get_backend().version("listings")
+            if stamp != self._stamp:
+                self._build(_load_marketplace())
+                self._stamp = stamp
+
+    def _build(self, listings):
+        self._listings = listings
+        self._order = list(range(len(listings)))
+        self._seq = {listing["token_id"]: n for n, listing in enumerate(listings)}
+        self._by_token = {}
+        self._by_seller = {}
+        self._by_seller_address = {}
+        self._by_price = []
+        self._by_chain_price = {}
+        self._listed = {}
+        for listing in listings:
+            self._index(listing)
+            key = self._price_key(listing)
+            self._by_price.append(key)
+            self._by_chain_price.setdefault(listing["chain"], []).append(key)
+        # One sort per list instead of an insort per listing
+        self._by_price.sort()
+        for keys in self._by_chain_price.values():
+            keys.sort()
+
+    @staticmethod
+    def _price_key(listing):
+        return (listing["price"], listing["token_id"])
+
+    def _index(self, listing):
+        self._by_token[listing["token_id"]] = listing
+        self._by_seller.setdefault(listing["seller_user"], {})[listing["token_id"]] = listing
+        self._by_seller_address.setdefault(listing["seller_address"], set()).add(listing["token_id"])
+        self._listed.pop(None, None)
+        self._listed.pop(listing["seller_address"], None)
+
+    def _link(self, listing):
+        self._index(listing)
+        key = self._price_key(listing)
+        insort(self._by_price, key)
+        insort(self._by_chain_price.setdefault(listing["chain"], []), key)
+
+    def _unlink(self, listing):
+        del self._by_token[listing["token_id"]]
+        self._by_seller.get(listing["seller_user"], {}).pop(listing["token_id"], None)
+        self._by_seller_address.get(listing["seller_address"], set()).discard(listing["token_id"])
+        self._listed.pop(None, None)
+        self._listed.pop(listing["seller_address"], None)
+        key = self._price_key(listing)
+        for keys in (self._by_price, self._by_chain_price.get(listing["chain"], [])):
+            i = bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    def _save(self, changed=(), removed=()):
+        _save_marketplace(self._listings, changed=list(changed), removed=list(removed))
+        self._stamp = get_backend().version("listings")
+
+    # ----- reads -----
+    def all(self):
+        self._refresh()
+        return list(self._listings)
+
+    def get(self, token_id):
+        self._refresh()
+        return self._by_token.get(token_id)
+
+    def by_seller(self, seller_user):
+        self._refresh()
+        return list(self._by_seller.get(seller_user, {}).values())
+
+    def listed_token_ids(self, seller_address=None):
+        self._refresh()
+        listed = self._listed.get(seller_address)
+        if listed is None:
+            if seller_address is None:
+                listed = frozenset(self._by_token)
+            else:
+                listed = frozenset(self._by_seller_address.get(seller_address, ()))
+            self._listed[seller_address] = listed
+        return listed
+
+    def query(self, chain=None, min_price=None, max_price=None, sort="price", offset=0, limit=20):
+        self._refresh()
+        if sort not in SORT_OPTIONS:
+            raise ValueError(f"Unknown sort '{sort}'. Expected one of {SORT_OPTIONS}.")
+
+        if sort in ("price", "-price"):
+            keys = self._by_chain_price.get(chain, []) if chain else self._by_price
+            price = itemgetter(0)
+            lo = 0 if min_price is None else bisect_left(keys, min_price, key=price)
+            hi = len(keys) if max_price is None else bisect_right(keys, max_price, key=price)
+            total = max(hi - lo, 0)
+            if sort == "price":
+                window = keys[lo + offset:min(lo + offset + limit, hi)]
+            else:
+                start = hi - offset
+                window = keys[max(start - limit, lo):max(start, lo)][::-1]
+            return [self._by_token[token_id] for _, token_id in window], total
 
-    # Check if already listed
-    for listing in listings:
-        if listing["token_id"] == token_id:
-            raise ValueError("NFT is already listed for sale.")
+        # Listing order is file order, which is the order they were listed in
+        matches = [
+            l for l in self._listings
+            if (not chain or l["chain"] == chain)
+            and (min_price is None or l["price"] >= min_price)
+            and (max_price is None or l["price"] <= max_price)
+        ]
+        if sort == "newest":
+            matches.reverse()
+        return matches[offset:offset + limit], len(matches)
 
+    # ----- writes -----
+    def add(self, listing):
+        with file_lock(NFT_REGISTRY_PATH), file_lock(MARKETPLACE_FILE), self._lock:
+            self._refresh()
+            if listing["token_id"] in self._by_token:
+                raise ValueError("NFT is already listed for sale.")
+            nft = get_nft(listing["token_id"])
+            if nft is None or nft.get("burned"):
+                raise ValueError("NFT does not exist or has been burned.")
+            if (nft["owner_user"], nft["owner_address"]) != (listing["seller_user"], listing["seller_address"]):
+                raise ValueError("Only the NFT's current owner can list it.")
+            seq = self._order[-1] + 1 if self._order else 0
+            self._listings.append(listing)
+            self._order.append(seq)
+            self._seq[listing["token_id"]] = seq
+            self._link(listing)
+            self._save(changed=[listing])
+
+    def remove(self, token_id):
+        """Delete a token's listing; returns it, or None if it was not listed."""
+        with file_lock(MARKETPLACE_FILE), self._lock:
+            self._refresh()
+            listing = self._by_token.get(token_id)
+            if listing is None:
+                return None
+            self._unlink(listing)
+            i = bisect_left(self._order, self._seq.pop(token_id))
+            del self._listings[i]
+            del self._order[i]
+            self._save(removed=[token_id])
+            return listing
+
+
+_store = ListingStore()
+
+
+# ---------- Add Listing ----------
+def list_nft_for_sale(token_id, seller_user, seller_address, price, chain):
     listing = {
         "token_id": token_id,
         "seller_user": seller_user,
@@ -36,32 +213,74 @@ def list_nft_for_sale(token_id, seller_user, seller_address, price, chain):
         "listed_at": datetime.utcnow().isoformat()
     }
 
-    listings.append(listing)
-    _save_marketplace(listings)
+    _store.add(listing)
+    invalidate("load_marketplace")
     return listing
 
 
 # ---------- Remove ----------
 def remove_listing(token_id):
-    listings = _load_marketplace()
-    new_listings = [l for l in listings if l["token_id"] != token_id]
-    _save_marketplace(new_listings)
+    """Delist a token. Returns the removed listing, or None if it was not listed,
+    so of two concurrent buyers only one sees the listing come back."""
+    listing = _store.remove(token_id)
+    invalidate("load_marketplace")
+    return listing
+
+
+# ---------- Buy ----------
+def buy_listing(token_id, buyer_user, buyer_address, gas_fee):
+    """
+    Pay the seller (price + gas from the buyer, in one ledger commit) and
+    hand the NFT over. Runs under the registry lock, so the listing cannot
+    be bought, burned or moved by anyone else between the check and the
+    transfer. Raises ValueError if the token is no longer listed or the
+    buyer cannot pay; nothing changes in either case. Returns the listing.
+    """
+    with file_lock(NFT_REGISTRY_PATH):
+        listing = _store.get(token_id)
+        if listing is None:
+            raise ValueError("NFT is no longer listed for sale.")
+        transfer(buyer_user, buyer_address, listing["seller_user"], listing["seller_address"],
+                 listing["price"], gas_fee)
+        transfer_nft(token_id, buyer_user, buyer_address, chain=listing["chain"])  # also delists it
+    return listing
 
 
 # ---------- Lookup ----------
 def get_listing(token_id):
-    listings = _load_marketplace()
-    for l in listings:
-        if l["token_id"] == token_id:
-            return l
-    return None
+    return _store.get(token_id)
 
 
+@instrumented("load_marketplace")
+@cached("load_marketplace", stamp=lambda: get_backend().version("listings"))
 def load_marketplace():
-    return _load_marketplace()
+    return _store.all()
+
+
+def listed_token_ids(seller_address=None):
+    """frozenset of token_ids currently listed, optionally only by one seller wallet"""
+    return _store.listed_token_ids(seller_address)
+
+
+def load_marketplace_with_nfts(listings=None):
+    """
+    Join listings (all of them by default) with their NFT records in one
+    registry read. Returns [(listing, nft)], dropping orphaned listings.
+    """
+    if listings is None:
+        listings = _store.all()
+    nfts = get_nfts([l["token_id"] for l in listings])
+    return [(l, nfts[l["token_id"]]) for l in listings if l["token_id"] in nfts]
 
 
 def get_listings_by_user(seller_user):
-    listings = _load_marketplace()
-    return [l for l in listings if l["seller_user"] == seller_user]
+    return _store.by_seller(seller_user)
+
 
+def query_listings(chain=None, min_price=None, max_price=None, sort="price", offset=0, limit=20):
+    """
+    Return one page of listings and the total number of matches.
+    sort: "price" (cheapest first), "-price", "newest" or "oldest".
+    """
+    return _store.query(chain=chain, min_price=min_price, max_price=max_price,
+                        sort=sort, offset=offset, limit=limit)
@@ -1,12 +1,20 @@
 # nfts.py
-import json, os, uuid
+import json, os, threading, uuid
 from datetime import datetime
 
+from cache import cached, invalidate
+from instrument import instrumented
+from locks import file_lock
+from nfttable import append_delta, open_table, write_table
+from storage import file_stamp, get_backend, NFT_REGISTRY_PATH, NFT_TABLE_PATH
+from thumbnails import prefetch as prefetch_thumbnail
+
 CATALOG_PATH = "data/portfolio_catalog.json"
-NFT_REGISTRY_PATH = "data/nfts.json"
 
 
 # ---------- Catalog ----------
+@instrumented("load_catalog")
+@cached("load_catalog", stamp=lambda: file_stamp(CATALOG_PATH))
 def load_catalog():
     if not os.path.exists(CATALOG_PATH):
         return []
@@ -15,24 +23,156 @@ def load_catalog():
 
 
 # ---------- Registry Helpers ----------
+@instrumented("_load_registry")
 def _load_registry():
-    if not os.path.exists(NFT_REGISTRY_PATH):
-        return []
-    with open(NFT_REGISTRY_PATH, "r") as f:
-        return json.load(f)
+    return get_backend().load_nfts()
+
+@instrumented("_save_registry")
+def _save_registry(nfts, changed=None):
+    get_backend().save_nfts(nfts, changed=changed)
+
+@instrumented("_record_event")
+def _record_event(token_id, event):
+    get_backend().append_nft_events([{"token_id": token_id, **event}])
+
+def _split_history(nfts):
+    """
+    Move embedded "history" lists out of registry records into the event
+    store. Tokens that already have stored events are skipped, so an
+    interrupted split can simply run again. Returns True if any moved.
+    """
+    backend = get_backend()
+    events, moved = [], False
+    for nft in nfts:
+        if "history" not in nft:
+            continue
+        history = nft.pop("history")
+        moved = True
+        if next(iter(backend.iter_nft_events(nft["token_id"])), None) is None:
+            events.extend({"token_id": nft["token_id"], **event} for event in history)
+    if events:
+        backend.append_nft_events(events)
+    return moved
+
+
+class NFTRegistry:
+    """
+    Cached view of the registry, held as an NFTTable (see nfttable.py).
+    The table is only reloaded when the backend reports a new version (for
+    JSON, the mtime and size of the file and its journal); it is
+    memory-mapped from the table file when that file and its delta reach
+    the same version, and rebuilt from the backend otherwise. Writes save
+    only the changed record, to the backend and to the table's delta.
+    Token lookups bisect the table's token order and owner lookups scan
+    the owner columns, so neither needs per-record index entries.
+    Returned records are dict-like views shared with the cache and should
+    be treated as read-only outside this module. Records hold current
+    state only; provenance lives in the event store (see get_nft_history).
+    Writes refresh, change and save under the registry's file lock, so
+    concurrent sessions and processes never overwrite each other.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()  # a reload must not swap the table under a write
+        self._stamp = None
+        self._table = None
+
+    def _refresh(self):
+        with self._lock:
+            stamp = get_backend().version("nfts")
+            if self._table is None or stamp != self._stamp:  # no registry file yet: stamp is None
+                table = open_table(NFT_TABLE_PATH, stamp)
+                if table is None:
+                    nfts = _load_registry()
+                    if _split_history(nfts):
+                        _save_registry(nfts)  # one-time migration of embedded history
+                        stamp = get_backend().version("nfts")
+                    table = write_table(NFT_TABLE_PATH, nfts, stamp)
+                self._table = table
+                self._stamp = stamp
+
+    def _save(self, changed):
+        # dicts() is lazy: backends only walk it when they rewrite everything
+        _save_registry(self._table.dicts(), changed=[dict(changed)])
+        self._stamp = get_backend().version("nfts")
+        self._table = append_delta(NFT_TABLE_PATH, self._table, [changed], self._stamp)
+
+    # ----- reads -----
+    def all(self):
+        self._refresh()
+        return self._table.records()
+
+    def get(self, token_id):
+        self._refresh()
+        row = self._table.row(token_id)
+        return None if row is None else self._table.record(row)
+
+    def get_many(self, token_ids):
+        self._refresh()
+        table = self._table
+        rows = {t: table.row(t) for t in token_ids}
+        return {t: table.record(row) for t, row in rows.items() if row is not None}
+
+    def by_owner(self, owner_user=None, owner_address=None):
+        self._refresh()
+        if not (owner_user or owner_address):
+            return self._table.records()
+        # registry order, as the old linear scan returned
+        return self._table.records(self._table.find(owner_user, owner_address))
+
+    # ----- writes -----
+    def add(self, nft):
+        with file_lock(NFT_REGISTRY_PATH), self._lock:
+            self._refresh()
+            self._table.append(nft)
+            self._save(nft)
+
+    def update(self, token_id, mutate):
+        """Apply mutate(nft) to one record and save it."""
+        with file_lock(NFT_REGISTRY_PATH), self._lock:
+            self._refresh()
+            row = self._table.row(token_id)
+            if row is None:
+                return None
+            nft = self._table.record(row)
+            mutate(nft)
+            self._save(nft)
+            return nft
 
-def _save_registry(nfts):
-    with open(NFT_REGISTRY_PATH, "w") as f:
-        json.dump(nfts, f, indent=2)
+
+_registry = NFTRegistry()
+
+
+def _invalidate_owner_views(*owners):
+    """Drop cached list_nfts_by_owner results that could include these (user, address) owners."""
+    invalidate("list_nfts_by_owner", owner_user=None, owner_address=None)
+    for owner_user, owner_address in owners:
+        if owner_user:
+            invalidate("list_nfts_by_owner", owner_user=owner_user)
+        if owner_address:
+            invalidate("list_nfts_by_owner", owner_address=owner_address)
+
+
+def _drop_listing(token_id):
+    """
+    Delist a token that changed hands or burned. Called under the registry
+    lock, which is always taken before the marketplace's.
+    """
+    from marketplace import remove_listing  # marketplace imports this module
+    remove_listing(token_id)
 
 
 # ---------- Mint ----------
-def mint_nft(asset, chain, owner_user, owner_address):
+def new_token_id():
+    return str(uuid.uuid4())  # simple unique ID; could be numeric
+
+def mint_nft(asset, chain, owner_user, owner_address, token_id=None):
     """
     asset: dict from catalog (asset_id, title, image_url, description, tags)
+    token_id: from new_token_id(), when it has to be known before the mint
+    (e.g. to log the gas payment first); a new one by default.
     """
-    nfts = _load_registry()
-    token_id = str(uuid.uuid4())  # simple unique ID; could be numeric
+    token_id = token_id or new_token_id()
     now = datetime.utcnow().isoformat()
 
     nft = {
@@ -44,89 +184,87 @@ def mint_nft(asset, chain, owner_user, owner_address):
         "chain": chain,
         "owner_user": owner_user,
         "owner_address": owner_address,
-        "minted_at": now,
-        "history": [
-            {"event": "mint", "user": owner_user, "address": owner_address, "ts": now, "chain": chain}
-        ]
+        "minted_at": now
     }
-    nfts.append(nft)
-    _save_registry(nfts)
+    with file_lock(NFT_REGISTRY_PATH):  # events land in the same order as the writes
+        _registry.add(nft)
+        _record_event(token_id, {"event": "mint", "user": owner_user, "address": owner_address, "ts": now, "chain": chain})
+    _invalidate_owner_views((owner_user, owner_address))
+    prefetch_thumbnail(nft["asset_id"], nft["image_url"])
     return nft
 
 
 # ---------- Transfer ----------
 def transfer_nft(token_id, new_owner_user, new_owner_address, chain=None):
-    nfts = _load_registry()
     now = datetime.utcnow().isoformat()
-    updated = None
+    previous_owners = []
 
-    for nft in nfts:
-        if nft["token_id"] == token_id:
-            prev_user = nft["owner_user"]
-            prev_addr = nft["owner_address"]
-            nft["owner_user"] = new_owner_user
-            nft["owner_address"] = new_owner_address
-            if chain:
-                nft["chain"] = chain  # optional "bridge" simulation
-            nft["history"].append({
-                "event": "transfer",
-                "from_user": prev_user,
-                "from_address": prev_addr,
-                "to_user": new_owner_user,
-                "to_address": new_owner_address,
-                "ts": now,
-                "chain": chain or nft["chain"]
-            })
-            updated = nft
-            break
-
-    if updated is None:
-        raise ValueError(f"NFT {token_id} not found.")
-
-    _save_registry(nfts)
+    def _apply(nft):
+        if nft.get("burned"):
+            raise ValueError(f"NFT {token_id} has been burned.")
+        previous_owners.append((nft["owner_user"], nft["owner_address"]))
+        nft["owner_user"] = new_owner_user
+        nft["owner_address"] = new_owner_address
+        if chain:
+            nft["chain"] = chain  # optional "bridge" simulation
+
+    with file_lock(NFT_REGISTRY_PATH):
+        updated = _registry.update(token_id, _apply)
+        if updated is None:
+            raise ValueError(f"NFT {token_id} not found.")
+
+        prev_user, prev_addr = previous_owners[0]
+        _record_event(token_id, {
+            "event": "transfer",
+            "from_user": prev_user,
+            "from_address": prev_addr,
+            "to_user": new_owner_user,
+            "to_address": new_owner_address,
+            "ts": now,
+            "chain": chain or updated["chain"]
+        })
+        _drop_listing(token_id)  # the old owner's asking price no longer applies
+
+    _invalidate_owner_views((new_owner_user, new_owner_address), *previous_owners)
     return updated
 
 
 # ---------- Query ----------
+@instrumented("list_nfts_by_owner")
+@cached("list_nfts_by_owner", stamp=lambda *_: get_backend().version("nfts"))
 def list_nfts_by_owner(owner_user=None, owner_address=None):
-    nfts = _load_registry()
-    results = []
-    for nft in nfts:
-        if owner_user and nft["owner_user"] != owner_user:
-            continue
-        if owner_address and nft["owner_address"] != owner_address:
-            continue
-        results.append(nft)
-    return results
+    return _registry.by_owner(owner_user=owner_user, owner_address=owner_address)
 
 def get_nft(token_id):
-    nfts = _load_registry()
-    for nft in nfts:
-        if nft["token_id"] == token_id:
-            return nft
-    return None
+    return _registry.get(token_id)
 
-def burn_nft(token_id: str):
-    nfts = _load_registry()
-    now = datetime.utcnow().isoformat()
-    updated = False
-
-    for nft in nfts:
-        if nft["token_id"] == token_id:
-            nft["owner_user"] = None
-            nft["owner_address"] = None
-            nft["burned"] = True
-            nft["history"].append({
-                "event": "burn",
-                "ts": now,
-                "chain": nft.get("chain", "unknown")
-            })
-            updated = True
-            break
+def get_nfts(token_ids):
+    """{token_id: nft} for every id that exists, resolved in one registry read"""
+    return _registry.get_many(token_ids)
 
-    if not updated:
-        raise ValueError(f"NFT with token_id {token_id} not found.")
+def get_nft_history(token_id):
+    """Stream a token's provenance events (mint, transfer, burn), oldest first"""
+    _registry._refresh()  # make sure any embedded history has been split out
+    return get_backend().iter_nft_events(token_id)
 
-    _save_registry(nfts)
+def burn_nft(token_id: str):
+    now = datetime.utcnow().isoformat()
+    previous_owners = []
 
+    def _apply(nft):
+        previous_owners.append((nft["owner_user"], nft["owner_address"]))
+        nft["owner_user"] = None
+        nft["owner_address"] = None
+        nft["burned"] = True
 
+    with file_lock(NFT_REGISTRY_PATH):
+        burned = _registry.update(token_id, _apply)
+        if burned is None:
+            raise ValueError(f"NFT with token_id {token_id} not found.")
+        _record_event(token_id, {
+            "event": "burn",
+            "ts": now,
+            "chain": burned.get("chain", "unknown")
+        })
+        _drop_listing(token_id)
+    _invalidate_owner_views(*previous_owners)
@@ -0,0 +1,402 @@
+# nfttable.py
+"""
+Compact in-memory NFT registry.
+
+Records are held as a struct of arrays: one uint32 column per field, each
+value a code into a sorted string pool, so the chain names, owners and
+catalog text that repeat across tokens are stored once. The table has a
+fixed binary layout and is saved next to the registry (data/nfts.tbl),
+tagged with the registry version it was built from; opening it is an
+mmap plus a header read, and nothing is decoded until a row is accessed.
+
+Registry writes append the changed records to data/nfts.tbl.delta, each
+step tagged with the versions it goes from and to, and opening replays
+the steps that follow on from the file's version. The file is rebuilt
+once the delta grows past DELTA_RATIO of its size.
+
+    header | stamp | one column per field | token order | string offsets | string bytes
+
+Rows are exposed through NFTRecord, a dict-like view with __slots__.
+Writes copy the columns out of the mapping once and then patch them in
+place; strings not in the file go to a small in-memory pool.
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from storage import _append_lines, _read_lines, _write_doc, file_stamp
+
+MAGIC = b"NFTTBL01"
+# magic, stamp bytes, column count, rows, strings, string bytes
+HEADER = struct.Struct("<8sIIQQQ")
+FIELDS = ("token_id", "asset_id", "name", "image_url", "description", "chain",
+          "owner_user", "owner_address", "minted_at")
+# Anything else a record carries (e.g. "burned") is kept as one JSON object per row
+COLUMNS = FIELDS + ("extra",)
+MISSING = 0xFFFFFFFF  # key not present
+NULL = 0xFFFFFFFE     # value is None
+DELTA_SUFFIX = ".delta"
+DELTA_RATIO = 0.125
+
+
+def _pad(raw):
+    return raw + b"\0" * (-len(raw) % 8)
+
+def _encode_stamp(stamp):
+    return json.dumps(stamp).encode()
+
+
+class _Pool:
+    """The file's sorted strings plus any added since, addressed by code."""
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+        self._base = len(offsets) - 1
+        self._added = []
+        self._index = {}
+
+    def __getitem__(self, code):
+        if code < self._base:
+            return str(self._blob[int(self._offsets[code]):int(self._offsets[code + 1])], "utf-8")
+        return self._added[code - self._base]
+
+    def __len__(self):
+        return self._base + len(self._added)
+
+    def find(self, value):
+        """The code of value, or None if it is not in the pool."""
+        code = self._index.get(value)
+        if code is None:
+            i = bisect.bisect_left(self, value, 0, self._base)
+            if i < self._base and self[i] == value:
+                code = i
+        return code
+
+    def code(self, value):
+        code = self.find(value)
+        if code is None:
+            code = self._index[value] = self._base + len(self._added)
+            self._added.append(value)
+        return code
+
+
+class NFTRecord(MutableMapping):
+    """Dict-like view of one row of an NFTTable."""
+
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, key):
+        return self._table.value(self._row, key)
+
+    def __setitem__(self, key, value):
+        self._table.set(self._row, key, value)
+
+    def __delitem__(self, key):
+        self._table.delete(self._row, key)
+
+    def __iter__(self):
+        return iter(self._table.keys(self._row))
+
+    def __len__(self):
+        return len(self._table.keys(self._row))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class NFTTable:
+    """Struct-of-arrays NFT registry, usually opened from a table file."""
+
+    def __init__(self, columns, order, pool, stamp=None):
+        self.stamp = stamp
+        self._columns = columns  # field -> uint32 codes; read-only while backed by the file
+        self._order = order      # file rows sorted by token_id code
+        self._pool = pool
+        self._rows = len(order)
+        self._file_rows = len(order)
+        self._sorted_tokens = None
+        self._appended = {}      # token_id -> row, for rows added since opening
+        self._writable = False
+
+    def __len__(self):
+        return self._rows
+
+    # ----- reads -----
+    def row(self, token_id):
+        """The row holding token_id, or None."""
+        row = self._appended.get(token_id)
+        if row is not None:
+            return row
+        code = self._pool.find(token_id)
+        if code is None or not self._file_rows:
+            return None
+        if self._sorted_tokens is None:
+            self._sorted_tokens = self._columns["token_id"][self._order]
+        i = int(np.searchsorted(self._sorted_tokens, code))
+        if i < self._file_rows and self._sorted_tokens[i] == code:
+            return int(self._order[i])
+        return None
+
+    def record(self, row):
+        return NFTRecord(self, row)
+
+    def records(self, rows=None):
+        """Views of the given rows (all of them by default), in row order."""
+        if rows is None:
+            rows = range(self._rows)
+        return [NFTRecord(self, int(row)) for row in rows]
+
+    def find(self, owner_user=None, owner_address=None):
+        """Rows owned by this user and/or address, in row order."""
+        keep = np.ones(self._rows, dtype=bool)
+        for field, value in (("owner_user", owner_user), ("owner_address", owner_address)):
+            if value:
+                code = self._pool.find(value)
+                if code is None:
+                    return []
+                keep &= self._columns[field][:self._rows] == code
+        return np.flatnonzero(keep)
+
+    def _extra(self, row):
+        code = int(self._columns["extra"][row])
+        return {} if code == MISSING else json.loads(self._pool[code])
+
+    def value(self, row, key):
+        if key in FIELDS:
+            code = int(self._columns[key][row])
+            if code == NULL:
+                return None
+            if code != MISSING:
+                return self._pool[code]
+        extra = self._extra(row)
+        if key not in extra:
+            raise KeyError(key)
+        return extra[key]
+
+    def keys(self, row):
+        present = [field for field in FIELDS if self._columns[field][row] != MISSING]
+        return present + list(self._extra(row))
+
+    def to_dict(self, row):
+        return {key: self.value(row, key) for key in self.keys(row)}
+
+    def dicts(self):
+        """Every row as a plain dict, generated one at a time (for saving)."""
+        return (self.to_dict(row) for row in range(self._rows))
+
+    # ----- writes -----
+    def _make_writable(self, capacity):
+        if self._writable and capacity <= len(self._columns["token_id"]):
+            return
+        size = max(capacity, 2 * self._rows, 16)
+        for field in COLUMNS:
+            column = np.full(size, MISSING, dtype=np.uint32)
+            column[:self._rows] = self._columns[field][:self._rows]
+            self._columns[field] = column
+        self._writable = True
+
+    def _set_extra(self, row, extra):
+        self._columns["extra"][row] = (
+            self._pool.code(json.dumps(extra, sort_keys=True, separators=(",", ":"))) if extra else MISSING
+        )
+
+    def set(self, row, key, value):
+        self._make_writable(self._rows)
+        extra = self._extra(row)
+        if key in FIELDS and (value is None or isinstance(value, str)):
+            self._columns[key][row] = NULL if value is None else self._pool.code(value)
+            if extra.pop(key, None) is not None:
+                self._set_extra(row, extra)
+        else:
+            if key in FIELDS:
+                self._columns[key][row] = MISSING
+            extra[key] = value
+            self._set_extra(row, extra)
+
+    def delete(self, row, key):
+        if key not in self.keys(row):
+            raise KeyError(key)
+        self._make_writable(self._rows)
+        if key in FIELDS:
+            self._columns[key][row] = MISSING
+        extra = self._extra(row)
+        if extra.pop(key, None) is not None:
+            self._set_extra(row, extra)
+
+    def append(self, nft):
+        """Add a record (a dict) as a new row and return the row number."""
+        self._make_writable(self._rows + 1)
+        row = self._rows
+        self._rows += 1
+        for key, value in nft.items():
+            self.set(row, key, value)
+        self._appended[nft["token_id"]] = row
+        return row
+
+    def put(self, nft):
+        """Make a record (a dict) the whole content of its token's row, adding one if needed."""
+        row = self.row(nft["token_id"])
+        if row is None:
+            return self.append(nft)
+        for key in self.keys(row):
+            if key not in nft:
+                self.delete(row, key)
+        for key, value in nft.items():
+            self.set(row, key, value)
+        return row
+
+
+# ---------- Table files ----------
+def encode_table(nfts, stamp):
+    """The table file for a list of record dicts, tagged with the registry's version."""
+    strings, index = [], {}
+    temp = {field: np.full(len(nfts), MISSING, dtype=np.uint32) for field in COLUMNS}
+
+    def intern(value):
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(strings)
+            strings.append(value)
+        return code
+
+    for row, nft in enumerate(nfts):
+        extra = {}
+        for key, value in nft.items():
+            if key not in FIELDS or not (value is None or isinstance(value, str)):
+                extra[key] = value
+            else:
+                temp[key][row] = NULL if value is None else intern(value)
+        if extra:
+            temp["extra"][row] = intern(json.dumps(extra, sort_keys=True, separators=(",", ":")))
+
+    # Renumber so codes follow string order, which lets lookups bisect the pool
+    by_value = sorted(range(len(strings)), key=strings.__getitem__)
+    remap = np.empty(len(strings), dtype=np.uint32)
+    remap[by_value] = np.arange(len(strings), dtype=np.uint32)
+    columns = {}
+    for field, codes in temp.items():
+        interned = codes < NULL
+        codes[interned] = remap[codes[interned]]
+        columns[field] = codes
+    order = np.argsort(columns["token_id"], kind="stable").astype(np.uint32)
+
+    encoded = [strings[i].encode() for i in by_value]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    np.cumsum([len(raw) for raw in encoded], out=offsets[1:])
+    stamp_raw = _encode_stamp(stamp)
+    parts = [HEADER.pack(MAGIC, len(stamp_raw), len(COLUMNS), len(nfts), len(encoded), int(offsets[-1])),
+             _pad(stamp_raw)]
+    parts += [columns[field].astype("<u4").tobytes() for field in COLUMNS]
+    parts.append(_pad(order.astype("<u4").tobytes()))
+    parts.append(offsets.tobytes())
+    parts.append(b"".join(encoded))
+    return b"".join(parts)
+
+
+def decode_table(buf, stamp=None):
+    """An NFTTable over buf (bytes or an mmap), or None if buf is not a table for stamp."""
+    if len(buf) < HEADER.size:
+        return None
+    magic, stamp_len, column_count, rows, string_count, blob_len = HEADER.unpack_from(buf)
+    if magic != MAGIC or column_count != len(COLUMNS):
+        return None
+    pos = HEADER.size
+    stamp_raw = bytes(buf[pos:pos + stamp_len])
+    if stamp is not None and stamp_raw != _encode_stamp(stamp):
+        return None
+    pos += len(_pad(stamp_raw))
+    columns = {}
+    for field in COLUMNS:
+        columns[field] = np.frombuffer(buf, dtype="<u4", count=rows, offset=pos)
+        pos += 4 * rows
+    order = np.frombuffer(buf, dtype="<u4", count=rows, offset=pos)
+    pos += 4 * rows
+    pos += -pos % 8
+    offsets = np.frombuffer(buf, dtype="<u8", count=string_count + 1, offset=pos)
+    pos += 8 * (string_count + 1)
+    blob = memoryview(buf)[pos:pos + blob_len]
+    return NFTTable(columns, order, _Pool(offsets, blob), stamp=json.loads(stamp_raw))
+
+
+def open_table(path, stamp=None):
+    """
+    Memory-map a table file and replay its delta; None if it is missing or
+    unreadable, or if stamp is given and the result is another version.
+    """
+    try:
+        with open(path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):  # ValueError: empty file
+        return None
+    table = decode_table(buf)
+    if table is None:
+        return None
+    # Steps from other versions (left by a rebuild that raced a write) are skipped
+    for step in _read_lines(path + DELTA_SUFFIX):
+        if step["prev"] == table.stamp:
+            for nft in step["nfts"]:
+                table.put(nft)
+            table.stamp = step["stamp"]
+    if stamp is not None and table.stamp != json.loads(_encode_stamp(stamp)):
+        return None
+    return table
+
+
+def write_table(path, nfts, stamp):
+    """Save the table for nfts, drop the old delta, and return the table opened from the new file."""
+    raw = encode_table(nfts, stamp)
+    _write_doc(path, raw)
+    try:
+        os.remove(path + DELTA_SUFFIX)
+    except FileNotFoundError:
+        pass
+    return open_table(path, stamp) or decode_table(raw)
+
+
+def append_delta(path, table, nfts, stamp):
+    """
+    Record nfts, already applied to table, as the step from the table's
+    version to stamp. Returns the table for stamp: table itself, or one
+    rebuilt from it once the delta has passed DELTA_RATIO of the file.
+    """
+    prev, table.stamp = table.stamp, json.loads(_encode_stamp(stamp))
+    _append_lines(path + DELTA_SUFFIX, [{"prev": prev, "stamp": table.stamp, "nfts": [dict(n) for n in nfts]}])
+    size, delta = file_stamp(path), file_stamp(path + DELTA_SUFFIX)
+    if size is None or delta[1] > size[1] * DELTA_RATIO:
+        return write_table(path, list(table.dicts()), stamp)
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from storage import NFT_TABLE_PATH, get_backend
+
+    parser = argparse.ArgumentParser(description="Build or inspect the NFT table file")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="rebuild the table from the registry")
+    sub.add_parser("stats", help="rows, strings and size of the table file")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        backend = get_backend()
+        stamp = backend.version("nfts")
+        table = write_table(NFT_TABLE_PATH, backend.load_nfts(), stamp)
+        print(f"Wrote {len(table):,} rows to {NFT_TABLE_PATH}")
+    else:
+        table = open_table(NFT_TABLE_PATH)
+        if table is None:
+            raise SystemExit(f"No table at {NFT_TABLE_PATH}; run `python nfttable.py build`")
+        current = table.stamp == json.loads(_encode_stamp(get_backend().version("nfts")))
+        print(f"{len(table):,} rows, {len(table._pool):,} strings, built from "
+              f"{'the current' if current else 'an older'} registry version")
@@ -0,0 +1,1010 @@
+# storage.py
+"""
+Storage backends for the data modules.
+
+wallet.py, balances.py, transactions.py, nfts.py and marketplace.py never
+touch files directly; they call get_backend(), which returns either the
+JSON-file layout under data/ or an embedded SQLite database, as selected
+by config.yaml (or the STORAGE_BACKEND environment variable).
+
+    python storage.py migrate      # import the data/ tree into SQLite
+"""
+import json
+import os
+import sqlite3
+import struct
+import threading
+from urllib.parse import quote
+
+import yaml
+
+import codec
+from instrument import record_read, record_write
+from locks import file_lock, user_locks
+
+CONFIG_PATH = "config.yaml"
+USER_ROOT = "data/users"
+NFT_REGISTRY_PATH = "data/nfts.json"
+NFT_TABLE_PATH = "data/nfts.tbl"  # derived, see nfttable.py
+MARKETPLACE_FILE = "data/marketplace.json"
+ADDRESS_DIRECTORY_PATH = "data/address_directory.json"
+NFT_EVENTS_PATH = "data/nft_events.jsonl"
+NFT_JOURNAL_PATH = "data/nfts.journal.jsonl"  # records changed since nfts.json was last written
+
+# nfts.json is rewritten (and its journal dropped) once the journal passes this share of its size
+NFT_JOURNAL_RATIO = 0.25
+
+# Transaction logs roll to a new segment once the active one passes this size
+SEGMENT_MAX_BYTES = 1024 * 1024
+# Per-wallet index entry pointing at one record: segment number, byte offset, length
+WALLET_INDEX_ENTRY = struct.Struct("<IQI")
+
+
+def load_config():
+    if not os.path.exists(CONFIG_PATH):
+        return {}
+    with open(CONFIG_PATH, "r") as f:
+        return yaml.safe_load(f) or {}
+
+
+class StorageBackend:
+    """Operations every backend provides. Records are plain dicts and lists."""
+
+    name = None
+
+    # ----- users & wallets -----
+    def list_users(self):
+        raise NotImplementedError
+
+    def create_user(self, user_id):
+        raise NotImplementedError
+
+    def load_wallets(self, user_id):
+        raise NotImplementedError
+
+    def save_wallets(self, user_id, wallets):
+        raise NotImplementedError
+
+    def load_all_wallets(self):
+        """[{"user_id", "address", "nickname"}] across every user, by full scan."""
+        raise NotImplementedError
+
+    # ----- address directory -----
+    def load_address_directory(self):
+        """{address: {"user_id", "nickname"}} for every wallet."""
+        raise NotImplementedError
+
+    def update_address_directory(self, upserts=None, removals=()):
+        raise NotImplementedError
+
+    def rebuild_address_directory(self):
+        """Recreate the directory from a full wallet scan and return it."""
+        raise NotImplementedError
+
+    # ----- balances -----
+    def load_balances(self, user_id):
+        raise NotImplementedError
+
+    def save_balances(self, user_id, balances):
+        raise NotImplementedError
+
+    def load_balance_snapshot(self, user_id):
+        """{"count", "balances"} derived from the first count transactions, or None."""
+        raise NotImplementedError
+
+    def save_balance_snapshot(self, user_id, snapshot):
+        raise NotImplementedError
+
+    # ----- transactions -----
+    def append_transactions(self, user_id, txs):
+        raise NotImplementedError
+
+    def iter_transactions(self, user_id, start=0):
+        """A user's transactions oldest first, skipping the first `start`."""
+        raise NotImplementedError
+
+    def transactions_version(self, user_id):
+        """A value that changes whenever user_id's transactions grow."""
+        raise NotImplementedError
+
+    def wallet_transactions(self, user_id, address, limit, before=None):
+        """
+        Newest-first page of one wallet's transactions and the cursor for
+        the next (older) page, or None when there is nothing older.
+        """
+        raise NotImplementedError
+
+    # ----- nfts & listings -----
+    def load_nfts(self):
+        raise NotImplementedError
+
+    def save_nfts(self, nfts, changed=None):
+        """
+        Persist the registry, an iterable of records. changed, if given,
+        lists the only records that differ.
+        """
+        raise NotImplementedError
+
+    def load_listings(self):
+        raise NotImplementedError
+
+    def save_listings(self, listings, changed=None, removed=()):
+        """Persist the order book. changed/removed, if given, describe the delta."""
+        raise NotImplementedError
+
+    def version(self, collection, user_id=None):
+        """
+        Opaque token that changes whenever a collection is written: "nfts",
+        "listings", "users", "address_directory", or one user's "wallets".
+        """
+        raise NotImplementedError
+
+    # ----- nft provenance -----
+    def append_nft_events(self, events):
+        """Append provenance events; each carries its token_id."""
+        raise NotImplementedError
+
+    def iter_nft_events(self, token_id=None):
+        """One token's events oldest first (every event if token_id is None)."""
+        raise NotImplementedError
+
+
+# ---------- Data files ----------
+def get_wallet_file(user_id):
+    return f"{USER_ROOT}/{user_id}/wallets.json"
+
+def get_balance_file(user_id):
+    return f"{USER_ROOT}/{user_id}/balances.json"
+
+def get_balance_snapshot_file(user_id):
+    return f"{USER_ROOT}/{user_id}/balance_snapshot.json"
+
+def get_tx_file(user_id):
+    """Legacy single-file history, only read when migrating."""
+    return f"{USER_ROOT}/{user_id}/transactions.json"
+
+def get_tx_dir(user_id):
+    return f"{USER_ROOT}/{user_id}/transactions"
+
+
+def _read_doc(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, "rb") as f:
+        raw = f.read()
+    record_read(len(raw))
+    return codec.decode(raw)
+
+def _write_doc(path, data):
+    """Atomically replace path with data, encoded by its configured codec (or raw bytes as given)."""
+    raw = data if isinstance(data, bytes) else codec.encode(path, data)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # A writer-unique temp name, so concurrent writers never share a half-written file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    record_write(len(raw))
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _repair_tail(path):
+    """Drop a torn final JSON line so the next append starts on a clean line."""
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b"\n":
+            return
+        f.seek(0)
+        data = f.read()
+        f.truncate(data.rfind(b"\n") + 1)
+
+
+def _append_lines(path, records):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if os.path.exists(path):
+        _repair_tail(path)
+    data = b"".join(json.dumps(r, separators=(",", ":")).encode() + b"\n" for r in records)
+    with open(path, "ab") as f:
+        f.write(data)
+    record_write(len(data))
+
+
+def _read_lines(path):
+    """The records of a JSON-lines file, up to any torn final line."""
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        raw = f.read()
+    record_read(len(raw))
+    return [json.loads(line) for line in raw[:raw.rfind(b"\n") + 1].splitlines()]
+
+
+class TransactionLog:
+    """
+    A user's history as an append-only JSON-lines log split into segments.
+    A segment is sealed once it grows past SEGMENT_MAX_BYTES and a new one
+    is started; manifest.json lists the sealed segments (with record
+    counts) and the active one, so appends only touch the active segment.
+
+    Alongside the segments, wallets/<address>.idx holds one fixed-size
+    WALLET_INDEX_ENTRY per record of that wallet, so the newest N records
+    of a wallet can be read from the end without scanning the log.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.dir = get_tx_dir(user_id)
+        self.manifest_path = os.path.join(self.dir, "manifest.json")
+
+    @staticmethod
+    def _segment_name(index):
+        return f"{index:08d}.jsonl"
+
+    @staticmethod
+    def _encode(tx):
+        return json.dumps(tx, separators=(",", ":")) + "\n"
+
+    def _new_manifest(self):
+        return {"sealed": [], "active": self._segment_name(0), "wallet_index": True}
+
+    def _segment_path(self, number):
+        return os.path.join(self.dir, self._segment_name(number))
+
+    def _index_path(self, address):
+        return os.path.join(self.dir, "wallets", quote(str(address), safe="") + ".idx")
+
+    def _write_manifest(self, manifest):
+        _write_doc(self.manifest_path, manifest)
+
+    def load_manifest(self, create=False):
+        """Return the manifest, migrating a legacy transactions.json first."""
+        manifest = _read_doc(self.manifest_path, None)
+        if manifest is None and os.path.exists(get_tx_file(self.user_id)):
+            with user_locks("transactions", self.user_id):
+                manifest = _read_doc(self.manifest_path, None)  # another process may have won
+                if manifest is None:
+                    manifest = self.migrate_legacy()
+        if manifest is None and create:
+            os.makedirs(self.dir, exist_ok=True)
+            manifest = self._new_manifest()
+            self._write_manifest(manifest)
+        return manifest
+
+    def migrate_legacy(self):
+        """One-time conversion of transactions.json into segments."""
+        legacy_path = get_tx_file(self.user_id)
+        try:
+            txs = _read_doc(legacy_path, [])
+        except ValueError:  # undecodable in either codec
+            txs = []
+
+        os.makedirs(self.dir, exist_ok=True)
+        manifest = self._new_manifest()
+        manifest["wallet_index"] = False  # built on first use
+        out, size, count = None, 0, 0
+        try:
+            for tx in txs:
+                if out is None:
+                    out = open(os.path.join(self.dir, manifest["active"]), "w")
+                line = self._encode(tx)
+                out.write(line)
+                size += len(line.encode())
+                count += 1
+                if size >= SEGMENT_MAX_BYTES:
+                    out.close()
+                    out = None
+                    manifest["sealed"].append({"name": manifest["active"], "count": count})
+                    manifest["active"] = self._segment_name(len(manifest["sealed"]))
+                    size, count = 0, 0
+        finally:
+            if out is not None:
+                out.close()
+
+        self._write_manifest(manifest)
+        os.replace(legacy_path, legacy_path + ".migrated")
+        return manifest
+
+    @staticmethod
+    def _iter_segment(path, skip=0):
+        if not os.path.exists(path):
+            return
+        size = 0
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # torn write at the tail of the active segment
+                    size += len(line)
+                    if skip:
+                        skip -= 1
+                        continue
+                    yield json.loads(line)
+        finally:
+            record_read(size)
+
+    def _roll(self, manifest):
+        active = manifest["active"]
+        with open(os.path.join(self.dir, active), "rb") as f:
+            count = sum(1 for _ in f)
+        manifest["sealed"].append({"name": active, "count": count})
+        manifest["active"] = self._segment_name(len(manifest["sealed"]))
+        self._write_manifest(manifest)
+
+    def _write_index_entries(self, entries):
+        """entries: {wallet: bytearray of packed WALLET_INDEX_ENTRY}"""
+        os.makedirs(os.path.join(self.dir, "wallets"), exist_ok=True)
+        for wallet, data in entries.items():
+            if wallet is None:
+                continue
+            with open(self._index_path(wallet), "ab") as f:
+                f.write(data)
+            record_write(len(data))
+
+    def _ensure_wallet_index(self, manifest):
+        """Build the per-wallet index once for logs written before it existed."""
+        if manifest.get("wallet_index"):
+            return
+        with user_locks("transactions", self.user_id):
+            manifest.update(_read_doc(self.manifest_path, manifest))
+            if not manifest.get("wallet_index"):
+                self._build_wallet_index(manifest)
+
+    def _build_wallet_index(self, manifest):
+        entries = {}
+        names = [segment["name"] for segment in manifest["sealed"]] + [manifest["active"]]
+        for name in names:
+            path = os.path.join(self.dir, name)
+            if not os.path.exists(path):
+                continue
+            number, offset = int(name.split(".")[0]), 0
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    wallet = json.loads(line).get("wallet")
+                    entries.setdefault(wallet, bytearray()).extend(
+                        WALLET_INDEX_ENTRY.pack(number, offset, len(line))
+                    )
+                    offset += len(line)
+        index_dir = os.path.join(self.dir, "wallets")
+        if os.path.isdir(index_dir):
+            for name in os.listdir(index_dir):  # leftovers of an interrupted build
+                os.remove(os.path.join(index_dir, name))
+        self._write_index_entries(entries)
+        manifest["wallet_index"] = True
+        self._write_manifest(manifest)
+
+    def wallet_page(self, address, limit, before=None):
+        manifest = self.load_manifest()
+        if manifest is None:
+            return [], None
+        self._ensure_wallet_index(manifest)
+        index_path = self._index_path(address)
+        if not os.path.exists(index_path):
+            return [], None
+
+        end = os.path.getsize(index_path) // WALLET_INDEX_ENTRY.size
+        if before is not None:
+            end = min(before, end)
+        start = max(end - limit, 0)
+        with open(index_path, "rb") as f:
+            f.seek(start * WALLET_INDEX_ENTRY.size)
+            data = f.read((end - start) * WALLET_INDEX_ENTRY.size)
+
+        records, segments, size = [], {}, 0
+        try:
+            for number, offset, length in reversed(list(WALLET_INDEX_ENTRY.iter_unpack(data))):
+                if number not in segments:
+                    segments[number] = open(self._segment_path(number), "rb")
+                segment = segments[number]
+                segment.seek(offset)
+                records.append(json.loads(segment.read(length)))
+                size += length
+        finally:
+            for segment in segments.values():
+                segment.close()
+        record_read(len(data) + size, files=1 + len(segments))
+        return records, (start if start > 0 else None)
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, start):
+        """Records from the start-th on; whole sealed segments are skipped by their counts."""
+        manifest = self.load_manifest()
+        if manifest is None:
+            return
+        for segment in manifest["sealed"]:
+            if start >= segment["count"]:
+                start -= segment["count"]
+                continue
+            yield from self._iter_segment(os.path.join(self.dir, segment["name"]), start)
+            start = 0
+        yield from self._iter_segment(os.path.join(self.dir, manifest["active"]), start)
+
+    def stamp(self):
+        manifest = self.load_manifest()
+        if manifest is None:
+            return None
+        return len(manifest["sealed"]), file_stamp(os.path.join(self.dir, manifest["active"]))
+
+    def append(self, txs):
+        manifest = self.load_manifest(create=True)
+        self._ensure_wallet_index(manifest)
+        path = os.path.join(self.dir, manifest["active"])
+        if os.path.exists(path):
+            _repair_tail(path)
+            if os.path.getsize(path) >= SEGMENT_MAX_BYTES:
+                self._roll(manifest)
+                path = os.path.join(self.dir, manifest["active"])
+
+        lines = [self._encode(tx).encode() for tx in txs]
+        with open(path, "ab") as f:
+            offset = f.tell()
+            f.write(b"".join(lines))
+        record_write(sum(map(len, lines)))
+
+        # Index after the records are written, so an entry never points past the log
+        number = int(manifest["active"].split(".")[0])
+        entries = {}
+        for tx, line in zip(txs, lines):
+            entries.setdefault(tx.get("wallet"), bytearray()).extend(
+                WALLET_INDEX_ENTRY.pack(number, offset, len(line))
+            )
+            offset += len(line)
+        self._write_index_entries(entries)
+
+
+class NFTEventLog:
+    """
+    Append-only provenance log for every NFT, one JSON line per event.
+    Per-token byte offsets are indexed in memory. Each read first indexes
+    whatever was appended since the previous read, so the file is scanned
+    once per process and afterwards only at its tail.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._offsets = {}
+        self._indexed = 0
+        self._inode = None
+
+    def append(self, events):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if os.path.exists(self.path):
+            _repair_tail(self.path)
+        data = b"".join(json.dumps(e, separators=(",", ":")).encode() + b"\n" for e in events)
+        with open(self.path, "ab") as f:
+            f.write(data)
+        record_write(len(data))
+
+    def _catch_up(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if st.st_ino != self._inode or st.st_size < self._indexed:
+            self._offsets, self._indexed, self._inode = {}, 0, st.st_ino
+        if st.st_size == self._indexed:
+            return
+        start = self._indexed
+        with open(self.path, "rb") as f:
+            f.seek(self._indexed)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                token_id = json.loads(line)["token_id"]
+                self._offsets.setdefault(token_id, []).append((self._indexed, len(line)))
+                self._indexed += len(line)
+        record_read(self._indexed - start)
+
+    def iter_token(self, token_id):
+        with self._lock:
+            self._catch_up()
+            offsets = list(self._offsets.get(token_id, ()))
+        if not offsets:
+            return
+        with open(self.path, "rb") as f:
+            for offset, length in offsets:
+                f.seek(offset)
+                yield json.loads(f.read(length))
+        record_read(sum(length for _, length in offsets))
+
+    def __iter__(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                yield json.loads(line)
+
+
+class JsonBackend(StorageBackend):
+    """The original layout: one directory of JSON files per user under data/users."""
+
+    name = "json"
+
+    def __init__(self):
+        self._events = NFTEventLog(NFT_EVENTS_PATH)
+
+    def list_users(self):
+        if not os.path.exists(USER_ROOT):
+            return []
+        return sorted([name for name in os.listdir(USER_ROOT) if os.path.isdir(os.path.join(USER_ROOT, name))])
+
+    def create_user(self, user_id):
+        os.makedirs(f"{USER_ROOT}/{user_id}", exist_ok=True)
+        # Initialize empty wallet and balance files; the transaction log is
+        # created on first write
+        if not os.path.exists(get_wallet_file(user_id)):
+            _write_doc(get_wallet_file(user_id), [])
+        if not os.path.exists(get_balance_file(user_id)):
+            _write_doc(get_balance_file(user_id), {})
+
+    def load_wallets(self, user_id):
+        return _read_doc(get_wallet_file(user_id), [])
+
+    def save_wallets(self, user_id, wallets):
+        _write_doc(get_wallet_file(user_id), wallets)
+
+    def load_all_wallets(self):
+        all_wallets = []
+        if not os.path.exists(USER_ROOT):
+            return []
+
+        for user_id in os.listdir(USER_ROOT):
+            try:
+                wallets = _read_doc(get_wallet_file(user_id), [])
+            except ValueError:  # undecodable in either codec
+                continue  # Could add logging here
+            for w in wallets:
+                all_wallets.append({
+                    "user_id": user_id,
+                    "address": w["address"],
+                    "nickname": w.get("nickname", "")
+                })
+        return all_wallets
+
+    def load_address_directory(self):
+        directory = _read_doc(ADDRESS_DIRECTORY_PATH, None)
+        if directory is None:
+            directory = self.rebuild_address_directory()
+        return directory
+
+    def update_address_directory(self, upserts=None, removals=()):
+        with file_lock(ADDRESS_DIRECTORY_PATH):
+            directory = self.load_address_directory()
+            for address in removals:
+                directory.pop(address, None)
+            directory.update(upserts or {})
+            _write_doc(ADDRESS_DIRECTORY_PATH, directory)
+
+    def rebuild_address_directory(self):
+        with file_lock(ADDRESS_DIRECTORY_PATH):
+            directory = {
+                w["address"]: {"user_id": w["user_id"], "nickname": w["nickname"]}
+                for w in self.load_all_wallets()
+            }
+            _write_doc(ADDRESS_DIRECTORY_PATH, directory)
+        return directory
+
+    def load_balances(self, user_id):
+        return _read_doc(get_balance_file(user_id), {})
+
+    def save_balances(self, user_id, balances):
+        _write_doc(get_balance_file(user_id), balances)
+
+    def load_balance_snapshot(self, user_id):
+        return _read_doc(get_balance_snapshot_file(user_id), None)
+
+    def save_balance_snapshot(self, user_id, snapshot):
+        _write_doc(get_balance_snapshot_file(user_id), snapshot)
+
+    def append_transactions(self, user_id, txs):
+        with user_locks("transactions", user_id):
+            TransactionLog(user_id).append(txs)
+
+    def iter_transactions(self, user_id, start=0):
+        return TransactionLog(user_id).iter_from(start)
+
+    def transactions_version(self, user_id):
+        return TransactionLog(user_id).stamp()
+
+    def wallet_transactions(self, user_id, address, limit, before=None):
+        return TransactionLog(user_id).wallet_page(address, limit, before)
+
+    def load_nfts(self):
+        nfts = _read_doc(NFT_REGISTRY_PATH, [])
+        rows = None
+        for nft in _read_lines(NFT_JOURNAL_PATH):  # later records win
+            if rows is None:
+                rows = {n["token_id"]: i for i, n in enumerate(nfts)}
+            i = rows.setdefault(nft["token_id"], len(nfts))
+            if i == len(nfts):
+                nfts.append(nft)
+            else:
+                nfts[i] = nft
+        return nfts
+
+    def save_nfts(self, nfts, changed=None):
+        """
+        Changed records are appended to the journal, so a write costs the
+        size of the change; nfts is only iterated when the whole file is
+        rewritten. The journal is dropped after that rewrite, and a rewrite
+        interrupted before then just replays records it already holds.
+        """
+        if changed is not None:
+            _append_lines(NFT_JOURNAL_PATH, changed)
+            registry, journal = file_stamp(NFT_REGISTRY_PATH), file_stamp(NFT_JOURNAL_PATH)
+            if registry is not None and journal[1] <= registry[1] * NFT_JOURNAL_RATIO:
+                return
+        _write_doc(NFT_REGISTRY_PATH, list(nfts))
+        if os.path.exists(NFT_JOURNAL_PATH):
+            os.remove(NFT_JOURNAL_PATH)
+
+    def load_listings(self):
+        return _read_doc(MARKETPLACE_FILE, [])
+
+    def save_listings(self, listings, changed=None, removed=()):
+        _write_doc(MARKETPLACE_FILE, listings)
+
+    def version(self, collection, user_id=None):
+        if collection == "wallets":
+            return file_stamp(get_wallet_file(user_id))
+        if collection == "nfts":
+            stamp, journal = file_stamp(NFT_REGISTRY_PATH), file_stamp(NFT_JOURNAL_PATH)
+            return stamp if journal is None else (stamp, journal)
+        return file_stamp({
+            "listings": MARKETPLACE_FILE,
+            "users": USER_ROOT,  # the directory's mtime moves when a user directory is added
+            "address_directory": ADDRESS_DIRECTORY_PATH,
+        }[collection])
+
+    def append_nft_events(self, events):
+        self._events.append(events)
+
+    def iter_nft_events(self, token_id=None):
+        if token_id is None:
+            return iter(self._events)
+        return self._events.iter_token(token_id)
+
+
+# ---------- SQLite ----------
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS wallets (
+    user_id TEXT NOT NULL,
+    address TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (user_id, address)
+);
+CREATE INDEX IF NOT EXISTS wallets_address ON wallets (address);
+CREATE TABLE IF NOT EXISTS balances (
+    user_id TEXT NOT NULL,
+    address TEXT NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (user_id, address)
+);
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+    user_id TEXT PRIMARY KEY,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    wallet TEXT,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_user_wallet ON transactions (user_id, wallet, id);
+CREATE TABLE IF NOT EXISTS nfts (
+    token_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    owner_user TEXT,
+    owner_address TEXT,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS nfts_owner_address ON nfts (owner_address);
+CREATE INDEX IF NOT EXISTS nfts_owner_user ON nfts (owner_user);
+CREATE TABLE IF NOT EXISTS listings (
+    token_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    seller_user TEXT,
+    chain TEXT,
+    price REAL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS listings_chain_price ON listings (chain, price);
+CREATE INDEX IF NOT EXISTS listings_seller ON listings (seller_user);
+CREATE TABLE IF NOT EXISTS nft_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token_id TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS nft_events_token ON nft_events (token_id, id);
+CREATE TABLE IF NOT EXISTS versions (
+    collection TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+
+class SqliteBackend(StorageBackend):
+    """Embedded SQLite database in WAL mode, one connection per thread."""
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _bump(conn, collection):
+        conn.execute(
+            "INSERT INTO versions (collection, version) VALUES (?, 1) "
+            "ON CONFLICT (collection) DO UPDATE SET version = version + 1",
+            (collection,)
+        )
+
+    def list_users(self):
+        rows = self._conn().execute("SELECT user_id FROM users ORDER BY user_id")
+        return [user_id for (user_id,) in rows]
+
+    def create_user(self, user_id):
+        with self._conn() as conn:
+            conn.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+            self._bump(conn, "users")
+
+    def load_wallets(self, user_id):
+        rows = self._conn().execute(
+            "SELECT body FROM wallets WHERE user_id = ? ORDER BY position", (user_id,)
+        )
+        return [json.loads(body) for (body,) in rows]
+
+    def save_wallets(self, user_id, wallets):
+        with self._conn() as conn:
+            if conn.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,)).rowcount:
+                self._bump(conn, "users")
+            conn.execute("DELETE FROM wallets WHERE user_id = ?", (user_id,))
+            conn.executemany(
+                "INSERT INTO wallets (user_id, address, position, body) VALUES (?, ?, ?, ?)",
+                [(user_id, w["address"], i, json.dumps(w)) for i, w in enumerate(wallets)]
+            )
+            self._bump(conn, f"wallets/{user_id}")
+            self._bump(conn, "address_directory")  # the wallets table is the directory
+
+    def load_all_wallets(self):
+        rows = self._conn().execute("SELECT user_id, body FROM wallets ORDER BY user_id, position")
+        all_wallets = []
+        for user_id, body in rows:
+            w = json.loads(body)
+            all_wallets.append({
+                "user_id": user_id,
+                "address": w["address"],
+                "nickname": w.get("nickname", "")
+            })
+        return all_wallets
+
+    def load_address_directory(self):
+        # The indexed wallets table already is the directory
+        return {w["address"]: {"user_id": w["user_id"], "nickname": w["nickname"]}
+                for w in self.load_all_wallets()}
+
+    def update_address_directory(self, upserts=None, removals=()):
+        pass  # kept current by save_wallets
+
+    def rebuild_address_directory(self):
+        return self.load_address_directory()
+
+    def load_balances(self, user_id):
+        rows = self._conn().execute("SELECT address, body FROM balances WHERE user_id = ?", (user_id,))
+        return {address: json.loads(body) for address, body in rows}
+
+    def save_balances(self, user_id, balances):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM balances WHERE user_id = ?", (user_id,))
+            conn.executemany(
+                "INSERT INTO balances (user_id, address, body) VALUES (?, ?, ?)",
+                [(user_id, address, json.dumps(wallet)) for address, wallet in balances.items()]
+            )
+
+    def load_balance_snapshot(self, user_id):
+        row = self._conn().execute("SELECT body FROM balance_snapshots WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_balance_snapshot(self, user_id, snapshot):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO balance_snapshots (user_id, body) VALUES (?, ?)",
+                (user_id, json.dumps(snapshot))
+            )
+
+    def append_transactions(self, user_id, txs):
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO transactions (user_id, wallet, body) VALUES (?, ?, ?)",
+                [(user_id, tx.get("wallet"), json.dumps(tx)) for tx in txs]
+            )
+
+    def iter_transactions(self, user_id, start=0):
+        rows = self._conn().execute(
+            "SELECT body FROM transactions WHERE user_id = ? ORDER BY id LIMIT -1 OFFSET ?", (user_id, start)
+        )
+        for (body,) in rows:
+            yield json.loads(body)
+
+    def transactions_version(self, user_id):
+        return self._conn().execute(
+            "SELECT COUNT(*), MAX(id) FROM transactions WHERE user_id = ?", (user_id,)
+        ).fetchone()
+
+    def wallet_transactions(self, user_id, address, limit, before=None):
+        # Served by the (user_id, wallet, id) index; the cursor is a row id
+        rows = self._conn().execute(
+            "SELECT id, body FROM transactions WHERE user_id = ? AND wallet = ? AND id < ? "
+            "ORDER BY id DESC LIMIT ?",
+            (user_id, address, before if before is not None else 2 ** 63 - 1, limit + 1)
+        ).fetchall()
+        records = [json.loads(body) for _, body in rows[:limit]]
+        return records, (rows[limit - 1][0] if len(rows) > limit else None)
+
+    def load_nfts(self):
+        rows = self._conn().execute("SELECT body FROM nfts ORDER BY position")
+        return [json.loads(body) for (body,) in rows]
+
+    def save_nfts(self, nfts, changed=None):
+        with self._conn() as conn:
+            if changed is None:
+                conn.execute("DELETE FROM nfts")
+                changed = nfts
+            conn.executemany(
+                "INSERT INTO nfts (token_id, position, owner_user, owner_address, body) "
+                "VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM nfts), ?, ?, ?) "
+                "ON CONFLICT (token_id) DO UPDATE SET owner_user = excluded.owner_user, "
+                "owner_address = excluded.owner_address, body = excluded.body",
+                [(n["token_id"], n.get("owner_user"), n.get("owner_address"), json.dumps(n)) for n in changed]
+            )
+            self._bump(conn, "nfts")
+
+    def load_listings(self):
+        rows = self._conn().execute("SELECT body FROM listings ORDER BY position")
+        return [json.loads(body) for (body,) in rows]
+
+    def save_listings(self, listings, changed=None, removed=()):
+        with self._conn() as conn:
+            if changed is None:
+                conn.execute("DELETE FROM listings")
+                changed = listings
+            conn.executemany("DELETE FROM listings WHERE token_id = ?", [(t,) for t in removed])
+            conn.executemany(
+                "INSERT INTO listings (token_id, position, seller_user, chain, price, body) "
+                "VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM listings), ?, ?, ?, ?) "
+                "ON CONFLICT (token_id) DO UPDATE SET seller_user = excluded.seller_user, "
+                "chain = excluded.chain, price = excluded.price, body = excluded.body",
+                [(l["token_id"], l["seller_user"], l["chain"], l["price"], json.dumps(l)) for l in changed]
+            )
+            self._bump(conn, "listings")
+
+    def version(self, collection, user_id=None):
+        if collection == "wallets":
+            collection = f"wallets/{user_id}"
+        row = self._conn().execute(
+            "SELECT version FROM versions WHERE collection = ?", (collection,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def append_nft_events(self, events):
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO nft_events (token_id, body) VALUES (?, ?)",
+                [(e["token_id"], json.dumps(e)) for e in events]
+            )
+
+    def iter_nft_events(self, token_id=None):
+        if token_id is None:
+            rows = self._conn().execute("SELECT body FROM nft_events ORDER BY id")
+        else:
+            rows = self._conn().execute(
+                "SELECT body FROM nft_events WHERE token_id = ? ORDER BY id", (token_id,)
+            )
+        for (body,) in rows:
+            yield json.loads(body)
+
+
+# ---------- Selection ----------
+_backend = None
+_backend_lock = threading.Lock()
+
+def make_backend(name, sqlite_path=None):
+    if name == "json":
+        return JsonBackend()
+    if name == "sqlite":
+        return SqliteBackend(sqlite_path or "data/crossmobi.db")
+    raise ValueError(f"Unknown storage backend '{name}'. Expected 'json' or 'sqlite'.")
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            config = load_config().get("storage", {})
+            name = os.environ.get("STORAGE_BACKEND", config.get("backend", "json"))
+            _backend = make_backend(name, config.get("sqlite_path"))
+        return _backend
+
+
+# ---------- Migration ----------
+def copy_data(src, dst):
+    """Copy every collection from one backend to another."""
+    counts = {"users": 0, "wallets": 0, "transactions": 0}
+    for user_id in src.list_users():
+        dst.create_user(user_id)
+        wallets = src.load_wallets(user_id)
+        dst.save_wallets(user_id, wallets)
+        dst.save_balances(user_id, src.load_balances(user_id))
+        txs = list(src.iter_transactions(user_id))
+        if txs:
+            dst.append_transactions(user_id, txs)
+        counts["users"] += 1
+        counts["wallets"] += len(wallets)
+        counts["transactions"] += len(txs)
+
+    nfts = src.load_nfts()
+    dst.save_nfts(nfts)
+    listings = src.load_listings()
+    dst.save_listings(listings)
+    events = list(src.iter_nft_events())
+    if events:
+        dst.append_nft_events(events)
+    counts["nfts"] = len(nfts)
+    counts["listings"] = len(listings)
+    counts["nft events"] = len(events)
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from ledger import Ledger, LEDGER_WAL_PATH
+
+    parser = argparse.ArgumentParser(description="Storage backend tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="import the JSON data/ tree into SQLite")
+    migrate.add_argument("--db", default=load_config().get("storage", {}).get("sqlite_path", "data/crossmobi.db"))
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        if os.path.exists(args.db):
+            parser.error(f"{args.db} already exists; move it aside to re-import.")
+        src = JsonBackend()
+        # Fold any pending ledger records into balances.json before copying
+        Ledger(LEDGER_WAL_PATH, load=src.load_balances, save=src.save_balances).flush()
+        counts = copy_data(src, SqliteBackend(args.db))
+        print(", ".join(f"{n} {name}" for name, n in counts.items()))
+        print(f"Set storage.backend to 'sqlite' in {CONFIG_PATH} to use {args.db}.")
@@ -0,0 +1,171 @@
+# stress.py
+"""
+Concurrency stress test for the locked write paths.
+
+    python stress.py --workers 1,2,4,8 --ops 200
+
+Runs worker processes against a synthetic data/ tree (see synthetic.py)
+and checks that no update is lost:
+
+  * transfers: every worker moves USDC between two wallets, either all on
+    the same user ("shared") or each on its own user ("distinct"); final
+    balances must equal the exact sum of the committed transfers
+  * mints: every worker mints NFTs into one shared registry; the registry
+    must end up with every token
+  * listings: every worker lists its own tokens; the order book must hold
+    all of them
+
+Throughput of the transfer scenarios is reported per worker count. With
+lock striping, "distinct" should keep scaling where "shared" flattens out
+on the one user's stripe. Exits non-zero if any invariant fails.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _worker(tree, scenario, index, ops, pairs, barrier, results):
+    os.chdir(tree)
+    sys.path.insert(0, REPO_ROOT)
+    import balances, marketplace, nfts
+
+    (sender_user, sender_address), (recipient_user, recipient_address) = pairs[index]
+    catalog = nfts.load_catalog()
+    barrier.wait()
+    started = time.perf_counter()
+    for i in range(ops):
+        if scenario == "mint":
+            nfts.mint_nft(catalog[i % len(catalog)], "Ethereum", sender_user, sender_address)
+        elif scenario == "list":
+            token = nfts.mint_nft(catalog[i % len(catalog)], "Ethereum", sender_user, sender_address)
+            marketplace.list_nft_for_sale(token["token_id"], sender_user, sender_address, 10.0 + i, "Ethereum")
+        elif i % 2 == 0:
+            balances.transfer(sender_user, sender_address, recipient_user, recipient_address, 1.0, 0)
+        else:
+            balances.transfer(recipient_user, recipient_address, sender_user, sender_address, 0.5, 0)
+    results.put((index, time.perf_counter() - started))
+    balances._ledger.close()
+
+
+def _run(tree, scenario, workers, ops, pairs):
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=_worker, args=(tree, scenario, i, ops, pairs, barrier, results))
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    elapsed = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+        if p.exitcode:
+            raise RuntimeError(f"{scenario} worker exited with {p.exitcode}")
+    wall = max(seconds for _, seconds in elapsed)
+    return workers * ops / wall
+
+
+def _state(tree):
+    """Balances, registry size and order book size as seen by a fresh process."""
+    code = (
+        "import json, balances, nfts, marketplace, wallet\n"
+        "print(json.dumps({"
+        "'balances': {u: balances.load_balances(u) for u in wallet.list_users()},"
+        "'nfts': len(nfts.list_nfts_by_owner()),"
+        "'listings': len(marketplace.load_marketplace())}))"
+    )
+    import subprocess
+    out = subprocess.run([sys.executable, "-c", code], cwd=tree, check=True, capture_output=True, text=True,
+                         env=dict(os.environ, PYTHONPATH=REPO_ROOT, STORAGE_BACKEND="json")).stdout
+    return json.loads(out)
+
+
+def _usdc(state, user_id, address):
+    return state["balances"][user_id].get(address, {"USDC": 0})["USDC"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency stress test for the locked write paths")
+    parser.add_argument("--workers", default="1,2,4,8", help="comma-separated worker counts")
+    parser.add_argument("--ops", type=int, default=200, help="operations per worker")
+    parser.add_argument("--output", help="write the report JSON here as well")
+    args = parser.parse_args()
+    counts = [int(n) for n in args.workers.split(",")]
+
+    sys.path.insert(0, REPO_ROOT)
+    from synthetic import generate
+
+    tree = tempfile.mkdtemp(prefix="crossmobi-stress-")
+    os.environ["STORAGE_BACKEND"] = "json"
+    failures, report = [], {"ops_per_worker": args.ops, "throughput": {}}
+    try:
+        generate(tree, users=max(counts) + 1, wallets_per_user=2, nfts=0, listings=0,
+                 transactions_per_user=2, catalog=20)
+        with open(os.path.join(tree, "data", "address_directory.json")) as f:
+            directory = json.load(f)
+        by_user = {}
+        for address, entry in directory.items():
+            by_user.setdefault(entry["user_id"], []).append(address)
+        users = sorted(by_user)
+        funding = {
+            user_id: {address: {"USDC": 1_000_000.0} for address in by_user[user_id]}
+            for user_id in users
+        }
+        for user_id, wallets in funding.items():
+            with open(os.path.join(tree, "data", "users", user_id, "balances.json"), "w") as f:
+                json.dump(wallets, f)
+
+        for scenario in ("shared", "distinct"):
+            for workers in counts:
+                if scenario == "shared":
+                    pairs = [((users[0], by_user[users[0]][0]), (users[0], by_user[users[0]][1]))] * workers
+                else:
+                    pairs = [((u, by_user[u][0]), (u, by_user[u][1])) for u in users[1:workers + 1]]
+                before = _state(tree)
+                ops_s = _run(tree, "transfer", workers, args.ops, pairs)
+                after = _state(tree)
+                report["throughput"].setdefault(scenario, {})[workers] = round(ops_s, 1)
+                print(f"transfer/{scenario}: {workers} workers -> {ops_s:,.0f} ops/s", file=sys.stderr)
+
+                # Each worker's pair nets +0.5 per round trip on the recipient side
+                rounds = args.ops // 2
+                expected = {}
+                for (su, sa), (ru, ra) in pairs:
+                    expected[(su, sa)] = expected.get((su, sa), 0) - 0.5 * rounds - (args.ops % 2)
+                    expected[(ru, ra)] = expected.get((ru, ra), 0) + 0.5 * rounds + (args.ops % 2)
+                for (user_id, address), delta in expected.items():
+                    got = _usdc(after, user_id, address) - _usdc(before, user_id, address)
+                    if abs(got - delta) > 1e-6:
+                        failures.append(f"transfer/{scenario}/{workers}: {address} moved {got}, expected {delta}")
+
+        workers = max(counts)
+        pairs = [((u, by_user[u][0]), (u, by_user[u][1])) for u in users[1:workers + 1]]
+        for scenario, field in (("mint", "nfts"), ("list", "listings")):
+            before = _state(tree)
+            _run(tree, scenario, workers, args.ops, pairs)
+            after = _state(tree)
+            added = after[field] - before[field]
+            print(f"{scenario}: {workers} workers added {added} of {workers * args.ops}", file=sys.stderr)
+            if added != workers * args.ops:
+                failures.append(f"{scenario}: {added} {field} added, expected {workers * args.ops}")
+    finally:
+        shutil.rmtree(tree, ignore_errors=True)
+
+    report["failures"] = failures
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+# synthetic.py
+"""
+Build a synthetic data/ tree for benchmarks and load tests.
+
+    python synthetic.py /tmp/crossmobi-10k --users 100 --nfts 10000 --listings 2000
+
+The output directory gets its own chains.yaml and config.yaml (forced to
+the JSON backend, thumbnails off), so the app and the data modules can be run against it
+with that directory as the working directory. Balances are consistent with the generated
+transaction history.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+import yaml
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+TAGS = ["abstract", "portrait", "landscape", "street", "night", "color", "mono", "city", "nature", "motion"]
+WORDS = ["red", "blue", "quiet", "loud", "river", "tower", "glass", "paper", "sun", "moon",
+         "echo", "signal", "garden", "harbor", "static", "velvet", "orbit", "ember", "frost", "drift"]
+
+
+def _address(rng):
+    return "0x" + "".join(rng.choice("0123456789abcdef") for _ in range(40))
+
+
+def _catalog(rng, count):
+    catalog = []
+    for i in range(count):
+        title = " ".join(rng.choice(WORDS).title() for _ in range(rng.randint(2, 3)))
+        catalog.append({
+            "asset_id": f"asset-{i:06d}",
+            "title": title,
+            "image_url": f"https://picsum.photos/seed/{i}/800/800",
+            "description": " ".join(rng.choice(WORDS) for _ in range(12)),
+            "tags": rng.sample(TAGS, 3)
+        })
+    return catalog
+
+
+def _history(rng, wallet, chains, count, start):
+    """A single wallet's transactions plus the balance they leave behind."""
+    txs, balance, ts = [], 0.0, start
+    for _ in range(count):
+        ts += timedelta(seconds=rng.randint(1, 3600))
+        chain = rng.choice(chains)
+        kind = "onramp" if balance < 100 else rng.choice(["onramp", "offramp", "contract_call", "contract_call"])
+        tx = {"type": kind, "wallet": wallet, "chain": chain, "timestamp": ts.isoformat()}
+        if kind == "onramp":
+            tx.update(amount=500, gas_fee=0, direction="in")
+            balance += 500
+        elif kind == "offramp":
+            amount = round(rng.uniform(1, balance / 2), 2)
+            tx.update(amount=amount, gas_fee=0, direction="out")
+            balance -= amount
+        else:
+            gas = round(rng.uniform(0.01, 5), 4)
+            tx.update(gas_fee=gas, direction="out", action="Simple Call (e.g. view balance)")
+            balance -= gas
+        txs.append(tx)
+    return txs, round(balance, 6)
+
+
+def generate(out_dir, users=10, wallets_per_user=3, nfts=1000, listings=200,
+             transactions_per_user=200, catalog=100, seed=0):
+    """Write a synthetic data/ tree under out_dir and return the counts written."""
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(out_dir, "data", "users"), exist_ok=True)
+    shutil.copy(os.path.join(REPO_ROOT, "chains.yaml"), os.path.join(out_dir, "chains.yaml"))
+    # The tree is written in the JSON layout, whatever the repo is configured for
+    with open(os.path.join(REPO_ROOT, "config.yaml"), "r") as f:
+        config = yaml.safe_load(f) or {}
+    config.setdefault("storage", {})["backend"] = "json"
+    config.setdefault("thumbnails", {})["enabled"] = False  # benchmarks must not hit the network
+    with open(os.path.join(out_dir, "config.yaml"), "w") as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+
+    previous_cwd = os.getcwd()
+    os.chdir(out_dir)
+    try:
+        from storage import JsonBackend
+
+        with open("chains.yaml", "r") as f:
+            chains = list(yaml.safe_load(f))
+        backend = JsonBackend()
+        start = datetime(2025, 1, 1)
+
+        assets = _catalog(rng, catalog)
+        with open("data/portfolio_catalog.json", "w") as f:
+            json.dump(assets, f)
+
+        owners = []
+        for u in range(users):
+            user_id = f"user{u:05d}"
+            backend.create_user(user_id)
+            wallets, balances, txs = [], {}, []
+            per_wallet = max(transactions_per_user // max(wallets_per_user, 1), 1)
+            for w in range(wallets_per_user):
+                address = _address(rng)
+                wallets.append({"address": address, "private_key": "%064x" % rng.getrandbits(256),
+                                "nickname": f"wallet {w + 1}"})
+                history, balance = _history(rng, address, chains, per_wallet, start)
+                txs.extend(history)
+                balances[address] = {"USDC": balance}
+                owners.append((user_id, address))
+            txs.sort(key=lambda tx: tx["timestamp"])
+            backend.save_wallets(user_id, wallets)
+            backend.save_balances(user_id, balances)
+            if txs:
+                backend.append_transactions(user_id, txs)
+
+        registry, events = [], []
+        for i in range(nfts):
+            asset = rng.choice(assets)
+            owner_user, owner_address = rng.choice(owners)
+            chain = rng.choice(chains)
+            minted_at = (start + timedelta(minutes=i)).isoformat()
+            token_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            registry.append({
+                "token_id": token_id,
+                "asset_id": asset["asset_id"],
+                "name": asset["title"],
+                "image_url": asset["image_url"],
+                "description": asset["description"],
+                "chain": chain,
+                "owner_user": owner_user,
+                "owner_address": owner_address,
+                "minted_at": minted_at
+            })
+            events.append({"token_id": token_id, "event": "mint", "user": owner_user,
+                           "address": owner_address, "ts": minted_at, "chain": chain})
+        backend.save_nfts(registry)
+        if events:
+            backend.append_nft_events(events)
+
+        book = []
+        for nft in rng.sample(registry, min(listings, len(registry))):
+            book.append({
+                "token_id": nft["token_id"],
+                "seller_user": nft["owner_user"],
+                "seller_address": nft["owner_address"],
+                "price": float(rng.randint(1, 5000)),
+                "chain": nft["chain"],
+                "listed_at": nft["minted_at"]
+            })
+        backend.save_listings(book)
+        backend.rebuild_address_directory()
+    finally:
+        os.chdir(previous_cwd)
+
+    return {
+        "users": users,
+        "wallets": users * wallets_per_user,
+        "transactions": users * wallets_per_user * max(transactions_per_user // max(wallets_per_user, 1), 1),
+        "nfts": nfts,
+        "listings": min(listings, nfts),
+        "catalog": catalog
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic data/ tree")
+    parser.add_argument("out_dir")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--wallets-per-user", type=int, default=3)
+    parser.add_argument("--nfts", type=int, default=1000)
+    parser.add_argument("--listings", type=int, default=200)
+    parser.add_argument("--transactions-per-user", type=int, default=200)
+    parser.add_argument("--catalog", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    counts = generate(args.out_dir, args.users, args.wallets_per_user, args.nfts, args.listings,
+                      args.transactions_per_user, args.catalog, args.seed)
+    print(json.dumps(counts))
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root and resolve data/ against the working directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def lock_dir(tmp_path_factory):
+    """Keep lock files out of the checkout. Not restored: atexit hooks still take locks."""
+    import locks
+    locks.LOCK_DIR = str(tmp_path_factory.mktemp("locks"))
+    return locks.LOCK_DIR
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    """An empty data/ tree in tmp_path as the working directory, with no cached reads."""
+    from balances import _ledger
+    from cache import read_cache
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    read_cache.clear()
+    yield tmp_path
+    _ledger.close()  # checkpoint into this tree while it is still the working directory
+    read_cache.clear()
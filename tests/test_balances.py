@@ -0,0 +1,47 @@
+import pytest
+
+from balances import get_wallet_balance, transfer_many, update_wallet_balance, verify_balances
+from transactions import load_transactions, save_transaction
+
+
+def test_transfer_many_always_writes_records(tree):
+    update_wallet_balance("s", "0xs", 100.0)
+    transfer_many("s", "0xs", [("r1", "0x1", 10.0), ("r2", "0x2", 5.0), ("r1", "0x1", 1.0)], gas_fee=0.5)
+
+    assert get_wallet_balance("r1", "0x1")["USDC"] == 11.0
+    assert get_wallet_balance("s", "0xs")["USDC"] == 100.0 - 16.0 - 1.5
+    assert [tx["amount"] for tx in load_transactions("r1")] == [10.0, 1.0]
+    assert [tx["recipient"] for tx in load_transactions("s")] == ["0x1", "0x2", "0x1"]
+    assert verify_balances("r1") == [] and verify_balances("r2") == []
+
+
+def _gas(address, gas_fee):
+    return {"type": "contract_call", "wallet": address, "chain": "Ethereum",
+            "timestamp": "2026-01-01T00:00:00", "gas_fee": gas_fee, "direction": "out"}
+
+
+def test_apply_transaction_keeps_balance_and_log_together(tree):
+    from balances import apply_transaction
+    apply_transaction("u", {"type": "onramp", "wallet": "0xa", "amount": 10.0, "chain": "Ethereum",
+                            "timestamp": "2026-01-01T00:00:00", "gas_fee": 0, "direction": "in"})
+    apply_transaction("u", _gas("0xa", 4.0))
+    with pytest.raises(ValueError, match="no gas"):
+        apply_transaction("u", _gas("0xa", 7.0), error="no gas")
+
+    assert get_wallet_balance("u", "0xa")["USDC"] == 6.0
+    assert len(load_transactions("u")) == 2  # the rejected record was not written
+    assert verify_balances("u") == []
+
+
+def test_snapshot_skips_records_without_a_wallet(tree, monkeypatch):
+    import balances
+    from balances import apply_transaction, derive_balances
+    from storage import get_backend
+    monkeypatch.setattr(balances, "SNAPSHOT_EVERY", 2)
+    apply_transaction("u", {"type": "onramp", "wallet": "0xa", "amount": 3.0, "chain": "Ethereum",
+                            "timestamp": "2026-01-01T00:00:00", "gas_fee": 0, "direction": "in"})
+    save_transaction("u", {"type": "note", "timestamp": "2026-01-01T00:00:00"})
+
+    assert derive_balances("u") == {"0xa": {"USDC": 3.0}}
+    snapshot = get_backend().load_balance_snapshot("u")
+    assert snapshot["count"] == 2 and snapshot["balances"] == {"0xa": 3.0}
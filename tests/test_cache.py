@@ -0,0 +1,40 @@
+import pytest
+
+from cache import ReadCache
+
+
+def test_stamp_sees_the_arguments():
+    cache, stamps, calls = ReadCache(), {"a": 1, "b": 1}, []
+
+    @cache.cached("read", stamp=lambda key: stamps[key])
+    def read(key):
+        calls.append(key)
+        return key
+
+    read("a"), read("b"), read("a")
+    stamps["a"] = 2  # another process wrote a
+    read("a"), read("b")
+    assert calls == ["a", "b", "a"]
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_wallet_reads_follow_other_writers(backend, tmp_path, monkeypatch):
+    import storage
+    from cache import read_cache
+    from wallet import get_address_directory, get_wallets, list_users
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "_backend", storage.make_backend(backend, str(tmp_path / "data.db")))
+    read_cache.clear()
+    assert list_users() == [] and get_wallets("u1") == [] and get_address_directory() == {}
+
+    # Writes that bypass this process's invalidate() calls, as another process's would
+    other = storage.get_backend()
+    other.create_user("u1")
+    other.save_wallets("u1", [{"address": "0x1", "nickname": "main"}])
+    other.update_address_directory({"0x1": {"user_id": "u1", "nickname": "main"}})
+
+    assert list_users() == ["u1"]
+    assert [w["address"] for w in get_wallets("u1")] == ["0x1"]
+    assert get_address_directory() == {"0x1": {"user_id": "u1", "nickname": "main"}}
+    read_cache.clear()
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from ledger import Ledger
+
+WAL = "data/ledger.wal"
+
+
+@pytest.fixture
+def saved(tmp_path, monkeypatch):
+    """Checkpointed balances per user, standing in for the per-user files."""
+    monkeypatch.chdir(tmp_path)
+    return {}
+
+
+def _ledger(saved):
+    return Ledger(WAL, load=lambda user_id: json.loads(json.dumps(saved.get(user_id, {}))),
+                  save=saved.__setitem__)
+
+
+def test_commit_after_torn_tail(saved):
+    _ledger(saved).commit([("u1", "a", 10.0)])
+    # The writer died mid-append: half a record, no newline, no checkpoint
+    with open(WAL, "ab") as f:
+        f.write(b'{"set":[["x"')
+
+    ledger = _ledger(saved)
+    ledger.commit([("u1", "a", 5.0)])
+    assert ledger.wallet("u1", "a")["USDC"] == 15.0
+
+    restarted = _ledger(saved)
+    assert restarted.wallet("u1", "a")["USDC"] == 15.0
+    restarted.close()
+    assert saved["u1"]["a"]["USDC"] == 15.0
+
+
+def test_torn_tail_is_ignored_by_readers(saved):
+    _ledger(saved).commit([("u1", "a", 10.0)])
+    with open(WAL, "ab") as f:
+        f.write(b'{"set":[["u1","a",99')
+    assert _ledger(saved).wallet("u1", "a")["USDC"] == 10.0
+
+
+def test_multi_party_commit_checks_minimums(saved):
+    ledger = _ledger(saved)
+    ledger.commit([("buyer", "b", 10.0)])
+    with pytest.raises(ValueError):
+        ledger.commit([("buyer", "b", -12.0), ("seller", "s", 11.0)], minimums=[("buyer", "b", 12.0)])
+    assert ledger.wallet("buyer", "b")["USDC"] == 10.0
+    assert ledger.wallet("seller", "s")["USDC"] == 0
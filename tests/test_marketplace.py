@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+ASSET = {"asset_id": "a1", "title": "Harbor", "image_url": "", "description": ""}
+
+
+@pytest.fixture(scope="module", autouse=True)
+def tree(tmp_path_factory):
+    """One data/ tree for the module: the ledger and order book are process-wide."""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("tree"))
+    os.makedirs("data")
+    yield
+    from balances import _ledger
+    _ledger.close()  # checkpoint into this tree, not wherever atexit finds the process
+    os.chdir(cwd)
+
+
+def _mint(user="alice", address="0xa"):
+    from nfts import mint_nft
+    return mint_nft(ASSET, "Ethereum", user, address)["token_id"]
+
+
+def test_burn_removes_listing():
+    from marketplace import get_listing, list_nft_for_sale
+    from nfts import burn_nft
+    token_id = _mint()
+    list_nft_for_sale(token_id, "alice", "0xa", 10.0, "Ethereum")
+    burn_nft(token_id)
+    assert get_listing(token_id) is None
+
+
+def test_transfer_removes_listing():
+    from marketplace import get_listing, list_nft_for_sale
+    from nfts import transfer_nft
+    token_id = _mint()
+    list_nft_for_sale(token_id, "alice", "0xa", 10.0, "Ethereum")
+    transfer_nft(token_id, "bob", "0xb")
+    assert get_listing(token_id) is None
+
+
+def test_only_a_live_owned_token_can_be_listed():
+    from marketplace import get_listing, list_nft_for_sale
+    from nfts import burn_nft
+    token_id = _mint()
+    with pytest.raises(ValueError):
+        list_nft_for_sale(token_id, "bob", "0xb", 10.0, "Ethereum")
+    with pytest.raises(ValueError):
+        list_nft_for_sale("no-such-token", "alice", "0xa", 10.0, "Ethereum")
+    burn_nft(token_id)
+    with pytest.raises(ValueError):
+        list_nft_for_sale(token_id, "alice", "0xa", 10.0, "Ethereum")
+    assert get_listing(token_id) is None
+
+
+def test_a_listing_sells_once():
+    from balances import get_wallet_balance, update_wallet_balance
+    from marketplace import buy_listing, get_listing, list_nft_for_sale
+    from nfts import get_nft
+    token_id = _mint("carol", "0xc")
+    list_nft_for_sale(token_id, "carol", "0xc", 10.0, "Ethereum")
+    update_wallet_balance("dave", "0xd", 30.0)
+    update_wallet_balance("erin", "0xe", 30.0)
+
+    buy_listing(token_id, "dave", "0xd", 1.0)
+    with pytest.raises(ValueError):
+        buy_listing(token_id, "erin", "0xe", 1.0)
+
+    assert get_listing(token_id) is None
+    assert get_nft(token_id)["owner_address"] == "0xd"
+    assert get_wallet_balance("dave", "0xd")["USDC"] == 19.0
+    assert get_wallet_balance("erin", "0xe")["USDC"] == 30.0
+    assert get_wallet_balance("carol", "0xc")["USDC"] == 10.0
+
+
+def test_a_buyer_who_cannot_pay_changes_nothing():
+    from balances import get_wallet_balance
+    from marketplace import buy_listing, get_listing, list_nft_for_sale
+    from nfts import get_nft
+    token_id = _mint("frank", "0xf")
+    list_nft_for_sale(token_id, "frank", "0xf", 10.0, "Ethereum")
+    with pytest.raises(ValueError):
+        buy_listing(token_id, "gina", "0x9", 1.0)
+    assert get_listing(token_id) is not None
+    assert get_nft(token_id)["owner_address"] == "0xf"
+    assert get_wallet_balance("gina", "0x9")["USDC"] == 0.0
@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+import nfts
+import nfttable
+import storage
+from nfts import NFTRegistry
+from storage import NFT_JOURNAL_PATH, NFT_REGISTRY_PATH, NFT_TABLE_PATH, file_stamp, get_backend
+
+DELTA_PATH = NFT_TABLE_PATH + nfttable.DELTA_SUFFIX
+
+
+def _nft(i, owner="u0"):
+    return {"token_id": f"t{i:04d}", "asset_id": f"a{i % 7}", "name": f"Token {i}",
+            "image_url": "https://example.com/a.png", "description": "", "chain": "Ethereum",
+            "owner_user": owner, "owner_address": f"0x{owner}", "minted_at": "2026-01-01T00:00:00"}
+
+
+def _give(owner):
+    def mutate(nft):
+        nft["owner_user"], nft["owner_address"] = owner, f"0x{owner}"
+    return mutate
+
+
+def _burn(nft):
+    nft["owner_user"] = nft["owner_address"] = None
+    nft["burned"] = True
+
+
+@pytest.fixture
+def registry(tree, monkeypatch):
+    """200 tokens in a JSON registry, too small to outgrow a journal or delta unless a test says so."""
+    monkeypatch.setattr(storage, "_backend", storage.make_backend("json", "unused.db"))
+    monkeypatch.setattr(storage, "NFT_JOURNAL_RATIO", 100)
+    monkeypatch.setattr(nfttable, "DELTA_RATIO", 100)
+    get_backend().save_nfts([_nft(i) for i in range(200)])
+    registry = NFTRegistry()
+    registry.all()  # builds data/nfts.tbl
+    return registry
+
+
+def test_writes_append_to_the_journal_and_delta(registry, monkeypatch):
+    files = file_stamp(NFT_REGISTRY_PATH), file_stamp(NFT_TABLE_PATH)
+
+    def dicts(self):
+        pytest.fail("walked the whole table")
+        yield
+    monkeypatch.setattr(nfttable.NFTTable, "dicts", dicts)
+
+    registry.add(_nft(200, owner="u1"))
+    registry.update("t0003", _give("u2"))
+    registry.update("t0004", _burn)
+
+    assert (file_stamp(NFT_REGISTRY_PATH), file_stamp(NFT_TABLE_PATH)) == files
+    assert os.path.exists(NFT_JOURNAL_PATH) and os.path.exists(DELTA_PATH)
+
+    # Another process opens the table file and replays its delta, without reading the registry
+    monkeypatch.setattr(nfts, "_load_registry", lambda: pytest.fail("rebuilt from the registry"))
+    other = NFTRegistry()
+    assert len(other.all()) == 201
+    assert other.get("t0200")["owner_user"] == "u1"
+    assert other.get("t0003")["owner_address"] == "0xu2"
+    assert dict(other.get("t0004")) == {**_nft(4), "owner_user": None, "owner_address": None, "burned": True}
+
+    # ... and its writes carry on the same chain
+    other.update("t0003", _give("u3"))
+    assert registry.get("t0003")["owner_user"] == "u3"
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_registry_round_trips(registry, monkeypatch, compact):
+    if compact:  # every write folds the journal and delta back into their files
+        monkeypatch.setattr(storage, "NFT_JOURNAL_RATIO", 0)
+        monkeypatch.setattr(nfttable, "DELTA_RATIO", 0)
+    for i in range(10):
+        registry.update(f"t{i:04d}", _give("u9"))
+    registry.add(_nft(200))
+    registry.update("t0001", _give("u8"))
+
+    expected = [_nft(i, owner="u9") for i in range(10)] + [_nft(i) for i in range(10, 201)]
+    expected[1] = _nft(1, owner="u8")
+    assert get_backend().load_nfts() == expected
+    assert [dict(nft) for nft in NFTRegistry().all()] == expected
+    assert os.path.exists(NFT_JOURNAL_PATH) != compact and os.path.exists(DELTA_PATH) != compact
+
+
+def test_a_broken_delta_chain_rebuilds_the_table(registry):
+    registry.update("t0005", _give("u1"))
+    os.remove(DELTA_PATH)  # as if a writer died between the registry and the table
+
+    other = NFTRegistry()
+    assert other.get("t0005")["owner_user"] == "u1"
+    assert not os.path.exists(DELTA_PATH)
@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+from marketplace import ListingStore
+from storage import get_backend
+
+
+@pytest.fixture
+def listings(tmp_path, monkeypatch):
+    """A stored order book of 500 listings over three chains, in listing order."""
+    monkeypatch.chdir(tmp_path)
+    rng = random.Random(7)
+    stored = [
+        {"token_id": f"t{i:04d}", "seller_user": f"u{i % 9}", "seller_address": f"0x{i % 9}",
+         "price": float(rng.randint(1, 50)), "chain": rng.choice(["Ethereum", "Polygon", "Solana"]),
+         "listed_at": f"2026-01-01T00:{i // 60:02d}:{i % 60:02d}"}
+        for i in range(500)
+    ]
+    get_backend().save_listings(stored)
+    return stored
+
+
+def _by_price(listings, chain=None):
+    return sorted((l for l in listings if not chain or l["chain"] == chain),
+                  key=lambda l: (l["price"], l["token_id"]))
+
+
+def test_built_indexes_match_a_full_sort(listings):
+    store = ListingStore()
+    page, total = store.query(limit=600)
+    assert total == 500 and page == _by_price(listings)
+    page, _ = store.query(chain="Polygon", min_price=10, max_price=20, limit=600)
+    assert page == [l for l in _by_price(listings, "Polygon") if 10 <= l["price"] <= 20]
+    assert store.query(sort="oldest", limit=600)[0] == listings
+
+
+def test_remove_keeps_every_order(listings):
+    store = ListingStore()
+    gone = {l["token_id"] for l in listings[::7]}
+    for token_id in sorted(gone, reverse=True):
+        assert store.remove(token_id)["token_id"] == token_id
+    assert store.remove("t0000") is None
+
+    left = [l for l in listings if l["token_id"] not in gone]
+    assert store.query(sort="oldest", limit=600)[0] == left
+    assert store.query(sort="newest", limit=600)[0] == left[::-1]
+    assert store.query(limit=600)[0] == _by_price(left)
+    assert ListingStore().all() == left  # and so does the saved file
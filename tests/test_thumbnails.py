@@ -0,0 +1,73 @@
+import os
+import time
+
+import pytest
+
+import thumbnails
+
+Image = pytest.importorskip("PIL.Image")
+
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    """A fresh thumbnail cache in tmp_path and a factory for source images under its asset directory."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(thumbnails, "_config", dict(thumbnails.DEFAULTS))
+    monkeypatch.setattr(thumbnails, "_bytes", None)
+    monkeypatch.setattr(thumbnails, "_failed", {})
+    os.makedirs(thumbnails.ASSET_DIR)
+
+    def make(name, directory=thumbnails.ASSET_DIR):
+        path = os.path.join(directory, f"{name}.png")
+        Image.new("RGB", (64, 64), "teal").save(path)
+        return path
+    return make
+
+
+def test_worker_survives_a_crashing_image(images, monkeypatch):
+    good = images("good")
+    generate = thumbnails.generate
+
+    def flaky(asset_id, image_url):
+        if asset_id == "bomb":
+            raise Image.DecompressionBombError("too many pixels")
+        return generate(asset_id, image_url)
+    monkeypatch.setattr(thumbnails, "generate", flaky)
+
+    thumbnails.prefetch("bomb", images("bomb"))
+    thumbnails.prefetch("good", good)
+    deadline = time.time() + 5
+    while thumbnails._pending and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert thumbnails._worker.is_alive()
+    assert thumbnails._key("bomb", images("bomb")) in thumbnails._failed
+    assert thumbnails.image_for({"asset_id": "good", "image_url": good}) != good
+
+
+def test_generating_many_scans_the_directory_once(images, monkeypatch):
+    scans = []
+    entries = thumbnails._entries
+    monkeypatch.setattr(thumbnails, "_entries", lambda: scans.append(1) or entries())
+
+    for i in range(20):
+        assert thumbnails.generate(f"a{i}", images(f"a{i}")) is not None
+    assert len(scans) == 1
+
+    # Over budget: the next thumbnail trims back under the low-water mark
+    thumbnails._config["max_mb"] = thumbnails._bytes * 1.01 / 1024 / 1024
+    thumbnails.generate("a20", images("a20"))
+    assert len(scans) == 2
+    assert thumbnails._bytes <= thumbnails._max_bytes() * thumbnails.LOW_WATER
+    assert thumbnails._bytes == sum(size for _, size, _ in entries())
+
+
+def test_local_sources_must_be_under_the_asset_directory(images, tmp_path):
+    outside = images("outside", directory=str(tmp_path))
+    os.symlink(os.path.abspath(outside), os.path.join(thumbnails.ASSET_DIR, "link.png"))
+
+    for image_url in (outside, f"{thumbnails.ASSET_DIR}/../outside.png", "file://" + os.path.abspath(outside),
+                      os.path.join(thumbnails.ASSET_DIR, "link.png")):
+        assert thumbnails.generate("x", image_url) is None
+        assert thumbnails._key("x", image_url) in thumbnails._failed
+    assert thumbnails.generate("ok", images("ok")) is not None
@@ -0,0 +1,237 @@
+# thumbnails.py
+"""
+Pre-sized NFT thumbnails, served by app.py in place of the full images.
+
+A thumbnail is keyed by the catalog asset_id and its image_url, made once
+(fetched, shrunk to fit SIZE x SIZE and saved as JPEG) and kept under
+data/thumbnails. The directory is bounded by max_mb in config.yaml and
+trimmed least recently used first; a served thumbnail's mtime is its
+last use.
+
+Images are fetched on a background thread, so a page that asks for a
+thumbnail that is not ready yet shows the original URL for that rerun.
+mint_nft queues the new token's thumbnail right away. Pillow is
+optional; without it every image is served from its original URL.
+
+Sources are fetched only from http(s) URLs or files under data/assets,
+since image_url comes from NFT records rather than from this server.
+
+    python thumbnails.py warm     # make a thumbnail for every catalog asset
+    python thumbnails.py stats
+"""
+import hashlib
+import io
+import os
+import queue
+import threading
+import time
+import urllib.request
+from urllib.parse import urlparse
+
+try:
+    from PIL import Image
+except ImportError:  # optional; thumbnails are disabled without it
+    Image = None
+
+from storage import load_config
+
+THUMBNAIL_DIR = "data/thumbnails"
+ASSET_DIR = "data/assets"  # the only local files an image_url may name
+DEFAULTS = {"enabled": True, "size": 400, "max_mb": 200}
+FETCH_TIMEOUT = 10      # seconds per source image
+RETRY_AFTER = 600       # seconds before a failed image is tried again
+TOUCH_EVERY = 60        # seconds between mtime bumps of a served thumbnail
+LOW_WATER = 0.9         # trim to this fraction of max_mb
+
+_config = None
+_lock = threading.Lock()
+_queue = queue.Queue()
+_pending = set()        # keys queued or being made
+_failed = {}            # key -> time of the last failed attempt
+_worker = None
+_bytes = None           # size of THUMBNAIL_DIR as of the last scan plus what this process wrote since
+
+
+def _settings():
+    global _config
+    if _config is None:
+        _config = {**DEFAULTS, **(load_config().get("thumbnails") or {})}
+    return _config
+
+def enabled():
+    return Image is not None and bool(_settings()["enabled"])
+
+
+def _key(asset_id, image_url):
+    digest = hashlib.sha1(image_url.encode()).hexdigest()[:16]
+    return f"{asset_id}-{digest}" if asset_id else digest
+
+def thumbnail_path(asset_id, image_url):
+    return os.path.join(THUMBNAIL_DIR, _key(asset_id, image_url) + ".jpg")
+
+
+# ---------- Making thumbnails ----------
+def _fetch(image_url):
+    if urlparse(image_url).scheme in ("http", "https"):
+        request = urllib.request.Request(image_url, headers={"User-Agent": "crossmobi-thumbnails"})
+        with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+            return response.read()
+    root = os.path.realpath(ASSET_DIR)
+    path = os.path.realpath(image_url)  # resolves ".." and symlinks before the check
+    if urlparse(image_url).scheme or os.path.commonpath([root, path]) != root:
+        raise ValueError(f"not an http(s) URL or a file under {ASSET_DIR}: {image_url}")
+    with open(path, "rb") as f:
+        return f.read()
+
+def generate(asset_id, image_url):
+    """Make the thumbnail now; its path, or None if the image could not be fetched or read."""
+    path = thumbnail_path(asset_id, image_url)
+    if os.path.exists(path):
+        return path
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(_fetch(image_url))) as image:
+            image.thumbnail((_settings()["size"],) * 2)
+            out = io.BytesIO()
+            image.convert("RGB").save(out, "JPEG", quality=85, optimize=True)
+    except Exception:  # network and HTTP errors, missing files, undecodable or oversized images
+        _mark_failed(asset_id, image_url)
+        return None
+
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(out.getvalue())
+    os.replace(tmp_path, path)
+    _grow(len(out.getvalue()))
+    return path
+
+def _mark_failed(asset_id, image_url):
+    with _lock:
+        _failed[_key(asset_id, image_url)] = time.time()
+
+
+def _work():
+    while True:
+        asset_id, image_url = _queue.get()
+        try:
+            generate(asset_id, image_url)
+        except Exception:  # e.g. a full disk; one bad image must not stop the worker
+            _mark_failed(asset_id, image_url)
+        finally:
+            with _lock:
+                _pending.discard(_key(asset_id, image_url))
+
+def prefetch(asset_id, image_url):
+    """Queue a thumbnail to be made in the background, unless it exists or is already queued."""
+    global _worker
+    if not (enabled() and image_url):
+        return
+    key = _key(asset_id, image_url)
+    if os.path.exists(thumbnail_path(asset_id, image_url)):
+        return
+    with _lock:
+        if key in _pending or time.time() - _failed.get(key, 0) < RETRY_AFTER:
+            return
+        _pending.add(key)
+        if _worker is None:
+            # A daemon, so a process exiting with images still queued does not wait for the network
+            _worker = threading.Thread(target=_work, name="thumbnails", daemon=True)
+            _worker.start()
+    _queue.put((asset_id, image_url))
+
+
+# ---------- Serving ----------
+def image_for(nft):
+    """What to pass to st.image for an NFT: its thumbnail if made, else the original URL."""
+    image_url = nft.get("image_url")
+    if not (enabled() and image_url):
+        return image_url
+    path = thumbnail_path(nft.get("asset_id"), image_url)
+    try:
+        last_used = os.stat(path).st_mtime
+    except FileNotFoundError:
+        prefetch(nft.get("asset_id"), image_url)
+        return image_url
+    if time.time() - last_used > TOUCH_EVERY:
+        try:
+            os.utime(path)
+        except FileNotFoundError:  # evicted by another process just now
+            return image_url
+    return path
+
+
+# ---------- Eviction ----------
+def _entries():
+    try:
+        with os.scandir(THUMBNAIL_DIR) as it:
+            stats = [(e.stat(), e.path) for e in it if e.name.endswith(".jpg")]
+    except FileNotFoundError:
+        return []
+    return [(st.st_mtime, st.st_size, path) for st, path in stats]
+
+def _max_bytes():
+    return _settings()["max_mb"] * 1024 * 1024
+
+def _grow(size):
+    """
+    Count a new thumbnail against the budget and trim once it is exceeded,
+    so the directory is only scanned when eviction may be due (and once on
+    first use), not after every image.
+    """
+    global _bytes
+    with _lock:
+        if _bytes is not None:
+            _bytes += size
+            if _bytes <= _max_bytes():
+                return
+    trim()
+
+def trim(max_bytes=None):
+    """Delete least recently used thumbnails until the cache is under its budget; returns how many."""
+    global _bytes
+    if max_bytes is None:
+        max_bytes = _max_bytes()
+    entries = _entries()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    if total > max_bytes:
+        for _, size, path in sorted(entries):
+            if total <= max_bytes * LOW_WATER:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+    with _lock:
+        _bytes = total  # rescanned, so other processes' thumbnails are counted again
+    return removed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the NFT thumbnail cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("warm", help="make a thumbnail for every catalog asset")
+    sub.add_parser("stats", help="size of the cache")
+    sub.add_parser("trim", help="evict down to the configured budget now")
+    args = parser.parse_args()
+
+    if args.command == "warm":
+        if Image is None:
+            raise SystemExit("Pillow is not installed (pip install Pillow)")
+        from nfts import load_catalog
+
+        assets = load_catalog()
+        made = sum(generate(a["asset_id"], a["image_url"]) is not None for a in assets)
+        print(f"{made} of {len(assets)} catalog thumbnails ready in {THUMBNAIL_DIR}/")
+    elif args.command == "stats":
+        entries = _entries()
+        total = sum(size for _, size, _ in entries)
+        print(f"{len(entries)} thumbnails, {total / 1024 / 1024:.1f} of {_settings()['max_mb']} MB")
+    else:
+        print(f"Removed {trim()} thumbnails")
@@ -1,22 +1,53 @@
 # transactions.py
 
-import json
 import os
-from datetime import datetime
 
-def get_tx_file(user_id):
-    return f"data/users/{user_id}/transactions.json"
+from instrument import instrumented
+from storage import get_backend, get_tx_file, JsonBackend, TransactionLog
 
+@instrumented("load_transactions")
 def load_transactions(user_id):
-    path = get_tx_file(user_id)
-    if not os.path.exists(path):
-        return []
-    with open(path, "r") as f:
-        return json.load(f)
+    return list(iter_transactions(user_id))
 
+def iter_transactions(user_id, start=0):
+    """Stream a user's transactions, oldest first, from the start-th on."""
+    return get_backend().iter_transactions(user_id, start)
+
+@instrumented("load_wallet_transactions")
+def load_wallet_transactions(user_id, address, limit=25, before=None):
+    """
+    The newest `limit` transactions of one wallet, newest first, plus the
+    cursor to pass as `before` for the next older page (None at the end).
+    Reads only the requested records rather than the whole history.
+    """
+    return get_backend().wallet_transactions(user_id, address, limit, before)
+
+@instrumented("save_transaction")
 def save_transaction(user_id, tx):
-    txs = load_transactions(user_id)
-    txs.append(tx)
-    with open(get_tx_file(user_id), "w") as f:
-        json.dump(txs, f, indent=2)
+    get_backend().append_transactions(user_id, [tx])
+
+@instrumented("save_transactions")
+def save_transactions(user_id, txs):
+    """Append several records for one user in a single write."""
+    if txs:
+        get_backend().append_transactions(user_id, list(txs))
+
+def migrate_all():
+    """Move every legacy transactions.json into the segmented JSON log."""
+    migrated = []
+    for user_id in JsonBackend().list_users():
+        log = TransactionLog(user_id)
+        if not os.path.exists(log.manifest_path) and os.path.exists(get_tx_file(user_id)):
+            log.migrate_legacy()
+            migrated.append(user_id)
+    return migrated
+
+
+if __name__ == "__main__":
+    import sys
 
+    if sys.argv[1:] == ["migrate"]:
+        for user_id in migrate_all():
+            print(f"Migrated {user_id}")
+    else:
+        print("usage: python transactions.py migrate")
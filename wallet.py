@@ -1,12 +1,14 @@
 # wallet.py
 
 from web3 import Account
-import json
 import os
-import glob
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-def get_wallet_file(user_id):
-    return f"data/users/{user_id}/wallets.json"
+from cache import cached, invalidate
+from instrument import instrumented
+from locks import user_locks
+from storage import get_backend, get_wallet_file
 
 def ensure_user_dir(user_id):
     path = os.path.dirname(get_wallet_file(user_id))
@@ -14,38 +16,56 @@ def ensure_user_dir(user_id):
 
 # ----------- User Utilities -----------
 
+@instrumented("list_users")
+@cached("list_users", stamp=lambda: get_backend().version("users"))
 def list_users():
-    """Return all user IDs based on subdirectories in /data/users/"""
-    user_root = "data/users"
-    if not os.path.exists(user_root):
-        return []
-    return sorted([name for name in os.listdir(user_root) if os.path.isdir(os.path.join(user_root, name))])
+    """Return all user IDs known to the storage backend"""
+    return get_backend().list_users()
 
 # ----------- Wallet Operations -----------
 
+def _invalidate_wallet_views(user_id):
+    invalidate("get_wallets", user_id=user_id)
+    invalidate("address_directory")
+    invalidate("load_all_wallets")
+
+def _update_directory(user_id, wallets=(), removals=()):
+    if not wallets and not removals:
+        return
+    get_backend().update_address_directory(
+        {w["address"]: {"user_id": user_id, "nickname": w.get("nickname", "")} for w in wallets},
+        removals
+    )
+
+@instrumented("get_address_directory")
+@cached("address_directory", stamp=lambda: get_backend().version("address_directory"))
+def get_address_directory():
+    """{address: {"user_id", "nickname"}} for every wallet of every user"""
+    return get_backend().load_address_directory()
+
+def lookup_address(address):
+    """Owner entry for one address, or None"""
+    return get_address_directory().get(address)
+
+@instrumented("load_all_wallets")
+@cached("load_all_wallets", stamp=lambda: get_backend().version("address_directory"))
 def load_all_wallets():
-    """Load all wallets from all user folders"""
-    all_wallets = []
-    user_root = "data/users"
-    if not os.path.exists(user_root):
-        return []
-
-    for user_id in os.listdir(user_root):
-        wallet_file = os.path.join(user_root, user_id, "wallets.json")
-        if not os.path.exists(wallet_file):
-            continue
-        with open(wallet_file, "r") as f:
-            try:
-                wallets = json.load(f)
-                for w in wallets:
-                    all_wallets.append({
-                        "user_id": user_id,
-                        "address": w["address"],
-                        "nickname": w.get("nickname", "")
-                    })
-            except json.JSONDecodeError:
-                pass  # Could add logging here
-    return all_wallets
+    """All wallets of all users, read from the address directory"""
+    return [
+        {"user_id": entry["user_id"], "address": address, "nickname": entry["nickname"]}
+        for address, entry in get_address_directory().items()
+    ]
+
+def rebuild_address_directory():
+    directory = get_backend().rebuild_address_directory()
+    invalidate("address_directory")
+    invalidate("load_all_wallets")
+    return directory
+
+def register_user_wallets(user_id):
+    """Make sure every wallet user_id already has is in the address directory"""
+    _update_directory(user_id, get_backend().load_wallets(user_id))
+    _invalidate_wallet_views(user_id)
 
 def create_wallet(user_id, nickname=None):
     acct = Account.create()
@@ -57,25 +77,67 @@ def create_wallet(user_id, nickname=None):
     save_wallet(user_id, wallet)
     return wallet
 
-def save_wallet(user_id, wallet):
-    wallet_file = get_wallet_file(user_id)
-    if not os.path.exists(wallet_file):
-        with open(wallet_file, 'w') as f:
-            json.dump([wallet], f, indent=2)
+def _generate_keys(count):
+    """Create count accounts; runs inside pool workers"""
+    keys = []
+    for _ in range(count):
+        acct = Account.create()
+        keys.append((acct.address, acct.key.hex()))
+    return keys
+
+def create_wallets(user_id, count, nickname_prefix=None, workers=None):
+    """
+    Create count wallets for user_id with key generation spread over a
+    process pool, then store them all in a single update.
+    Wallets are nicknamed "<nickname_prefix> <n>" when a prefix is given.
+    Returns (wallets, keys_per_second).
+    """
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+
+    if workers == 1 or count < workers:
+        keys = _generate_keys(count)
     else:
-        with open(wallet_file, 'r+') as f:
-            data = json.load(f)
-            data.append(wallet)
-            f.seek(0)
-            json.dump(data, f, indent=2)
-            f.truncate()
+        # A few chunks per worker keeps the pool busy without much IPC
+        chunks = workers * 4
+        sizes = [count // chunks + (1 if i < count % chunks else 0) for i in range(chunks)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            keys = [key for batch in pool.map(_generate_keys, sizes) for key in batch]
 
+    elapsed = time.perf_counter() - started
+    new_wallets = [
+        {
+            "address": address,
+            "private_key": private_key,
+            "nickname": f"{nickname_prefix} {i + 1}" if nickname_prefix else ""
+        }
+        for i, (address, private_key) in enumerate(keys)
+    ]
+
+    backend = get_backend()
+    with user_locks("wallets", user_id):
+        wallets = backend.load_wallets(user_id)
+        wallets.extend(new_wallets)
+        backend.save_wallets(user_id, wallets)
+    _update_directory(user_id, new_wallets)
+    _invalidate_wallet_views(user_id)
+
+    return new_wallets, (count / elapsed if elapsed else float("inf"))
+
+@instrumented("save_wallet")
+def save_wallet(user_id, wallet):
+    backend = get_backend()
+    with user_locks("wallets", user_id):
+        wallets = backend.load_wallets(user_id)
+        wallets.append(wallet)
+        backend.save_wallets(user_id, wallets)
+    _update_directory(user_id, [wallet])
+    _invalidate_wallet_views(user_id)
+
+@instrumented("get_wallets")
+@cached("get_wallets", stamp=lambda user_id: get_backend().version("wallets", user_id))
 def get_wallets(user_id):
-    wallet_file = get_wallet_file(user_id)
-    if not os.path.exists(wallet_file):
-        return []
-    with open(wallet_file, 'r') as f:
-        wallets = json.load(f)
+    wallets = get_backend().load_wallets(user_id)
     # Ensure backward compatibility
     for wallet in wallets:
         if 'nickname' not in wallet:
@@ -83,27 +145,37 @@ def get_wallets(user_id):
     return wallets
 
 def update_wallet_nickname(user_id, address, new_nickname):
-    wallet_file = get_wallet_file(user_id)
-    if not os.path.exists(wallet_file):
-        return
-    with open(wallet_file, 'r+') as f:
-        wallets = json.load(f)
+    backend = get_backend()
+    with user_locks("wallets", user_id):
+        wallets = backend.load_wallets(user_id)
+        if not wallets:
+            return
+        renamed = []
         for wallet in wallets:
             if wallet['address'] == address:
                 wallet['nickname'] = new_nickname
+                renamed.append(wallet)
                 break
-        f.seek(0)
-        json.dump(wallets, f, indent=2)
-        f.truncate()
+        backend.save_wallets(user_id, wallets)
+    _update_directory(user_id, renamed)
+    _invalidate_wallet_views(user_id)
 
 def delete_wallet(user_id, address):
-    wallet_file = get_wallet_file(user_id)
-    if not os.path.exists(wallet_file):
-        return
-    with open(wallet_file, 'r+') as f:
-        wallets = json.load(f)
+    backend = get_backend()
+    with user_locks("wallets", user_id):
+        wallets = backend.load_wallets(user_id)
+        if not wallets:
+            return
         wallets = [w for w in wallets if w['address'] != address]
-        f.seek(0)
-        json.dump(wallets, f, indent=2)
-        f.truncate()
+        backend.save_wallets(user_id, wallets)
+    _update_directory(user_id, removals=[address])
+    _invalidate_wallet_views(user_id)
+
 
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] == ["rebuild-directory"]:
+        print(f"Indexed {len(rebuild_address_directory())} addresses")
+    else:
+        print("usage: python wallet.py rebuild-directory")